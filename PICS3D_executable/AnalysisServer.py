@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load one or more reference ranges once, keep them in memory, and answer analysis requests over local HTTP
+# (or a Unix socket) - PICS-normalizing a submitted scan and scoring it against a range - without paying process startup costs each time.
+#
+# Requests:
+#   GET  /ranges   - list the loaded ranges.
+#   POST /analyze  - JSON body with either "mrml" (the name of an MRML file readable by the server) or "fiducials" (a dictionary of
+#                    fiducial names to [x, y, z] coordinates, plus an optional "name"), an optional "range" name (default: the first range),
+#                    and an optional "figure": true to get back a base64-encoded PNG of the normalized scan.
+
+# Generic custom imports
+import __init__
+import json
+import base64
+from os import path, remove
+from collections import OrderedDict
+from threading import Lock
+from multiprocessing import Pool
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.VaginalProperties import VaginalProperties, load_vaginal_properties
+from PICS3D_libraries.VaginalDisplay import VaginalDisplay
+from PICS3D_libraries.PICSMath import pics_correct_and_verify, get_missing_reference_points
+from PICS3D_libraries.Export import get_scan_result_rows, SCAN_RESULT_COLUMNS
+from ComputeStatistics import get_range_statistics, get_range_measure_matrices, get_cohort_arrays_from_properties
+from ComputeStatistics import collate_fiducials_for_scan, is_saved_range_filename
+from CompareToRange import score_cohort_against_range, RANGE_SCORE_COLUMNS
+from PelvicPoints import create_pelvic_points_graph
+
+# Constants
+from Options import SERVER_ADDRESS, SERVER_PORT, SERVER_SOCKET, SERVER_PROCESSES, COLOR_STRAT
+
+def _check_reference_points(name, fid_points):
+    ''' Raise a ValueError naming the PICS reference points missing from a dictionary of fiducial points, if any are. '''
+
+    missing = get_missing_reference_points(fid_points)
+    if (len(missing) > 0): raise ValueError("Error: Cannot PICS-correct " + name + " without its reference points - missing " + ", ".join(missing))
+
+def _load_and_correct_mrml_worker(filename):
+    ''' Process pool helper - load a single MRML file and run it through PICS standardization.  Unlike the batch workers, which leave
+    out a scan that can't be corrected, this raises a ValueError naming any missing reference points for the client to see. '''
+
+    vag_props = load_vaginal_properties([filename])[0]
+
+    _check_reference_points(filename, vag_props._fiducial_points)
+    pics_correct_and_verify(vag_props)
+
+    return vag_props
+
+def _correct_coordinates_worker(arguments):
+    ''' Process pool helper - build a set of vaginal properties from submitted coordinates and run it through PICS standardization. '''
+
+    [name, coordinates] = arguments
+
+    _check_reference_points(name, coordinates)
+
+    vag_props = VaginalProperties(name)
+    vag_props.initialize_from_coordinates(coordinates)
+    pics_correct_and_verify(vag_props)
+
+    return vag_props
+
+def _json_value(value):
+    ''' Convert a table value into something JSON can hold, with missing values (None or NaN) as null. '''
+
+    if (value == None): return None
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value): return None
+        return float(value)
+    if isinstance(value, np.integer): return int(value)
+
+    return value
+
+def _rows_to_dicts(columns, rows):
+    return [OrderedDict(zip(columns, [_json_value(value) for value in row])) for row in rows]
+
+class AnalysisService(object):
+    ''' Holds warm reference ranges and a pool of worker processes, and answers analysis requests against them. '''
+
+    _ranges = None # OrderedDict of range name to [propstats, statscollection, range measure matrices]
+
+    def __init__(self, processes = SERVER_PROCESSES):
+        self._ranges = OrderedDict()
+        self._pool = Pool(processes)
+
+        # matplotlib is not thread-safe, so only one request draws a figure at a time.
+        self._figure_lock = Lock()
+
+    def add_range(self, name, filenames):
+        ''' Load (or compute) a range once, along with the measure matrices every request is scored against. '''
+
+        [propstats, statscollection, display] = get_range_statistics(name, filenames)
+        self._ranges[name] = [propstats, statscollection, get_range_measure_matrices(propstats, statscollection)]
+
+    def describe_ranges(self):
+        return [OrderedDict([["name", name], ["scans", len(self._ranges[name][0]._propslist)]]) for name in self._ranges]
+
+    def analyze(self, request):
+        ''' Answer one analysis request (see the top of this file), returning a dictionary ready to send back as JSON.
+        Raises ValueError for a request we cannot answer. '''
+
+        if (len(self._ranges) == 0): raise ValueError("No ranges are loaded.")
+
+        range_name = request.get("range", self._ranges.keys()[0])
+        if (range_name not in self._ranges): raise ValueError("Unknown range: " + str(range_name))
+
+        if ("mrml" in request):
+            vag_props = self._pool.apply(_load_and_correct_mrml_worker, (str(request["mrml"]),))
+        elif ("fiducials" in request):
+            vag_props = self._pool.apply(_correct_coordinates_worker, ([str(request.get("name", "Submitted fiducials")), request["fiducials"]],))
+        else:
+            raise ValueError("Need either 'mrml' or 'fiducials' in the request.")
+
+        [propstats, statscollection, range_measures] = self._ranges[range_name]
+
+        scores = score_cohort_against_range(get_cohort_arrays_from_properties([vag_props]), propstats, statscollection, range_measures)
+
+        response = OrderedDict()
+        response["scan"] = vag_props._name
+        response["range"] = range_name
+        response["fiducials"] = _rows_to_dicts(SCAN_RESULT_COLUMNS, get_scan_result_rows(vag_props, collate_fiducials_for_scan(vag_props)))
+        response["widths"] = [_json_value(width) for width in vag_props._vagwidths]
+        response["scores"] = _rows_to_dicts(RANGE_SCORE_COLUMNS, scores)
+
+        if request.get("figure", False):
+            response["figure"] = self.render_figure(vag_props)
+
+        return response
+
+    def render_figure(self, vag_props):
+        ''' Draw a normalized scan as create_pelvic_points_graph would, returning it as a base64-encoded PNG. '''
+
+        display = VaginalDisplay(vag_props._name, COLOR_STRAT)
+        display._fiducial_points = vag_props._fiducial_points
+        display.compute_properties()
+
+        with self._figure_lock:
+            graph = create_pelvic_points_graph(None, display, vag_props._name)
+
+            buf = StringIO()
+            graph._fig.savefig(buf, format='png')
+            plt.close(graph._fig)
+
+        return base64.b64encode(buf.getvalue())
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    ''' Routes HTTP requests to the server's AnalysisService. '''
+
+    def address_string(self):
+        # Unix socket clients have no address to look up.
+        if (not self.client_address): return "local"
+        return BaseHTTPRequestHandler.address_string(self)
+
+    def log_message(self, format, *args):
+        debugprint(self.address_string() + " - " + (format % args), debug_levels.BASIC_DEBUG)
+
+    def send_json(self, code, value):
+        body = json.dumps(value)
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if (self.path == "/ranges"):
+            self.send_json(200, self.server.service.describe_ranges())
+        else:
+            self.send_json(404, {"error": "Unknown path " + self.path})
+
+    def do_POST(self):
+        if (self.path != "/analyze"):
+            self.send_json(404, {"error": "Unknown path " + self.path})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            if not isinstance(request, dict): raise ValueError("The request must be a JSON object.")
+
+            self.send_json(200, self.server.service.analyze(request))
+        except Exception as error:
+            debugprint("ERROR: Could not answer request: " + str(error), debug_levels.ERRORS)
+            self.send_json(400, {"error": str(error)})
+
+class ThreadingAnalysisServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixAnalysisServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def create_server(service, socket_name = SERVER_SOCKET, address = SERVER_ADDRESS, port = SERVER_PORT):
+    ''' Create a server answering requests with service, listening on the Unix socket socket_name if given, or on address:port if not. '''
+
+    if (socket_name != None):
+        if path.exists(socket_name): remove(socket_name)
+        server = ThreadingUnixAnalysisServer(socket_name, AnalysisRequestHandler)
+    else:
+        server = ThreadingAnalysisServer((address, port), AnalysisRequestHandler)
+
+    server.service = service
+
+    return server
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    ARGUMENT_LIST_SEPARATOR = ':'
+
+    if (len(argv) < 2):
+        print("Need to supply one or more reference ranges, separated by ':'.  Each range is a saved range, or mrml files, directories or manifests.")
+        print("E.g. AnalysisServer.py normals.pics3drange : /data/prolapse")
+        exit()
+
+    # Split the arguments into ranges at each separator.
+    range_arguments = [[]]
+    for argument in argv[1:]:
+        if (argument == ARGUMENT_LIST_SEPARATOR):
+            range_arguments.append([])
+        else:
+            range_arguments[-1].append(argument)
+
+    service = AnalysisService()
+
+    for rangeindex in range(len(range_arguments)):
+        arguments = range_arguments[rangeindex]
+        if (len(arguments) == 0): continue
+
+        # Name saved ranges and directories after themselves, and anything else by its position.
+        name = "Range " + str(rangeindex + 1)
+        if ((len(arguments) == 1) and (is_saved_range_filename(arguments[0]) or path.isdir(arguments[0]))):
+            name = path.splitext(path.basename(path.normpath(arguments[0])))[0]
+
+        service.add_range(name, expand_input_arguments(arguments))
+        print("Loaded range " + name + " of " + str(len(service._ranges[name][0]._propslist)) + " scans")
+
+    server = create_server(service)
+
+    if (SERVER_SOCKET != None):
+        print("Listening on Unix socket " + SERVER_SOCKET + ".  Press Ctrl-C to stop.")
+    else:
+        print("Listening on http://" + SERVER_ADDRESS + ":" + str(SERVER_PORT) + "/.  Press Ctrl-C to stop.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving")
+    finally:
+        server.server_close()
+        service.close()
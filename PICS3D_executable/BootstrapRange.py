@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments and normalize them to the PICS system,
+# then bootstrap confidence intervals for the cohort mean of every fiducial position, paravaginal gap, and row width.
+# Given a second set of fiducials after a ':', also permutation-test each mean against the second set.
+
+# Generic custom imports
+import __init__
+import csv
+import numpy as np
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties
+from ComputeStatistics import PARAVAGINAL_GAP_MEASURE, WIDTH_MEASURE
+from PICS3D_libraries.CohortArrays import GAP_COMPONENTS
+from PICS3D_libraries.Options import COORDS
+from PICS3D_libraries.Resampling import bootstrap_confidence_intervals
+from PICS3D_libraries.StatMath import permutation_tests
+
+# Resampling options
+from Options import BATCH_PROCESSES, COMPARISON_RESAMPLES, COMPARISON_SEED
+from Options import BOOTSTRAP_RESAMPLES, BOOTSTRAP_CONFIDENCE, BOOTSTRAP_FILENAME
+
+# Measure names for each axis of the fiducial positions
+POSITION_MEASURES = ["Position X", "Position Y", "Position Z"]
+
+# Column headings for the table written by write_bootstrap_statistics
+BOOTSTRAP_COLUMNS = ["Measure", "Key", "Count", "Mean", "CI Lower", "CI Upper"]
+GROUP_COMPARISON_COLUMNS = ["Group 2 Count", "Group 2 Mean", "Group 2 CI Lower", "Group 2 CI Upper", "Mean Difference", "Permutation p"]
+
+def get_cohort_measure_arrays(cohort, fid_names, row_count):
+    ''' Split a CohortArrays into an ordered list of [measure, keys, N x K values] entries, with the fiducial measures aligned to
+        fid_names and the widths padded with NaN out to row_count rows, so that two cohorts line up column for column. '''
+
+    coords = cohort.align_to(fid_names, cohort._coords)
+    gaps = cohort.align_to(fid_names, cohort._gaps[:, :, GAP_COMPONENTS.TOTAL])
+
+    widths = np.empty((cohort.get_scan_count(), row_count))
+    widths.fill(np.nan)
+    widths[:, 0:cohort._widths.shape[1]] = cohort._widths
+
+    row_keys = ["Row " + str(rowindex + 1) for rowindex in range(row_count)]
+
+    measures = []
+    for axis in [COORDS.X, COORDS.Y, COORDS.Z]:
+        measures.append([POSITION_MEASURES[axis], fid_names, coords[:, :, axis]])
+    measures.append([PARAVAGINAL_GAP_MEASURE, fid_names, gaps])
+    measures.append([WIDTH_MEASURE, row_keys, widths])
+
+    return measures
+
+def _describe_values(values, resamples, seed, processes):
+    ''' Return [counts, means, ci_lowers, ci_uppers] for each column of an N x K array of values. '''
+
+    counts = (~np.isnan(values)).sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(values, axis=0) / counts
+
+    [lower, upper] = bootstrap_confidence_intervals(values, resamples, BOOTSTRAP_CONFIDENCE, seed, processes)
+
+    return [counts, means, lower, upper]
+
+def bootstrap_cohorts(cohort1, cohort2 = None, resamples = BOOTSTRAP_RESAMPLES, permutations = COMPARISON_RESAMPLES,
+                      seed = COMPARISON_SEED, processes = BATCH_PROCESSES):
+    ''' Bootstrap confidence intervals for every measure of cohort1 (and cohort2, if given), and permutation-test the difference
+        in means between the two.  Returns a list of table rows, one per measure and key. '''
+
+    fid_names = list(cohort1._fid_names)
+    row_count = cohort1._widths.shape[1]
+
+    if (cohort2 != None):
+        fid_names += [fidname for fidname in cohort2._fid_names if (cohort1.get_fid_index(fidname) == None)]
+        row_count = max(row_count, cohort2._widths.shape[1])
+
+    measures1 = get_cohort_measure_arrays(cohort1, fid_names, row_count)
+    measures2 = None
+    if (cohort2 != None):
+        measures2 = get_cohort_measure_arrays(cohort2, fid_names, row_count)
+
+    rows = []
+    column_offset = 0
+
+    for measureindex in range(len(measures1)):
+        [measure, keys, values1] = measures1[measureindex]
+
+        # Offset the seed per measure, and again for the second cohort, so that no two bootstraps draw the same resamples.
+        measure_seed = seed + 2 * measureindex
+
+        columns = [_describe_values(values1, resamples, measure_seed, processes)]
+
+        if (measures2 != None):
+            values2 = measures2[measureindex][2]
+            columns.append(_describe_values(values2, resamples, measure_seed + 1, processes))
+
+            # Offset each measure's permutation seeds so that no two columns in the table share a stream of shufflings.
+            p_values = permutation_tests(values1, values2, permutations, processes, seed + column_offset)
+            column_offset += len(keys)
+
+            columns.append([columns[0][1] - columns[1][1], p_values])
+
+        for keyindex in range(len(keys)):
+            row = [measure, keys[keyindex]]
+            for column in columns:
+                row += [value[keyindex] for value in column]
+            rows.append(row)
+
+    return rows
+
+def write_bootstrap_statistics(filename, rows, compare_groups):
+    ''' Write the rows generated by bootstrap_cohorts to filename as a CSV table. '''
+
+    columns = BOOTSTRAP_COLUMNS
+    if compare_groups: columns = columns + GROUP_COMPARISON_COLUMNS
+
+    with open(filename, 'wb') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    ARGUMENT_LIST_SEPARATOR = ':'
+
+    if ((len(argv) < 2) or (argv.count(ARGUMENT_LIST_SEPARATOR) > 1)):
+        print("Need to supply mrml file names as arguments, optionally followed by a ':' and a second group of mrml file names to compare against.")
+        print("E.g. BootstrapRange.py 101.mrml 102.mrml 103.mrml : 201.mrml 202.mrml 203.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    group1_filenames = argv[1:]
+    group2_filenames = None
+
+    if (ARGUMENT_LIST_SEPARATOR in argv):
+        separator_index = argv.index(ARGUMENT_LIST_SEPARATOR)
+        group1_filenames = argv[1:separator_index]
+        group2_filenames = argv[(separator_index + 1):]
+
+        if ((len(group1_filenames) == 0) or (len(group2_filenames) == 0)):
+            print("Need at least one mrml file on each side of the ':'")
+            exit()
+
+    cohort1 = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(group1_filenames))
+
+    cohort2 = None
+    if (group2_filenames != None):
+        cohort2 = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(group2_filenames))
+
+    rows = bootstrap_cohorts(cohort1, cohort2)
+    write_bootstrap_statistics(BOOTSTRAP_FILENAME, rows, (cohort2 != None))
+
+    print("Wrote bootstrap statistics for " + str(len(rows)) + " fiducials and rows to " + BOOTSTRAP_FILENAME)
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to keep a population atlas of the vaginal wall in PICS space.  Fiducials loaded from the MRML files given as
+# arguments are normalized to the PICS system, and their wall points are binned into a voxel grid added to the saved atlas (which is
+# created the first time).  Slices through the atlas - of the fraction of scans passing through each voxel, and the mean paravaginal gap
+# and row width there - are then saved as figures, without needing a display.
+
+# Generic custom imports
+import __init__
+from os import path, makedirs
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.Atlas import create_atlas, open_atlas, save_atlas, ATLAS_HEADER_FILENAME
+from ComputeStatistics import load_and_correct_vaginal_properties
+
+# Graph control imports
+from PICS3D_libraries.Graphing import PelvicGraph2D
+
+# Constants
+from PICS3D_libraries.Options import COORDS
+from Options import ATLAS_DIRECTORY, ATLAS_LOWER_CORNER, ATLAS_UPPER_CORNER, ATLAS_VOXEL_SIZE, ATLAS_ROW_POINTS
+from Options import ATLAS_SLICE_POINT, ATLAS_FIGURES_DIRECTORY
+
+AXIS_NAMES = ["X", "Y", "Z"]
+
+def update_atlas(directory, propslist, row_points = ATLAS_ROW_POINTS):
+    ''' Add a list of vaginal properties to the atlas saved in directory (creating it if there is none yet), save it, and return it. '''
+
+    if path.isfile(path.join(directory, ATLAS_HEADER_FILENAME)):
+        atlas = open_atlas(directory, writable = True)
+    else:
+        atlas = create_atlas(directory, ATLAS_LOWER_CORNER, ATLAS_UPPER_CORNER, ATLAS_VOXEL_SIZE)
+
+    atlas.add_scans(propslist, row_points)
+    save_atlas(directory, atlas)
+
+    return atlas
+
+def get_slice_point(atlas, probabilities, slice_point = ATLAS_SLICE_POINT):
+    ''' Return slice_point, or if it is None, the center of the voxel the most scans pass through. '''
+
+    if (slice_point != None): return np.asarray(slice_point, dtype=float)
+
+    densest = np.unravel_index(np.argmax(probabilities), probabilities.shape)
+    return atlas._lower + (np.array(densest) + 0.5) * atlas._voxel_size
+
+def save_slice_figure(atlas, volume, axis, slice_point, title, units, filename):
+    ''' Save a figure of the slice of an atlas volume across axis through slice_point.  Voxels without a value are left blank. '''
+
+    atlas_slice = atlas.get_slice(volume, axis, slice_point[axis])
+    if (atlas_slice == None):
+        print("Not drawing " + filename + ": " + AXIS_NAMES[axis] + " = " + str(slice_point[axis]) + " is outside the atlas.")
+        return
+
+    [values, axes, extents] = atlas_slice
+
+    graph = PelvicGraph2D(title + " at " + AXIS_NAMES[axis] + " = " + str(round(slice_point[axis], 1)) + " mm",
+                          AXIS_NAMES[axes[0]] + " (mm)", AXIS_NAMES[axes[1]] + " (mm)")
+
+    # imshow puts an image's rows down the y axis, so draw the slice's first axis across.
+    image = graph._ax.imshow(np.ma.masked_invalid(np.asarray(values, dtype=float)).T, origin='lower', interpolation='nearest',
+                             extent=extents[0] + extents[1], cmap=plt.cm.viridis)
+    graph._fig.colorbar(image, ax=graph._ax, label=units)
+
+    graph._fig.savefig(filename)
+    plt.close(graph._fig)
+
+def save_atlas_figures(atlas, directory, slice_point = ATLAS_SLICE_POINT):
+    ''' Save slices of an atlas' probabilities, mean paravaginal gaps and mean row widths, one across each axis, to directory. '''
+
+    if not path.isdir(directory): makedirs(directory)
+
+    probabilities = atlas.get_probabilities()
+    slice_point = get_slice_point(atlas, probabilities, slice_point)
+
+    # Leave the voxels that no scan passes through blank, rather than a probability of zero.
+    probabilities = np.where(probabilities > 0, probabilities, np.nan)
+
+    volumes = [["probability", "Fraction of scans", "Fraction of " + str(atlas.get_scan_count()) + " scans", probabilities],
+               ["gap", "Mean paravaginal gap", "mm", atlas.get_gap_statistics()[0]],
+               ["width", "Mean row width", "mm", atlas.get_width_statistics()[0]]]
+
+    for name, title, units, volume in volumes:
+        for axis in [COORDS.X, COORDS.Y, COORDS.Z]:
+            save_slice_figure(atlas, volume, axis, slice_point, title, units,
+                              path.join(directory, name + "_" + AXIS_NAMES[axis].lower() + "_slice.png"))
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if (len(argv) < 2) and not path.isfile(path.join(ATLAS_DIRECTORY, ATLAS_HEADER_FILENAME)):
+        print("There is no atlas at " + ATLAS_DIRECTORY + " yet - supply mrml file names to build it from.")
+        print("E.g. BuildAtlas.py 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    atlas = update_atlas(ATLAS_DIRECTORY, load_and_correct_vaginal_properties(argv[1:]))
+
+    print("Saved an atlas of " + str(atlas.get_scan_count()) + " scans to " + ATLAS_DIRECTORY)
+    if (atlas._outside_points > 0):
+        print("  (" + str(atlas._outside_points) + " of their points fell outside the atlas grid)")
+
+    save_atlas_figures(atlas, ATLAS_FIGURES_DIRECTORY)
+    print("Saved slices through the atlas to " + ATLAS_FIGURES_DIRECTORY)
@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments, normalize them to the PICS system,
+# compute the statistics of the range they form, and save that range so that the comparison programs can load it instead of recomputing it.
+
+# Generic custom imports
+import __init__
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from ComputeStatistics import get_range_statistics, save_range_statistics, is_saved_range_filename
+
+# Constants
+from Options import SAVED_RANGE_EXTENSION
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if ((len(argv) < 3) or not is_saved_range_filename(argv[1])):
+        print("Need to supply the name of the range file to create (ending in " + SAVED_RANGE_EXTENSION + "), followed by the mrml files in the range.")
+        print("E.g. BuildRange.py normals" + SAVED_RANGE_EXTENSION + " 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    [propstats, fidstats, display] = get_range_statistics("Range", argv[2:])
+
+    save_range_statistics(argv[1], propstats, fidstats, display)
+
+    print("Saved range of " + str(len(propstats._propslist)) + " scans to " + argv[1])
@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments and check each scan's PICS reference landmarks against
+# the rest of the set before any of them are normalized: scans missing a landmark, with degenerate landmarks, or whose landmark geometry
+# is far out of line with the others are listed, and every scan's landmark measurements are written to a table.
+
+# Generic custom imports
+import __init__
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.LandmarkQA import LANDMARK_FEATURES, check_landmarks
+from PICS3D_libraries.Export import open_table_writer, get_export_extension
+from ComputeStatistics import load_raw_vaginal_properties, DEFAULT_CONFIGURATION
+
+# Constants
+from Options import LANDMARK_QA_FILENAME, EXPORT_FORMAT
+
+# Column headings for the table of each scan's landmark QA results
+LANDMARK_QA_COLUMNS = (["Scan"] + LANDMARK_FEATURES + [feature + " Robust Z" for feature in LANDMARK_FEATURES]
+                       + ["Passed", "Problems"])
+
+def get_landmark_qa_rows(report):
+    ''' Build one table row for each scan of a LandmarkReport. '''
+
+    failed = report.get_failed()
+
+    return [[report._scan_names[scanindex]] + list(report._features[scanindex]) + list(report._z_scores[scanindex])
+            + [not failed[scanindex], "; ".join(report.get_problems(scanindex))]
+            for scanindex in range(report.get_scan_count())]
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if (len(argv) < 2):
+        print("Need to supply mrml file names as arguments.")
+        print("E.g. CheckLandmarks.py 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    report = check_landmarks(load_raw_vaginal_properties(argv[1:]), DEFAULT_CONFIGURATION)
+
+    failed_scans = report.get_failed_scans()
+    print(str(len(failed_scans)) + " of " + str(report.get_scan_count()) + " scans failed landmark QA:")
+    for scanindex in failed_scans:
+        print("  " + report._scan_names[scanindex] + ": " + "; ".join(report.get_problems(scanindex)))
+
+    writer = open_table_writer(LANDMARK_QA_FILENAME, LANDMARK_QA_COLUMNS, EXPORT_FORMAT)
+    writer.write_rows(get_landmark_qa_rows(report))
+    writer.close()
+
+    print("Wrote each scan's landmark QA results to " + LANDMARK_QA_FILENAME + get_export_extension(EXPORT_FORMAT))
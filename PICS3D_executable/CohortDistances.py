@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments, normalize them to the PICS system, and compute how far
+# apart every two scans' shapes lie - the root mean square distance between the fiducials they share - as the basis for clustering patients
+# and looking up the patients most like a given one.  The distances are saved as a condensed symmetric matrix, and each scan's nearest
+# neighbour is printed.
+
+# Generic custom imports
+import __init__
+from numpy import argmin, inf, isnan, where
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.CohortArrays import build_cohort_arrays
+from PICS3D_libraries.RowResampling import get_resampled_row_fiducials
+from PICS3D_libraries.ScanDistances import compute_scan_distances, save_scan_distances, get_scan_distances_to
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties
+
+# Constants
+from Options import SCAN_DISTANCE_FIDUCIALS, SCAN_DISTANCE_FIDUCIALS_OPTIONS, SCAN_DISTANCES_FILENAME, RESAMPLED_ROW_POINTS
+from Options import BATCH_PROCESSES
+
+def get_cohort_arrays_for_distances(propslist, fiducials = SCAN_DISTANCE_FIDUCIALS, point_count = RESAMPLED_ROW_POINTS):
+    ''' Stack a list of vaginal properties into a CohortArrays of the fiducials they are to be compared over. '''
+
+    if (fiducials == SCAN_DISTANCE_FIDUCIALS_OPTIONS.RESAMPLED_ROWS):
+        return build_cohort_arrays(propslist, get_resampled_row_fiducials(propslist, point_count))
+
+    return get_cohort_arrays_from_properties(propslist)
+
+def get_cohort_scan_distances(propslist, fiducials = SCAN_DISTANCE_FIDUCIALS, processes = BATCH_PROCESSES):
+    ''' Return [scan names, condensed distances] between every two of a list of vaginal properties. '''
+
+    cohort = get_cohort_arrays_for_distances(propslist, fiducials)
+    return [cohort._scan_names, compute_scan_distances(cohort._coords, processes = processes)]
+
+def print_nearest_scans(scan_names, condensed):
+    for scanindex in range(len(scan_names)):
+        distances = get_scan_distances_to(condensed, scanindex)
+
+        # Never match a scan to itself, or to a scan it shares no fiducials with.
+        distances[scanindex] = inf
+        distances = where(isnan(distances), inf, distances)
+
+        nearest = argmin(distances)
+        if (distances[nearest] == inf):
+            print(scan_names[scanindex] + ": no comparable scan")
+        else:
+            print(scan_names[scanindex] + ": nearest is " + scan_names[nearest] + " at " + str(distances[nearest]))
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if (len(argv) < 3):
+        print("Need to supply at least two mrml file names as arguments.")
+        print("E.g. CohortDistances.py 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    [scan_names, condensed] = get_cohort_scan_distances(load_and_correct_vaginal_properties(argv[1:]))
+
+    save_scan_distances(SCAN_DISTANCES_FILENAME, scan_names, condensed)
+    print("Saved the distances between " + str(len(scan_names)) + " scans to " + SCAN_DISTANCES_FILENAME)
+
+    print_nearest_scans(scan_names, condensed)
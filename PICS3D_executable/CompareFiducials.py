@@ -10,10 +10,17 @@ from PICS3D_libraries.PICSMath import pics_correct_and_verify
 from PICS3D_libraries.VaginalDisplay import load_vaginal_displays
 from PICS3D_libraries.Graphing import show_all_graphs, add_line_to_graph3D
 from PICS3D_libraries.Options import  COORDS
+from PICS3D_libraries.RowResampling import get_resampled_row_fiducials
+from PICS3D_libraries.SpatialIndex import match_nearest_points, get_match_statistics
 from PelvicPoints import create_pelvic_points_graph
 
 # Generic custom imports
+from numpy import array
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Constants
+from Options import FIDUCIAL_COMPARISON, FIDUCIAL_COMPARISON_OPTIONS, RESAMPLED_ROW_POINTS, NEAREST_SAME_ROW
 
 class FiducialDifference(object):
     _fiducial_point_one = None
@@ -90,6 +97,54 @@ def compare_fiducials(fids1, fids2):
         difference_list.append(FiducialDifference(fid1, fid2))
             
     return difference_list
+
+def compare_resampled_rows(vag_props1, vag_props2, point_count = RESAMPLED_ROW_POINTS):
+    ''' Given two sets of vaginal properties, resample every row of each to point_count points evenly spaced along it, and compile a list
+    of the differences between each pair of corresponding resampled points - the whole width of each row, not just its ends. '''
+
+    [resampled1, resampled2] = get_resampled_row_fiducials([vag_props1, vag_props2], point_count)
+
+    return [FiducialDifference(resampled1[fidname], resampled2[fidname]) for fidname in resampled1 if (fidname in resampled2)]
+
+def get_row_fiducial_points(vag_props):
+    ''' Return [fiducials, N x 3 array of their coordinates, N array of their row indices] for every fiducial in vag_props's rows. '''
+
+    fids = []
+    rows = []
+    for rowindex in range(len(vag_props._rows)):
+        for fid in vag_props._rows[rowindex]:
+            # Empty places in the grid hold [] rather than a Fiducial.
+            if fid:
+                fids.append(fid)
+                rows.append(rowindex)
+
+    return [fids, array([fid.coords[0:3] for fid in fids], dtype=float).reshape((-1, 3)), array(rows, dtype=int)]
+
+def compare_nearest_fiducials(vag_props1, vag_props2, same_row = NEAREST_SAME_ROW):
+    ''' Given two sets of vaginal properties, pair every row and column fiducial of vag_props2 with the nearest one of vag_props1 (of the same row,
+    if same_row is True), and compile a list of the differences between each pair.  Fiducials with nothing to pair with are left out. '''
+
+    [fids1, coords1, rows1] = get_row_fiducial_points(vag_props1)
+    [fids2, coords2, rows2] = get_row_fiducial_points(vag_props2)
+
+    if same_row:
+        matches = match_nearest_points(coords2, coords1, rows2, rows1)[0]
+    else:
+        matches = match_nearest_points(coords2, coords1)[0]
+
+    return [FiducialDifference(fids1[matches[fidindex]], fids2[fidindex]) for fidindex in range(len(fids2)) if (matches[fidindex] >= 0)]
+
+def get_nearest_fiducial_statistics(vag_props1, vag_props2, same_row = NEAREST_SAME_ROW):
+    ''' Return [mean, max, Hausdorff distance] between the row and column fiducials of two sets of vaginal properties - the mean and max distance
+    from each fiducial of vag_props2 to its nearest in vag_props1, and the largest such distance either way round. '''
+
+    [fids1, coords1, rows1] = get_row_fiducial_points(vag_props1)
+    [fids2, coords2, rows2] = get_row_fiducial_points(vag_props2)
+
+    if same_row:
+        return get_match_statistics(coords1, coords2, rows1, rows2)
+    else:
+        return get_match_statistics(coords1, coords2)
             
 
 def draw_differences(graph, difflist):
@@ -114,6 +169,9 @@ if __name__ == '__main__':
     from sys import argv
      
     setdebuglevel(debug_levels.DETAILED_DEBUG) 
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     if len(argv) <> 3: 
         print "Need to supply TWO mrml file names, and we will compare fiducials from the second to the first."
@@ -135,7 +193,15 @@ if __name__ == '__main__':
             pics_correct_and_verify(display)
             graph = create_pelvic_points_graph(graph, display, filename)
         
-        difflist = compare_fiducials(displays[0]._fiducial_points, displays[1]._fiducial_points)
+        if (FIDUCIAL_COMPARISON == FIDUCIAL_COMPARISON_OPTIONS.RESAMPLED_ROWS):
+            difflist = compare_resampled_rows(displays[0], displays[1])
+        elif (FIDUCIAL_COMPARISON == FIDUCIAL_COMPARISON_OPTIONS.NEAREST):
+            difflist = compare_nearest_fiducials(displays[0], displays[1])
+            [mean_distance, max_distance, hausdorff_distance] = get_nearest_fiducial_statistics(displays[0], displays[1])
+            print("Nearest fiducial distances: mean " + str(mean_distance) + ", max " + str(max_distance)
+                  + ", Hausdorff " + str(hausdorff_distance))
+        else:
+            difflist = compare_fiducials(displays[0]._fiducial_points, displays[1]._fiducial_points)
         draw_differences(graph, difflist)
                                               
         show_all_graphs()
\ No newline at end of file
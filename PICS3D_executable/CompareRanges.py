@@ -5,15 +5,22 @@
 
 # Generic custom imports 
 import __init__
+import csv
+import numpy as np
 import matplotlib.pyplot as plt
 
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # Domain specific custom imports
-from ComputeStatistics import load_vaginal_properties, get_stats_and_display_from_properties
+from ComputeStatistics import get_range_statistics, get_range_measure_matrices, DEFAULT_CONFIGURATION
 from Options import RANGE_ONE_COLOR, RANGE_TWO_COLOR
-from PICS3D_libraries.Options import AXIS_CODING_IS
-from PICS3D_libraries.PICSMath import pics_correct_and_verify
+from PICS3D_libraries.StatMath import column_means_and_sample_variances, hedges_g_effect_sizes, welch_t_tests, mann_whitney_u_tests
+from PICS3D_libraries.StatMath import permutation_tests, holm_corrected_p_values, benjamini_hochberg_corrected_p_values
+
+# Comparison statistics options
+from Options import BATCH_PROCESSES, COMPARISON_RESAMPLES, COMPARISON_SEED
+from Options import MULTIPLE_COMPARISON_OPTIONS, MULTIPLE_COMPARISON_CORRECTION, RANGE_COMPARISON_FILENAME
 
 # Graph control imports
 from PICS3D_libraries.Graphing import show_all_graphs, generate_magic_subplot_number, filter_vagprops_for_graphing
@@ -22,8 +29,97 @@ from PICS3D_libraries.GraphColoring import set_boxplot_colors
 from Options import COORDINATE_GRAPH_MIN_MM, COORDINATE_GRAPH_MAX_MM
 from Options import GRAPH_BACKGROUND_COLOR
 
-def create_2D_height_range_comparison_graph(graph, key_list, stats_collection_1, stats_collection_2):
-    ''' Add all fiducials in key_list to the graph. Plot their heights against each other.
+# Column headings for the table written by write_range_comparison
+RANGE_COMPARISON_COLUMNS = ["Measure", "Key", "Range 1 Count", "Range 1 Mean", "Range 2 Count", "Range 2 Mean",
+                            "Mean Difference", "Hedges g", "Welch t", "Welch DF", "Welch p", "Mann-Whitney U", "Mann-Whitney p",
+                            "Permutation p", "Corrected Welch p", "Corrected Mann-Whitney p", "Corrected Permutation p"]
+
+def align_range_values(keys, range_keys, range_values):
+    ''' Re-index the columns of range_values (named by range_keys) to match keys, filling any missing key with NaN. '''
+
+    aligned = np.empty((range_values.shape[0], len(keys)))
+    aligned.fill(np.nan)
+
+    range_key_index = dict(zip(range_keys, range(len(range_keys))))
+
+    for keyindex in range(len(keys)):
+        if (keys[keyindex] in range_key_index):
+            aligned[:, keyindex] = range_values[:, range_key_index[keys[keyindex]]]
+
+    return aligned
+
+def correct_p_values(p_values):
+    ''' Apply the configured multiple-comparison correction to a family of p-values. '''
+
+    if (MULTIPLE_COMPARISON_CORRECTION == MULTIPLE_COMPARISON_OPTIONS.BENJAMINI_HOCHBERG):
+        return benjamini_hochberg_corrected_p_values(p_values)
+
+    return holm_corrected_p_values(p_values)
+
+def compare_range_measures(range1stats, range1fidstats, range2stats, range2fidstats,
+                           resamples = COMPARISON_RESAMPLES, processes = BATCH_PROCESSES, configuration = DEFAULT_CONFIGURATION):
+    ''' Compare two ranges fiducial by fiducial (heights along configuration's inferior-superior axis, and paravaginal gaps) and row by
+        row (widths).
+        For every key, computes each range's mean, the difference and effect size, and Welch t, Mann-Whitney U and permutation tests,
+        then corrects each test's p-values for multiple comparisons across the whole table.
+        Returns one row per measure per key, in the format described by RANGE_COMPARISON_COLUMNS. '''
+
+    measures1 = get_range_measure_matrices(range1stats, range1fidstats, configuration)
+    measures2 = get_range_measure_matrices(range2stats, range2fidstats, configuration)
+
+    rows = []
+    column_offset = 0
+
+    for measure in measures1:
+        [keys1, values1] = measures1[measure]
+        [keys2, values2] = measures2[measure]
+
+        # Compare every key in range 1, plus any extra keys (e.g. extra rows) found only in range 2.
+        keys = keys1 + [key for key in keys2 if not (key in keys1)]
+        values1 = align_range_values(keys, keys1, values1)
+        values2 = align_range_values(keys, keys2, values2)
+
+        [means1, variances1, counts1] = column_means_and_sample_variances(values1)
+        [means2, variances2, counts2] = column_means_and_sample_variances(values2)
+
+        effect_sizes = hedges_g_effect_sizes(values1, values2)
+        [welch_t, welch_df, welch_p] = welch_t_tests(values1, values2)
+        [mann_whitney_u, mann_whitney_p] = mann_whitney_u_tests(values1, values2)
+
+        # Offset each measure's seeds so that no two columns in the table share a stream of shufflings.
+        permutation_p = permutation_tests(values1, values2, resamples, processes, COMPARISON_SEED + column_offset)
+        column_offset += len(keys)
+
+        for keyindex in range(len(keys)):
+            rows.append([measure, keys[keyindex],
+                         counts1[keyindex], means1[keyindex], counts2[keyindex], means2[keyindex],
+                         means1[keyindex] - means2[keyindex], effect_sizes[keyindex],
+                         welch_t[keyindex], welch_df[keyindex], welch_p[keyindex],
+                         mann_whitney_u[keyindex], mann_whitney_p[keyindex],
+                         permutation_p[keyindex]])
+
+    # Correct each test's p-values as one family across every measure and key.
+    for p_column in [RANGE_COMPARISON_COLUMNS.index("Welch p"),
+                     RANGE_COMPARISON_COLUMNS.index("Mann-Whitney p"),
+                     RANGE_COMPARISON_COLUMNS.index("Permutation p")]:
+
+        corrected = correct_p_values(np.array([row[p_column] for row in rows], dtype=float))
+
+        for rowindex in range(len(rows)):
+            rows[rowindex].append(corrected[rowindex])
+
+    return rows
+
+def write_range_comparison(filename, rows):
+    ''' Write the rows generated by compare_range_measures to filename as a CSV table. '''
+
+    with open(filename, 'wb') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(RANGE_COMPARISON_COLUMNS)
+        writer.writerows(rows)
+
+def create_2D_height_range_comparison_graph(graph, key_list, stats_collection_1, stats_collection_2, configuration = DEFAULT_CONFIGURATION):
+    ''' Add all fiducials in key_list to the graph. Plot their heights (along configuration's inferior-superior axis) against each other.
         Takes as input a graph to draw on, a list of all the fiducial names (keys) to draw,
         and two sets of statistics to compare, which are dictionaries of [key, FiducialStatistics] format.'''
 
@@ -43,10 +139,10 @@ def create_2D_height_range_comparison_graph(graph, key_list, stats_collection_1,
         stats2_z_list = []
         
         for stat in stats1._fid_collated_list:
-            stats1_height_list.append(stat.coords[AXIS_CODING_IS])
+            stats1_height_list.append(stat.coords[configuration._axis_coding_is])
             
         for stat in stats2._fid_collated_list:
-            stats2_z_list.append(stat.coords[AXIS_CODING_IS])
+            stats2_z_list.append(stat.coords[configuration._axis_coding_is])
         
         # print("xtick_index = " + str(xtick_index))
         bp = graph.boxplot([stats1_height_list, stats2_z_list], 
@@ -140,6 +236,9 @@ if __name__ == '__main__':
     from sys import argv
      
     setdebuglevel(debug_levels.ERRORS) 
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     ARGUMENT_LIST_SEPARATOR = ':'
     
@@ -154,17 +253,16 @@ if __name__ == '__main__':
     # Get the two argument lists of file names. 
     separator_index = argv.index(ARGUMENT_LIST_SEPARATOR)
 
-    # List of fiducial stats representing a single vagina, to be compared to the range. Ignore argv[0], as it's just the filename of this python file.
-    range1propslist = load_vaginal_properties(argv[1:separator_index])
-    for props in range1propslist:
-        pics_correct_and_verify(props)
-    [range1propstats, range1fidstats, range1propsdisplay] = get_stats_and_display_from_properties("Range 1", range1propslist)
+    # Fiducial stats for the first range.  Either side may be a list of MRML files or a single saved range.
+    # Ignore argv[0], as it's just the filename of this python file.
+    [range1propstats, range1fidstats, range1propsdisplay] = get_range_statistics("Range 1", argv[1:separator_index])
     
-    # List of fiducial stats representing a range to compare that single one against. 
-    range2propslist = load_vaginal_properties(argv[(separator_index + 1):])
-    for props in range2propslist:
-        pics_correct_and_verify(props)
-    [range2propstats, range2fidstats, range2propsdisplay] = get_stats_and_display_from_properties("Range 2", range2propslist)
+    # Fiducial stats for the second range, to compare against the first.
+    [range2propstats, range2fidstats, range2propsdisplay] = get_range_statistics("Range 2", argv[(separator_index + 1):])
+ 
+    comparison_rows = compare_range_measures(range1propstats, range1fidstats, range2propstats, range2fidstats)
+    write_range_comparison(RANGE_COMPARISON_FILENAME, comparison_rows)
+    print("Wrote comparison of " + str(len(comparison_rows)) + " fiducials and rows to " + RANGE_COMPARISON_FILENAME)
  
     fig = plt.figure(facecolor = GRAPH_BACKGROUND_COLOR)
     
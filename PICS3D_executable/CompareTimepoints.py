@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in the scans listed in a metadata manifest giving each scan's patient and timepoint (e.g. before and after
+# surgery), normalize them to the PICS system, pair up each patient's timepoints, and measure how every fiducial, paravaginal gap, row width
+# and tilt angle changed between the scans of each pair.  Every scan is processed once, however many pairs it is part of.  The changes of
+# every pair, and their summary over each kind of pair, are written to tables, and figures are saved without needing a display.
+
+# Generic custom imports
+import __init__
+import re
+from os import path, makedirs
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_metadata_manifest
+
+# Domain specific custom imports
+from PICS3D_libraries.Longitudinal import get_timepoint_pairs, compute_longitudinal_changes
+from PICS3D_libraries.Longitudinal import get_pair_change_rows, get_change_summary_rows
+from PICS3D_libraries.GroupStatistics import get_group_indices, segmented_statistics
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, PAIR_CHANGE_COLUMNS, CHANGE_SUMMARY_COLUMNS
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties
+
+# Graph control imports
+from PICS3D_libraries.Graphing import PelvicGraph2D, PelvicGraph3D, add_scatterpoint_to_graph3D, add_line_to_graph3D
+
+# Constants
+from Options import LONGITUDINAL_PATIENT_FIELD, LONGITUDINAL_TIMEPOINT_FIELD, LONGITUDINAL_TIMEPOINTS
+from Options import LONGITUDINAL_PAIRING, LONGITUDINAL_PAIRING_OPTIONS, PAIR_CHANGES_FILENAME, CHANGE_SUMMARY_FILENAME
+from Options import LONGITUDINAL_FIGURES_DIRECTORY, LONGITUDINAL_PAIR_FIGURES, EXPORT_FORMAT
+from Options import AXIS_TO_GRAPH, BEFORE_COLOR, AFTER_COLOR
+
+def get_figure_filename(directory, name):
+    ''' Turn a figure's name into a PNG file name in directory, replacing anything but letters, digits, '-' and '.' with '_'. '''
+    return path.join(directory, re.sub(r'[^A-Za-z0-9.\-]+', '_', name).strip('_') + ".png")
+
+def save_pair_figure(cohort, changes, pairindex, before, after, filename):
+    ''' Save a figure of the earlier and later fiducials of one pair of scans, with a line showing how far each fiducial moved. '''
+
+    graph = PelvicGraph3D(changes._changes._scan_names[pairindex])
+
+    before_coords = cohort._coords[before[pairindex]]
+    after_coords = cohort._coords[after[pairindex]]
+
+    for coords, color in [[before_coords, BEFORE_COLOR], [after_coords, AFTER_COLOR]]:
+        present = coords[~np.isnan(coords).any(axis=1)]
+        add_scatterpoint_to_graph3D(graph, None, present[:, 0], present[:, 1], present[:, 2], color)
+
+    for fidindex in np.nonzero(~np.isnan(before_coords - after_coords).any(axis=1))[0]:
+        add_line_to_graph3D(graph, before_coords[fidindex], after_coords[fidindex], BEFORE_COLOR)
+
+    graph._fig.savefig(filename)
+    plt.close(graph._fig)
+
+def save_height_change_figure(changes, filename, axis = AXIS_TO_GRAPH):
+    ''' Save a bar graph of the mean (and std dev) change in height of each fiducial, one set of bars per kind of pair. '''
+
+    [kinds, groups] = get_group_indices(changes.get_pair_kinds())
+    [counts, means, std_devs] = segmented_statistics(changes._changes.get_heights(axis), groups, len(kinds))
+
+    fid_names = changes._changes._fid_names
+    graph = PelvicGraph2D("Mean change in height", "Fiducial", "Change in height (mm)")
+
+    bar_width = 0.8 / max(len(kinds), 1)
+    positions = np.arange(len(fid_names))
+    for kindindex in range(len(kinds)):
+        graph._ax.bar(positions + kindindex * bar_width, np.nan_to_num(means[kindindex]), bar_width,
+                      yerr = np.nan_to_num(std_devs[kindindex]), label = kinds[kindindex],
+                      color = plt.cm.viridis(float(kindindex) / max(len(kinds) - 1, 1)))
+
+    graph._ax.axhline(0, color='black', linewidth=0.5)
+    graph._ax.set_xticks(positions + 0.4)
+    graph._ax.set_xticklabels(fid_names, rotation='vertical')
+    graph._ax.legend(loc='best')
+
+    graph._fig.tight_layout()
+    graph._fig.savefig(filename)
+    plt.close(graph._fig)
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    if (len(argv) != 2):
+        print("Need to supply a metadata manifest with " + LONGITUDINAL_PATIENT_FIELD + " and " + LONGITUDINAL_TIMEPOINT_FIELD + " columns.")
+        print("E.g. CompareTimepoints.py surgery_study.csv")
+        exit()
+
+    [fields, metadata] = expand_metadata_manifest(argv[1])
+
+    for field in [LONGITUDINAL_PATIENT_FIELD, LONGITUDINAL_TIMEPOINT_FIELD]:
+        if (field not in fields):
+            print(argv[1] + " has no " + field + " column.")
+            exit()
+
+    # Only load the scans that have both a patient and a timepoint.
+    patient_column = fields.index(LONGITUDINAL_PATIENT_FIELD)
+    timepoint_column = fields.index(LONGITUDINAL_TIMEPOINT_FIELD)
+    filenames = [filename for filename, values in metadata.iteritems() if (values[patient_column] != "") and (values[timepoint_column] != "")]
+
+    cohort = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(filenames))
+
+    patients = [metadata[scan_name][patient_column] for scan_name in cohort._scan_names]
+    timepoints = [metadata[scan_name][timepoint_column] for scan_name in cohort._scan_names]
+
+    [pair_patients, before, after] = get_timepoint_pairs(patients, timepoints, LONGITUDINAL_TIMEPOINTS,
+                                                         LONGITUDINAL_PAIRING == LONGITUDINAL_PAIRING_OPTIONS.CONSECUTIVE)
+    changes = compute_longitudinal_changes(cohort, patients, timepoints, before, after)
+
+    for basename, columns, rows in [[PAIR_CHANGES_FILENAME, PAIR_CHANGE_COLUMNS, get_pair_change_rows(changes)],
+                                    [CHANGE_SUMMARY_FILENAME, CHANGE_SUMMARY_COLUMNS, get_change_summary_rows(changes)]]:
+        writer = open_table_writer(basename, columns, EXPORT_FORMAT)
+        writer.write_rows(rows)
+        writer.close()
+
+    print("Compared " + str(changes.get_pair_count()) + " pairs of scans of " + str(len(set(pair_patients))) + " patients, writing the changes to "
+          + PAIR_CHANGES_FILENAME + get_export_extension(EXPORT_FORMAT) + " and their summary to "
+          + CHANGE_SUMMARY_FILENAME + get_export_extension(EXPORT_FORMAT))
+
+    if not path.isdir(LONGITUDINAL_FIGURES_DIRECTORY): makedirs(LONGITUDINAL_FIGURES_DIRECTORY)
+
+    save_height_change_figure(changes, path.join(LONGITUDINAL_FIGURES_DIRECTORY, "height_changes.png"))
+
+    if LONGITUDINAL_PAIR_FIGURES:
+        for pairindex in range(changes.get_pair_count()):
+            save_pair_figure(cohort, changes, pairindex, before, after,
+                             get_figure_filename(LONGITUDINAL_FIGURES_DIRECTORY, changes._changes._scan_names[pairindex]))
+
+    print("Saved figures to " + LONGITUDINAL_FIGURES_DIRECTORY)
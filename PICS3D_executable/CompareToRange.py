@@ -5,14 +5,22 @@
 
 # Generic custom imports
 import __init__ 
+import csv
 import numpy as np
 import matplotlib.pyplot as plt
 # from pylab import boxplot
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # Domain specific custom imports
-from ComputeStatistics import load_vaginal_properties, get_stats_and_display_from_properties
+from ComputeStatistics import get_stats_and_display_from_properties, get_range_statistics
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties, get_range_measure_matrices
+from ComputeStatistics import HEIGHT_MEASURE, PARAVAGINAL_GAP_MEASURE, WIDTH_MEASURE
+from ComputeStatistics import procrustes_align_vaginal_properties, DEFAULT_CONFIGURATION
 from PICS3D_libraries.Graphing import filter_vagprops_for_graphing
+from PICS3D_libraries.CohortArrays import GAP_COMPONENTS
+from PICS3D_libraries.StatMath import column_means_and_std_devs, z_scores, percentile_ranks
+from PICS3D_libraries.StatMath import leave_one_out_means_and_std_devs, leave_one_out_percentile_ranks
 
 # Graph control imports
 from PICS3D_libraries.Graphing import show_all_graphs, generate_magic_subplot_number
@@ -22,6 +30,10 @@ from Options import WIDTH_GRAPH_MIN_MM, WIDTH_GRAPH_MAX_MM
 from Options import SHOW_PARAVAG_GRAPH, SHOW_WIDTH_GRAPH, SHOW_COORDINATE_GRAPH, AXIS_TO_GRAPH
 from Options import GRAPH_BACKGROUND_COLOR, POINT_COLOR
 from Options import SHOW_INDIVIDUAL_VALUES, SHOW_RANGE_VALUES
+from Options import RANGE_SCORE_FILENAME, LEAVE_ONE_OUT_SCORE_FILENAME
+
+# Column headings for the table of scores written by write_range_scores
+RANGE_SCORE_COLUMNS = ["Scan", "Measure", "Key", "Value", "Range Count", "Range Mean", "Range Std Dev", "Z Score", "Percentile"]
 
 
 def create_2D_coordinate_graph(graph, exemplar_key_list, exemplar_props, rangestats):
@@ -156,6 +168,140 @@ def create_2D_width_graph(graph, exemplar_vagprops, range_vagprop_stats):
     graph.set_xticklabels(xticklabels)
     graph.grid(True)
 
+def score_values_against_range(scan_names, measure, keys, exemplar_values, range_values):
+    ''' Score an M x K array of exemplar values against the N x K array of range values for the same K keys.
+        Returns one table row per exemplar per key, in the format described by RANGE_SCORE_COLUMNS. '''
+
+    [means, std_devs, counts] = column_means_and_std_devs(range_values)
+    scores = z_scores(exemplar_values, means, std_devs)
+    percentiles = percentile_ranks(exemplar_values, range_values)
+
+    return get_score_rows(scan_names, measure, keys, exemplar_values, counts, means, std_devs, scores, percentiles)
+
+def score_values_leaving_one_out(scan_names, measure, keys, values):
+    ''' Score each row of an N x K array of values against the other N - 1 rows, as score_values_against_range would with that row
+        as the exemplar and the rest as the range - but from one pass over the values rather than N.
+        Returns one table row per scan per key, in the format described by RANGE_SCORE_COLUMNS. '''
+
+    [means, std_devs, counts] = leave_one_out_means_and_std_devs(values)
+    scores = z_scores(values, means, std_devs)
+    percentiles = leave_one_out_percentile_ranks(values)
+
+    return get_score_rows(scan_names, measure, keys, values, counts, means, std_devs, scores, percentiles)
+
+def get_score_rows(scan_names, measure, keys, exemplar_values, counts, means, std_devs, scores, percentiles):
+    ''' Lay out M x K exemplar values and their scores as table rows in the format described by RANGE_SCORE_COLUMNS.  The range's counts,
+        means and std devs may be K-length (one range for every exemplar) or M x K (one range per exemplar). '''
+
+    [counts, means, std_devs] = [np.ones(exemplar_values.shape) * statistic for statistic in [counts, means, std_devs]]
+
+    rows = []
+    for scanindex in range(len(scan_names)):
+        for keyindex in range(len(keys)):
+
+            # Skip anything this exemplar doesn't have a value for.
+            if np.isnan(exemplar_values[scanindex, keyindex]): continue
+
+            rows.append([scan_names[scanindex], measure, keys[keyindex],
+                         exemplar_values[scanindex, keyindex],
+                         int(counts[scanindex, keyindex]), means[scanindex, keyindex], std_devs[scanindex, keyindex],
+                         scores[scanindex, keyindex], percentiles[scanindex, keyindex]])
+
+    return rows
+
+def score_cohort_against_range(exemplar_arrays, rangestats, rangefidstats, range_measures = None, configuration = DEFAULT_CONFIGURATION):
+    ''' Score every scan in exemplar_arrays (a CohortArrays) against a range, given as the property statistics and collated fiducial
+        statistics returned by get_range_statistics.  Every fiducial height (along configuration's inferior-superior axis), paravaginal gap
+        and row width is given a z-score and percentile relative to the range.  range_measures may be given (from
+        get_range_measure_matrices) to save recomputing them when scoring many requests against the same range. '''
+
+    if (range_measures == None):
+        range_measures = get_range_measure_matrices(rangestats, rangefidstats, configuration)
+    scan_names = exemplar_arrays._scan_names
+
+    rows = []
+
+    # Fiducial heights
+    [keys, range_heights] = range_measures[HEIGHT_MEASURE]
+    exemplar_heights = exemplar_arrays.align_to(keys, exemplar_arrays.get_heights(configuration._axis_coding_is))
+    rows += score_values_against_range(scan_names, HEIGHT_MEASURE, keys, exemplar_heights, range_heights)
+
+    # Paravaginal gaps
+    [keys, range_gaps] = range_measures[PARAVAGINAL_GAP_MEASURE]
+    exemplar_gaps = exemplar_arrays.align_to(keys, exemplar_arrays._gaps[:, :, GAP_COMPONENTS.TOTAL])
+    rows += score_values_against_range(scan_names, PARAVAGINAL_GAP_MEASURE, keys, exemplar_gaps, range_gaps)
+
+    # Row widths - pad the exemplar widths out with NaN to the number of rows in the range, or trim them back to it.
+    [row_keys, range_widths] = range_measures[WIDTH_MEASURE]
+    row_count = len(row_keys)
+
+    exemplar_widths = np.empty((len(scan_names), row_count))
+    exemplar_widths.fill(np.nan)
+
+    shared_rows = min(row_count, exemplar_arrays._widths.shape[1])
+    exemplar_widths[:, 0:shared_rows] = exemplar_arrays._widths[:, 0:shared_rows]
+
+    rows += score_values_against_range(scan_names, WIDTH_MEASURE, row_keys, exemplar_widths, range_widths)
+
+    return rows
+
+def score_cohort_leaving_one_out(cohort, configuration = DEFAULT_CONFIGURATION):
+    ''' Score every scan of a CohortArrays against a range of all the other scans, for internal validation: every fiducial height
+        (along configuration's inferior-superior axis), paravaginal gap and row width is given a z-score and percentile relative to the
+        rest of the cohort. '''
+
+    scan_names = cohort._scan_names
+
+    rows = []
+    rows += score_values_leaving_one_out(scan_names, HEIGHT_MEASURE, cohort._fid_names, cohort.get_heights(configuration._axis_coding_is))
+    rows += score_values_leaving_one_out(scan_names, PARAVAGINAL_GAP_MEASURE, cohort._fid_names, cohort._gaps[:, :, GAP_COMPONENTS.TOTAL])
+
+    row_keys = ["Row " + str(rowindex + 1) for rowindex in range(cohort._widths.shape[1])]
+    rows += score_values_leaving_one_out(scan_names, WIDTH_MEASURE, row_keys, cohort._widths)
+
+    return rows
+
+def write_range_scores(filename, rows):
+    ''' Write the rows generated by score_cohort_against_range to filename as a CSV table. '''
+
+    with open(filename, 'wb') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(RANGE_SCORE_COLUMNS)
+        writer.writerows(rows)
+
+def batch_compare_to_range(exemplar_filenames, range_filenames, configuration = DEFAULT_CONFIGURATION):
+    ''' Build the range from range_filenames once (or load it, if it is a single saved range), then score every one of exemplar_filenames
+        against it under configuration and write the table of scores to RANGE_SCORE_FILENAME.  Files are loaded and PICS-corrected in
+        parallel. '''
+
+    [rangestats, rangefidstats, rangedisplay] = get_range_statistics("Range", range_filenames, configuration = configuration)
+
+    # Exemplars that can't be loaded or PICS-corrected are reported and left out.
+    exemplarlist = load_and_correct_vaginal_properties(exemplar_filenames, configuration = configuration)
+    if (len(exemplarlist) == 0):
+        print("None of the " + str(len(exemplar_filenames)) + " exemplars could be scored.")
+        return
+
+    exemplar_arrays = get_cohort_arrays_from_properties(exemplarlist, configuration)
+
+    rows = score_cohort_against_range(exemplar_arrays, rangestats, rangefidstats, configuration = configuration)
+    write_range_scores(RANGE_SCORE_FILENAME, rows)
+
+    print("Scored " + str(len(exemplarlist)) + " of " + str(len(exemplar_filenames)) + " exemplars against a range of "
+          + str(len(rangestats._propslist)) + " into " + RANGE_SCORE_FILENAME)
+
+def leave_one_out_compare_to_range(filenames, configuration = DEFAULT_CONFIGURATION):
+    ''' Load every one of filenames once, score each scan against a range of all the others, and write the table of scores to
+        LEAVE_ONE_OUT_SCORE_FILENAME.  Under Procrustes normalization the scans are aligned together once, left-out scan included. '''
+
+    propslist = load_and_correct_vaginal_properties(filenames, configuration = configuration)
+    if configuration.aligns_by_procrustes(): procrustes_align_vaginal_properties(propslist, configuration)
+
+    rows = score_cohort_leaving_one_out(get_cohort_arrays_from_properties(propslist, configuration), configuration)
+    write_range_scores(LEAVE_ONE_OUT_SCORE_FILENAME, rows)
+
+    print("Scored each of " + str(len(propslist)) + " scans against a range of the rest into " + LEAVE_ONE_OUT_SCORE_FILENAME)
+
 #####################
 ### DEFAULT MAIN PROC
 #####################  graph
@@ -165,20 +311,46 @@ if __name__ == '__main__':
     from sys import argv
      
     setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+    
+    ARGUMENT_LIST_SEPARATOR = ':'
     
     if len(argv) < 3: 
         print("Need to supply at least one mrml file name argument and at least one to compare it against.")
+        print("To score many exemplars at once, separate the exemplars from the range with a single ':'")
+        print("To score every scan of a range against the rest of it, start with the ':' - e.g. CompareToRange.py : 101.mrml 102.mrml 103.mrml")
+        exit()
+    
+    # Leave-one-out mode - ':', then the range, each scan of which is scored against the others.
+    if (argv.count(ARGUMENT_LIST_SEPARATOR) == 1) and (argv.index(ARGUMENT_LIST_SEPARATOR) == 1):
+        if (len(argv) < 4):
+            print("Need to supply at least two range mrml files after the ':' to score each against the rest.")
+            exit()
+
+        leave_one_out_compare_to_range(argv[2:])
+        exit()
+
+    # Batch mode - many exemplars, then ':', then the range.
+    if (argv.count(ARGUMENT_LIST_SEPARATOR) == 1):
+        separator_index = argv.index(ARGUMENT_LIST_SEPARATOR)
+        
+        if ((separator_index < 2) or (separator_index >= len(argv) - 1)):
+            print("Need to supply at least one exemplar mrml file before the ':' and at least one range mrml file after it.")
+            exit()
+            
+        batch_compare_to_range(argv[1:separator_index], argv[(separator_index + 1):])
         exit()
     
     # ignore argv[0], as it's just the filename of this python file.
 
     # List of fiducial stats representing a single vagina, to be compared to the range.
-    propslist = load_vaginal_properties(argv[1:2])
+    propslist = load_and_correct_vaginal_properties(argv[1:2])
     [propstats, fidstats, propsdisplay] = get_stats_and_display_from_properties("Exemplar", propslist)
     
-    # List of fiducial stats representing a range to compare that single one against. 
-    rangelist = load_vaginal_properties(argv[2:])
-    [rangestats, rangefidstats, rangedisplay] = get_stats_and_display_from_properties("Range", rangelist)
+    # List of fiducial stats representing a range to compare that single one against - either MRML files or a single saved range.
+    [rangestats, rangefidstats, rangedisplay] = get_range_statistics("Range", argv[2:])
  
     fig = plt.figure(facecolor = GRAPH_BACKGROUND_COLOR)
     
@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in the scans listed in a metadata manifest (a CSV table of scans and their metadata, such as diagnosis,
+# age band, parity or timepoint), normalize them to the PICS system, and compute the cohort statistics of every group of scans under each
+# of several groupings - all from one load of the scans, rather than one load per group.  The results are written to a table.
+
+# Generic custom imports
+import __init__
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_metadata_manifest
+
+# Domain specific custom imports
+from PICS3D_libraries.GroupStatistics import get_group_result_rows
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, GROUP_RESULT_COLUMNS
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties
+
+# Constants
+from Options import GROUP_BY, GROUP_RESULTS_FILENAME, EXPORT_FORMAT
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    if (len(argv) < 2):
+        print("Need to supply a metadata manifest, optionally followed by the metadata columns to group by.")
+        print("E.g. ComputeGroupStatistics.py study.csv Diagnosis \"Diagnosis+Age Band\"")
+        exit()
+
+    [fields, metadata] = expand_metadata_manifest(argv[1])
+
+    groupings = argv[2:]
+    if (len(groupings) == 0): groupings = GROUP_BY if (GROUP_BY != None) else fields
+
+    cohort = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(metadata.keys()))
+
+    writer = open_table_writer(GROUP_RESULTS_FILENAME, GROUP_RESULT_COLUMNS, EXPORT_FORMAT)
+    writer.write_rows(get_group_result_rows(cohort, fields, metadata, groupings))
+    writer.close()
+
+    print("Wrote the statistics of " + str(cohort.get_scan_count()) + " scans under " + str(len(groupings)) + " groupings to "
+          + GROUP_RESULTS_FILENAME + get_export_extension(EXPORT_FORMAT))
@@ -4,28 +4,76 @@
 
 # Python base library imports
 import __init__
+import json
 from collections import OrderedDict
+from multiprocessing import Pool
 from numpy import std as std_dev
-from numpy import mean
+from numpy import mean, array, empty, zeros, outer, nan, isnan, load, savez_compressed
 
 # Generic custom imports 
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint, rad_to_degrees
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # Domain specific custom imports
 from PICS3D_libraries.VaginalProperties import load_vaginal_properties
 from PICS3D_libraries.Fiducials import Fiducial, get_fiducial_list_by_row_and_column
 from PICS3D_libraries.PICSMath import pics_correct_and_verify
+from PICS3D_libraries.CohortArrays import build_cohort_arrays
+from PICS3D_libraries.Procrustes import generalized_procrustes, fit_similarity_transforms
+from PICS3D_libraries.RowResampling import get_resampled_row_fiducials
+from PICS3D_libraries.Configuration import PICSConfiguration
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, get_scan_result_rows, get_cohort_result_rows
+from PICS3D_libraries.Export import get_surface_result_rows
+from PICS3D_libraries.SurfaceMesh import get_surface_meshes
+from PICS3D_libraries.LandmarkQA import check_landmarks
+from PICS3D_libraries.Export import SCAN_RESULT_COLUMNS, COHORT_RESULT_COLUMNS
 from PICS3D_libraries.Options import COORDS, REFERENCE_POINT_NAMES, LEFT_EDGE_PREFIX, RIGHT_EDGE_PREFIX, CENTER_PREFIX
 
 # Executable options
 from Options import COMPUTE_LEFT_EDGES, COMPUTE_RIGHT_EDGES, COMPUTE_CENTER, COMPUTE_ALL_INDIVIDUAL_POINTS, STD_DEV_GRAPH_MULTIPLIER
-from Options import COLOR_STRAT
+from Options import NORMALIZATION, NORMALIZATION_OPTIONS, PROCRUSTES_SCALING, COMPUTE_RESAMPLED_ROWS, RESAMPLED_ROW_POINTS
+from Options import COLOR_STRAT, BATCH_PROCESSES, SAVED_RANGE_EXTENSION, SAVED_RANGE_FORMAT_VERSION
+from Options import EXPORT_FORMAT, SCAN_RESULTS_FILENAME, COHORT_RESULTS_FILENAME, COMPUTE_SURFACE_METRICS
+from Options import ERROR_DISPLAY, ERROR_DISPLAY_OPTIONS, LANDMARK_QA, LANDMARK_QA_OPTIONS
 
 # Graph drawing imports 
 from PICS3D_libraries.VaginalDisplay import VaginalDisplay
-from PICS3D_libraries.Graphing import show_all_graphs, add_line_to_graph3D
+from PICS3D_libraries.Graphing import show_all_graphs, add_line_to_graph3D, add_ellipsoids_to_graph3D
+from PICS3D_libraries.StatMath import covariance_ellipsoid_axes
 from PelvicPoints import create_pelvic_points_graph
 
+# Names of the measures gathered by get_range_measure_matrices
+HEIGHT_MEASURE = "Height"
+PARAVAGINAL_GAP_MEASURE = "Paravaginal Gap"
+WIDTH_MEASURE = "Width"
+
+class StatisticsConfiguration(PICSConfiguration):
+    ''' A PICSConfiguration that also holds the options deciding which fiducials are collated into a range's statistics,
+    and how a range's scans are normalized against each other, which default to their values in this directory's Options.py. '''
+
+    OPTION_DEFAULTS = OrderedDict(PICSConfiguration.OPTION_DEFAULTS.items()
+                                  + [("COMPUTE_LEFT_EDGES", COMPUTE_LEFT_EDGES),
+                                     ("COMPUTE_RIGHT_EDGES", COMPUTE_RIGHT_EDGES),
+                                     ("COMPUTE_CENTER", COMPUTE_CENTER),
+                                     ("COMPUTE_ALL_INDIVIDUAL_POINTS", COMPUTE_ALL_INDIVIDUAL_POINTS),
+                                     ("COMPUTE_RESAMPLED_ROWS", COMPUTE_RESAMPLED_ROWS),
+                                     ("RESAMPLED_ROW_POINTS", RESAMPLED_ROW_POINTS),
+                                     ("NORMALIZATION", NORMALIZATION),
+                                     ("PROCRUSTES_SCALING", PROCRUSTES_SCALING),
+                                     ("LANDMARK_QA", LANDMARK_QA)])
+
+    def collates_edges(self):
+        return (self._compute_left_edges or self._compute_right_edges or self._compute_center)
+
+    def aligns_by_procrustes(self):
+        return (self._normalization == NORMALIZATION_OPTIONS.PROCRUSTES)
+
+    def excludes_landmark_outliers(self):
+        return (self._landmark_qa == LANDMARK_QA_OPTIONS.EXCLUDE)
+
+# The configuration given by both Options.py files, used wherever no other configuration is passed in.
+DEFAULT_CONFIGURATION = StatisticsConfiguration()
+
 class FiducialStatistics():
     ''' This is a class that collects statistical information about a particular Fiducial point. '''
     
@@ -45,10 +93,55 @@ class FiducialStatistics():
         
         self._averaged_paravag_gap_horiz=None
         self._fid_paravag_gap_horiz_std_dev=None
+
+        # Running sums behind get_covariance, kept as fiducials are added and removed.  Coordinates are summed relative to the first
+        # fiducial added (_coord_shift), which keeps the sums small and the covariance accurate.
+        self._coord_count = 0
+        self._coord_shift = None
+        self._coord_sum = zeros(3)
+        self._coord_outer_sum = zeros((3, 3))
         
     def add_fiducial(self, Fiducial):
         self._fid_collated_list.append(Fiducial)
+        self._accumulate_coords(Fiducial, 1)
+        self.update_statistics()
+
+    def add_fiducials(self, fiducials):
+        ''' Add a list of Fiducials, updating the statistics once at the end rather than after each one. '''
+        for fid in fiducials:
+            self._fid_collated_list.append(fid)
+            self._accumulate_coords(fid, 1)
+
         self.update_statistics()
+
+    def remove_fiducial(self, Fiducial):
+        ''' Remove a previously added Fiducial (the same object, not just an equal one) and update the statistics. '''
+        for fidindex in range(len(self._fid_collated_list)):
+            if (self._fid_collated_list[fidindex] is Fiducial):
+                del self._fid_collated_list[fidindex]
+                self._accumulate_coords(Fiducial, -1)
+                break
+
+        self.update_statistics()
+
+    def _accumulate_coords(self, fid, sign):
+        ''' Add (sign 1) or subtract (sign -1) one Fiducial's coordinates to or from the running sums behind get_covariance. '''
+        if (fid == None): return
+
+        if (self._coord_shift is None): self._coord_shift = array(fid.coords[0:3], dtype=float)
+
+        offset = fid.coords[0:3] - self._coord_shift
+
+        self._coord_count += sign
+        self._coord_sum += sign * offset
+        self._coord_outer_sum += sign * outer(offset, offset)
+
+    def get_covariance(self):
+        ''' Return the 3x3 (population) covariance matrix of the collated fiducials' coordinates, or None if there are none. '''
+        if (self._coord_count == 0): return None
+
+        mean_offset = self._coord_sum / self._coord_count
+        return (self._coord_outer_sum / self._coord_count) - outer(mean_offset, mean_offset)
         
     def update_statistics(self): 
             
@@ -125,6 +218,15 @@ class FiducialStatCollection():
             self._statsdict[fiducialname] = FiducialStatistics(fiducialname)
          
         self._statsdict[fiducialname].add_fiducial(fiducial)
+
+    def remove_fiducial_by_name(self, fiducialname, fiducial):
+        ''' Remove a fiducial added by add_fiducial_by_name, dropping the name altogether once it has no fiducials left. '''
+        if (not fiducialname in self._statsdict): return
+
+        self._statsdict[fiducialname].remove_fiducial(fiducial)
+
+        if (len(self._statsdict[fiducialname]._fid_collated_list) == 0):
+            del self._statsdict[fiducialname]
     
     def get_all_stats(self):
         return self._statsdict
@@ -212,6 +314,44 @@ class VaginalPropertyStatistics():
         for item in propslist:
             self.add_vaginalproperties(item)
 
+    def get_vaginalproperties(self, name):
+        ''' Return the VaginalProperties added under name, or None if there are none. '''
+        for [propsname, vagprops] in self._propslist:
+            if (propsname == name): return vagprops
+
+        return None
+
+    def remove_vaginalproperties(self, name):
+        ''' Remove the VaginalProperties added under name, undoing everything add_vaginalproperties collated from it.
+        Returns the removed VaginalProperties, or None if there were none. '''
+
+        vagprops = self.get_vaginalproperties(name)
+        if (vagprops == None): return None
+
+        self._propslist = [item for item in self._propslist if (item[1] is not vagprops)]
+
+        # Widths and angles aren't stored by scan, but any equal value is statistically interchangeable, so remove the first match.
+        for widthindex in range(len(vagprops._vagwidths)):
+            if (widthindex < len(self._vagwidthlists)) and (vagprops._vagwidths[widthindex] in self._vagwidthlists[widthindex]):
+                self._vagwidthlists[widthindex].remove(vagprops._vagwidths[widthindex])
+
+        # Don't leave empty rows at the end that no remaining scan reaches.
+        while ((len(self._vagwidthlists) > 0) and (len(self._vagwidthlists[-1]) == 0)):
+            self._vagwidthlists.pop()
+
+        for angle, anglelist in [[vagprops._pelvic_tilt_correction_angle_about_LR_axis, self._pitch_correction_list],
+                                 [vagprops._pelvic_tilt_correction_angle_about_AP_axis, self._roll_correction_list],
+                                 [vagprops._pelvic_tilt_correction_angle_about_IS_axis, self._yaw_correction_list]]:
+            if (angle != None) and (rad_to_degrees(angle) in anglelist):
+                anglelist.remove(rad_to_degrees(angle))
+
+        for key, fid in vagprops._fiducial_points.iteritems():
+            self._fidstatcollection.remove_fiducial_by_name(key, fid)
+
+        self.update_statistics()
+
+        return vagprops
+
 
 def collate_fiducials_reference_points(propslist, allfidstats = None):
     ''' Iterate over all gathered sets of vaginal properties, gathering the specially named reference point fiducials from them all and collating.
@@ -262,8 +402,9 @@ def collate_fiducials_by_row_and_column(propslist, allfidstats = None):
                     
     return allfidstats
 
-def collate_fiducials_by_edges(propslist, allfidstats = None):
+def collate_fiducials_by_edges(propslist, allfidstats = None, configuration = DEFAULT_CONFIGURATION):
     ''' Iterate over propslist, gathering the edge fiducials from them all and collating.
+    Which edges (left, right and center) are gathered is decided by configuration.
     Fills allfidstats with the results and returns it.'''
     
     if (allfidstats == None): 
@@ -286,7 +427,7 @@ def collate_fiducials_by_edges(propslist, allfidstats = None):
                     start_index = colindex
                     standardized_fid_name = LEFT_EDGE_PREFIX + str(rowindex)
                     
-                    if COMPUTE_LEFT_EDGES: allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid)   
+                    if configuration._compute_left_edges: allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid)   
                         
                 if (start_index != None): break
         
@@ -302,7 +443,7 @@ def collate_fiducials_by_edges(propslist, allfidstats = None):
                     end_index = -1 * colindex
                     standardized_fid_name = RIGHT_EDGE_PREFIX + str(rowindex)
                     
-                    if COMPUTE_RIGHT_EDGES: allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid) 
+                    if configuration._compute_right_edges: allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid) 
                             
                 if (end_index != None): break
             
@@ -321,11 +462,24 @@ def collate_fiducials_by_edges(propslist, allfidstats = None):
                 standardized_fid_name = CENTER_PREFIX + str(rowindex)    
                 current_fid = fids[rowindex][mid_index]   
                 
-                if (COMPUTE_CENTER): allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid) 
+                if (configuration._compute_center): allfidstats.add_fiducial_by_name(standardized_fid_name, current_fid) 
                 
     return allfidstats
 
-def get_stats_and_display_from_properties(display_name, inputlist):
+def collate_fiducials_by_resampled_rows(propslist, allfidstats = None, configuration = DEFAULT_CONFIGURATION):
+    ''' Resample every row of every scan in propslist to the configuration's number of evenly spaced points (see RowResampling),
+    and collate the resampled points by row and position along the row.  Fills allfidstats with the results and returns it. '''
+
+    if (allfidstats == None):
+        allfidstats = FiducialStatCollection()
+
+    for fid_dict in get_resampled_row_fiducials(propslist, configuration._resampled_row_points):
+        for fidname, fid in fid_dict.iteritems():
+            allfidstats.add_fiducial_by_name(fidname, fid)
+
+    return allfidstats
+
+def get_stats_and_display_from_properties(display_name, inputlist, configuration = DEFAULT_CONFIGURATION):
     ''' Takes a list of vaginal properties and returns a VaginalDisplay. '''
     
     propstats = VaginalPropertyStatistics()
@@ -333,68 +487,479 @@ def get_stats_and_display_from_properties(display_name, inputlist):
     propstats.add_vaginalproperties_from_list(inputlist)
     
     statscollection = collate_fiducials_reference_points(inputlist)
-    if (COMPUTE_RIGHT_EDGES or COMPUTE_LEFT_EDGES or COMPUTE_CENTER): 
-        statscollection = collate_fiducials_by_edges(inputlist, statscollection)
-    if (COMPUTE_ALL_INDIVIDUAL_POINTS):
+    if configuration.collates_edges(): 
+        statscollection = collate_fiducials_by_edges(inputlist, statscollection, configuration)
+    if (configuration._compute_all_individual_points):
         statscollection = collate_fiducials_by_row_and_column(inputlist, statscollection)
+    if (configuration._compute_resampled_rows):
+        statscollection = collate_fiducials_by_resampled_rows(inputlist, statscollection, configuration)
+
+    display = create_display_from_statistics(display_name, propstats, statscollection, configuration = configuration)
+
+    return [propstats, statscollection,display]
 
-    display = VaginalDisplay(display_name, COLOR_STRAT)        
-    # Iterate over our collated Fiducial stats using their standardized names, and compute some values. 
+def create_display_from_statistics(display_name, propstats, statscollection, color_strat = COLOR_STRAT, configuration = DEFAULT_CONFIGURATION):
+    ''' Build the averaged VaginalDisplay for a range from its property statistics and collated fiducial statistics. '''
+
+    display = VaginalDisplay(display_name, color_strat, configuration)
+    # Iterate over our collated Fiducial stats using their standardized names, and compute some values.
     for fidname in statscollection.get_all_stats():
         stats = statscollection.get_stats_for_name(fidname)
-        
+
         display._fiducial_points[fidname] = stats._averaged_fid
-       
 
+    display.compute_properties()
+
+    # The averaged display's widths are the row means across the range, not widths measured from the averaged points.
     for widthmean in propstats._vagwidthmeanslist:
         display._vagwidths.append(widthmean)
 
-    display.compute_properties()
-    
-    return [propstats, statscollection,display]
+    return display
 
-def print_results(propstats, allfidstats):
-    
-    print("================")
-    print("Vaginal Property Statistics for all sets of vaginas... ")
-    print("Vaginal Width List:")
-    
-    rowcount = 0
-    while (rowcount < len(propstats._vagwidthlists)):
-        widthlist = propstats._vagwidthlists[rowcount]
-        rowcount += 1 # Done here so the displayed row # makes sense
-        print("Row # " + str(rowcount) 
-              + ", mean: " +  str(mean(widthlist)) 
-              + ", std dev: " + str(std_dev(widthlist)))
-              
-    print("================")
-    
-    print("Pitch Correction Angle mean: " + str(mean(propstats._pitch_correction_list)))
-    print("Pitch Correction Angle stdev: " + str(std_dev(propstats._pitch_correction_list)))
-    print("Roll Correction Angle mean: " + str(mean(propstats._roll_correction_list)))
-    print("Roll Correction Angle stdev: " + str(std_dev(propstats._roll_correction_list)))
-    print("Yaw Correction Angle mean: " + str(mean(propstats._yaw_correction_list)))
-    print("Yaw Correction Angle stdev: " + str(std_dev(propstats._yaw_correction_list)))
-    
-    print("================")
-    
-    for fidname in allfidstats.get_all_stats():
-        stat = allfidstats.get_stats_for_name(fidname)
-        print("================")
-        print("Statistics for " + stat._fid_name)
-        print("Mean Fiducial: " + stat._averaged_fid.to_string())
-        print("X std dev: " + str(stat._fid_std_dev_x))
-        print("Y std dev: " + str(stat._fid_std_dev_y))
-        print("Z std dev: " + str(stat._fid_std_dev_z))
-        print("Mean paravaginal gap (diagonal): " + str(stat._averaged_paravag_gap))
-        print("Paravaginal gap std dev (diagonal): " + str(stat._fid_paravag_gap_std_dev)) 
-        print("Mean paravaginal gap (vertical): " + str(stat._averaged_paravag_gap_is))
-        print("Paravaginal gap std dev (vertical): " + str(stat._fid_paravag_gap_is_std_dev)) 
-        print("Mean paravaginal gap (horizontal): " + str(stat._averaged_paravag_gap_horiz))
-        print("Paravaginal gap std dev (horizontal): " + str(stat._fid_paravag_gap_horiz_std_dev)) 
-        print("================")
-     
-    print("================")
+def collate_fiducials_for_scan(vag_props, include_all = False, configuration = DEFAULT_CONFIGURATION):
+    ''' Collate a single set of vaginal properties exactly as get_stats_and_display_from_properties collates a range,
+    returning an OrderedDict mapping each standardized fiducial name to that scan's Fiducial.
+    If include_all is True, collate the edges and individual points whatever the configuration's COMPUTE_ options say. '''
+
+    statscollection = collate_fiducials_reference_points([vag_props])
+    if (include_all or configuration.collates_edges()):
+        statscollection = collate_fiducials_by_edges([vag_props], statscollection, configuration)
+    if (include_all or configuration._compute_all_individual_points):
+        statscollection = collate_fiducials_by_row_and_column([vag_props], statscollection)
+    if (configuration._compute_resampled_rows):
+        statscollection = collate_fiducials_by_resampled_rows([vag_props], statscollection, configuration)
+
+    collated = OrderedDict()
+    for fidname, stats in statscollection.get_all_stats().iteritems():
+        collated[fidname] = stats._fid_collated_list[0]
+
+    return collated
+
+def get_cohort_arrays_from_properties(propslist, configuration = DEFAULT_CONFIGURATION):
+    ''' Takes a list of vaginal properties and returns them stacked into a CohortArrays, using standardized fiducial names. '''
+
+    collated_fid_dicts = [collate_fiducials_for_scan(vag_props, configuration = configuration) for vag_props in propslist]
+
+    return build_cohort_arrays(propslist, collated_fid_dicts)
+
+def _load_and_correct_worker(filename, configuration = DEFAULT_CONFIGURATION):
+    ''' Process pool helper - load a single MRML file and run it through the PICS standardization process.
+    Returns None (rather than stopping the whole batch) if the scan cannot be loaded or corrected. '''
+
+    vag_props = _load_or_skip(filename, configuration)
+    if (vag_props == None): return None
+
+    return _correct_or_skip(vag_props)
+
+def _load_and_correct_configured_worker(arguments):
+    ''' Process pool helper - _load_and_correct_worker for a [filename, configuration] pair. '''
+    return _load_and_correct_worker(arguments[0], arguments[1])
+
+def _load_worker(filename):
+    ''' Process pool helper - load a single MRML file without PICS-correcting it.
+    Returns None (rather than stopping the whole batch) if the file cannot be loaded. '''
+    return _load_or_skip(filename)
+
+def _correct_worker(arguments):
+    ''' Process pool helper - PICS-correct a fresh copy of an already loaded scan's raw fiducials under another configuration.
+    arguments is a [VaginalProperties, configuration] pair. '''
+
+    [vag_props, configuration] = arguments
+
+    return _correct_or_skip(vag_props.copy_raw(configuration))
+
+def _load_or_skip(filename, configuration = DEFAULT_CONFIGURATION):
+    ''' Load a single MRML file and return its vaginal properties, or report why it can't be loaded and return None. '''
+
+    try:
+        return load_vaginal_properties([filename], configuration)[0]
+    except Exception as error:
+        debugprint("Cannot load " + filename + " - leaving it out.  " + str(error), debug_levels.ERRORS)
+        return None
+
+def _correct_or_skip(vag_props):
+    ''' PICS-correct vag_props and return it, or report why it can't be corrected and return None. '''
+
+    try:
+        pics_correct_and_verify(vag_props)
+    except ValueError as error:
+        debugprint(str(error) + " - leaving it out.", debug_levels.ERRORS)
+        return None
+
+    return vag_props
+
+def _iterate_pool_results(worker, arguments, processes, pool = None):
+    ''' Yield worker(argument) for each of arguments in order, using pool if given, a new pool of processes if not,
+    or no pool at all if processes is 1 or there is only one argument. '''
+
+    if (pool == None) and ((processes == 1) or (len(arguments) < 2)):
+        for argument in arguments:
+            yield worker(argument)
+        return
+
+    own_pool = (pool == None)
+    if own_pool: pool = Pool(processes)
+
+    try:
+        for result in pool.imap(worker, arguments):
+            yield result
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+def iterate_loaded_vaginal_properties(filenames, processes = BATCH_PROCESSES, configuration = DEFAULT_CONFIGURATION):
+    ''' Load and PICS-correct the vaginal properties from each of the MRML filenames, spreading the work across a pool of processes,
+    and yield each one as soon as it (and every file before it) is done, in the same order as filenames.  Scans that cannot be corrected
+    are reported and left out.  processes of None means one process per CPU; 1 means load serially. '''
+
+    arguments = [[filename, configuration] for filename in filenames]
+
+    for vag_props in _iterate_pool_results(_load_and_correct_configured_worker, arguments, processes):
+        if (vag_props != None): yield vag_props
+
+def screen_vaginal_properties(propslist, configuration = DEFAULT_CONFIGURATION):
+    ''' Run landmark QA (see LandmarkQA) over a cohort of vaginal properties and report every scan whose PICS reference landmarks are
+    missing, degenerate or out of line with the rest of the cohort.  Returns the scans to carry on with: all of them, or under
+    LANDMARK_QA of EXCLUDE, only those that passed. '''
+
+    if (configuration._landmark_qa == LANDMARK_QA_OPTIONS.OFF) or (len(propslist) == 0): return propslist
+
+    report = check_landmarks(propslist, configuration)
+    failed = report.get_failed()
+
+    for scanindex in report.get_failed_scans():
+        debugprint("Landmark QA flagged " + report._scan_names[scanindex] + ": " + "; ".join(report.get_problems(scanindex))
+                   + (" - leaving it out." if configuration.excludes_landmark_outliers() else ""), debug_levels.ERRORS)
+
+    if configuration.excludes_landmark_outliers():
+        return [propslist[scanindex] for scanindex in range(len(propslist)) if not failed[scanindex]]
+
+    return propslist
+
+def load_and_correct_vaginal_properties(filenames, processes = BATCH_PROCESSES, configuration = DEFAULT_CONFIGURATION):
+    ''' Load and PICS-correct the vaginal properties from each of the MRML filenames, returning them in the same order as filenames,
+    less any that cannot be corrected or (see screen_vaginal_properties) fail landmark QA. '''
+
+    return screen_vaginal_properties(list(iterate_loaded_vaginal_properties(filenames, processes, configuration)), configuration)
+
+def load_raw_vaginal_properties(filenames, processes = BATCH_PROCESSES, pool = None):
+    ''' Load the vaginal properties from each of the MRML filenames without PICS-correcting them, so that they can be corrected
+    under one or more configurations with correct_vaginal_properties.  Returns them in the same order as filenames, less any that
+    cannot be loaded.  Scans missing reference points are kept, for landmark QA to report. '''
+
+    return [vag_props for vag_props in _iterate_pool_results(_load_worker, filenames, processes, pool) if (vag_props != None)]
+
+def correct_vaginal_properties(propslist, configuration = DEFAULT_CONFIGURATION, processes = BATCH_PROCESSES, pool = None):
+    ''' PICS-correct copies of the raw fiducials of each loaded set of vaginal properties in propslist under configuration,
+    returning the corrected copies in the same order, less any that cannot be corrected.  The files are not re-read, and propslist
+    itself is left unchanged. '''
+
+    arguments = [[vag_props, configuration] for vag_props in propslist]
+
+    return [vag_props for vag_props in _iterate_pool_results(_correct_worker, arguments, processes, pool) if (vag_props != None)]
+
+def transform_vaginal_properties(vag_props, transform):
+    ''' Move every fiducial of a PICS-corrected scan by a 4 x 4 row-vector transform (see Procrustes) and recompute its properties.
+    The scan remembers the transform, so that moving one of its reference landmarks later re-applies it (see move_fiducial). '''
+
+    vag_props.apply_transform(transform)
+
+def procrustes_align_vaginal_properties(propslist, configuration = DEFAULT_CONFIGURATION):
+    ''' Align a list of PICS-corrected scans to each other by Generalized Procrustes analysis over their collated fiducials,
+    with scaling if configuration says so, moving each scan in place.  Returns [collated fiducial names, F x 3 mean shape]. '''
+
+    cohort = get_cohort_arrays_from_properties(propslist, configuration)
+    [transforms, mean_shape, iterations] = generalized_procrustes(cohort._coords, configuration._procrustes_scaling)
+
+    debugprint("Procrustes alignment of " + str(len(propslist)) + " scans took " + str(iterations) + " iterations", debug_levels.BASIC_DEBUG)
+
+    for scanindex in range(len(propslist)):
+        transform_vaginal_properties(propslist[scanindex], transforms[scanindex])
+
+    return [cohort._fid_names, mean_shape]
+
+def align_scan_to_range(vag_props, statscollection, configuration = DEFAULT_CONFIGURATION):
+    ''' Align one PICS-corrected scan, in place, to a range's averaged fiducials by the same fit procrustes_align_vaginal_properties uses. '''
+
+    [names, centers, covariances] = get_fiducial_covariances(statscollection)
+    collated = collate_fiducials_for_scan(vag_props, configuration = configuration)
+
+    shape = empty((1, len(names), 3))
+    shape.fill(nan)
+    for nameindex in range(len(names)):
+        fid = collated.get(names[nameindex])
+        if (fid != None): shape[0, nameindex] = fid.coords[0:3]
+
+    transform_vaginal_properties(vag_props, fit_similarity_transforms(shape, centers, configuration._procrustes_scaling)[0])
+
+def add_scan_to_range(propstats, statscollection, vag_props, configuration = DEFAULT_CONFIGURATION):
+    ''' Add one loaded and PICS-corrected scan to an existing range's property statistics and collated fiducial statistics.
+    Under Procrustes normalization the scan is first aligned to the range's current averaged fiducials - the scans already in the range
+    are not realigned, so the range drifts slightly from what aligning every scan together would give. '''
+
+    if configuration.aligns_by_procrustes():
+        align_scan_to_range(vag_props, statscollection, configuration)
+
+    propstats.add_vaginalproperties(vag_props)
+
+    for fidname, fid in collate_fiducials_for_scan(vag_props, configuration = configuration).iteritems():
+        statscollection.add_fiducial_by_name(fidname, fid)
+
+def remove_scan_from_range(propstats, statscollection, scan_name, configuration = DEFAULT_CONFIGURATION):
+    ''' Undo add_scan_to_range for the scan named scan_name.  Returns the removed VaginalProperties, or None if there was no such scan. '''
+
+    vag_props = propstats.remove_vaginalproperties(scan_name)
+    if (vag_props == None): return None
+
+    for fidname, fid in collate_fiducials_for_scan(vag_props, configuration = configuration).iteritems():
+        statscollection.remove_fiducial_by_name(fidname, fid)
+
+    return vag_props
+
+def get_range_value_matrix(value_lists):
+    ''' Given one list of range values per key, return them as the columns of an array padded out with NaN. '''
+
+    longest = 0
+    for value_list in value_lists:
+        longest = max(longest, len(value_list))
+
+    matrix = empty((longest, len(value_lists)))
+    matrix.fill(nan)
+
+    for keyindex in range(len(value_lists)):
+        matrix[0:len(value_lists[keyindex]), keyindex] = value_lists[keyindex]
+
+    return matrix
+
+def get_range_measure_matrices(propstats, statscollection, configuration = DEFAULT_CONFIGURATION):
+    ''' Gather a range's values for each measure we score and compare: fiducial heights (along the configuration's inferior-superior axis)
+    and paravaginal gaps by standardized name, and widths by row.  Returns an OrderedDict mapping each measure name to a [keys, values] pair,
+    where values is a NaN-padded array with one column per key. '''
+
+    stat_list = statscollection.get_all_stats()
+    keys = stat_list.keys()
+
+    heights = [[fid.coords[configuration._axis_coding_is] for fid in stat_list[key]._fid_collated_list] for key in keys]
+    gaps = [[fid.paravaginal_gap for fid in stat_list[key]._fid_collated_list if (fid.paravaginal_gap != None)] for key in keys]
+    row_keys = ["Row " + str(rowindex + 1) for rowindex in range(len(propstats._vagwidthlists))]
+
+    measures = OrderedDict()
+    measures[HEIGHT_MEASURE] = [keys, get_range_value_matrix(heights)]
+    measures[PARAVAGINAL_GAP_MEASURE] = [keys, get_range_value_matrix(gaps)]
+    measures[WIDTH_MEASURE] = [row_keys, get_range_value_matrix(propstats._vagwidthlists)]
+
+    return measures
+
+def get_range_options(configuration = DEFAULT_CONFIGURATION):
+    ''' Gather every option that changes the numbers in a computed range, so a saved range can record how it was made. '''
+
+    return configuration.get_options()
+
+def _flatten_stat_collection(statscollection):
+    ''' Flatten a FiducialStatCollection into compact arrays: the standardized names, offsets into the collated values for each name,
+    and the original name, coordinates and paravaginal gaps of every collated Fiducial. '''
+
+    stat_names = []
+    offsets = [0]
+    fid_names = []
+    coords = []
+    gaps = []
+
+    for fidname, stats in statscollection.get_all_stats().iteritems():
+        stat_names.append(fidname)
+
+        for fid in stats._fid_collated_list:
+            if (fid == None): continue
+
+            fid_names.append(fid.name)
+            coords.append(fid.coords[0:3])
+            gaps.append([nan if (gap == None) else gap for gap in [fid.paravaginal_gap, fid.paravaginal_gap_is, fid.paravaginal_gap_horiz]])
+
+        offsets.append(len(fid_names))
+
+    return [array(stat_names), array(offsets), array(fid_names), array(coords).reshape((-1, 3)), array(gaps).reshape((-1, 3))]
+
+def _restore_stat_collection(stat_names, offsets, fid_names, coords, gaps):
+    ''' Rebuild a FiducialStatCollection from the arrays created by _flatten_stat_collection, computing each set of statistics once. '''
+
+    statscollection = FiducialStatCollection()
+
+    for statindex in range(len(stat_names)):
+        stats = FiducialStatistics(str(stat_names[statindex]))
+        fids = []
+
+        for fidindex in range(offsets[statindex], offsets[statindex + 1]):
+            x, y, z = coords[fidindex]
+            fid = Fiducial(str(fid_names[fidindex]), x, y, z)
+
+            fid_gaps = [None if isnan(gap) else float(gap) for gap in gaps[fidindex]]
+            [fid.paravaginal_gap, fid.paravaginal_gap_is, fid.paravaginal_gap_horiz] = fid_gaps
+
+            fids.append(fid)
+
+        stats.add_fiducials(fids)
+        statscollection._statsdict[stats._fid_name] = stats
+
+    return statscollection
+
+def save_range_statistics(filename, propstats, statscollection, display, configuration = DEFAULT_CONFIGURATION):
+    ''' Save a computed range (the results of get_stats_and_display_from_properties) to filename, along with the options (configuration)
+    that produced it, so that it can be loaded with load_range_statistics instead of being recomputed from the original MRML files. '''
+
+    arrays = {}
+
+    arrays["format_version"] = array([SAVED_RANGE_FORMAT_VERSION])
+    arrays["options"] = array([json.dumps(get_range_options(configuration))])
+    arrays["display_name"] = array([display._name])
+    arrays["color_strategy"] = array([display._color_strategy])
+    arrays["scan_names"] = array([item[0] for item in propstats._propslist])
+
+    # Both accumulators - the per-name statistics of every raw fiducial, and the collated statistics by standardized name.
+    for prefix, collection in [["property_", propstats._fidstatcollection], ["collated_", statscollection]]:
+        [names, offsets, fid_names, coords, gaps] = _flatten_stat_collection(collection)
+        arrays[prefix + "stat_names"] = names
+        arrays[prefix + "stat_offsets"] = offsets
+        arrays[prefix + "fid_names"] = fid_names
+        arrays[prefix + "coords"] = coords
+        arrays[prefix + "gaps"] = gaps
+
+    width_offsets = [0]
+    for widthlist in propstats._vagwidthlists:
+        width_offsets.append(width_offsets[-1] + len(widthlist))
+
+    arrays["width_offsets"] = array(width_offsets)
+    arrays["width_values"] = array([width for widthlist in propstats._vagwidthlists for width in widthlist], dtype=float)
+
+    arrays["pitch_corrections"] = array(propstats._pitch_correction_list, dtype=float)
+    arrays["roll_corrections"] = array(propstats._roll_correction_list, dtype=float)
+    arrays["yaw_corrections"] = array(propstats._yaw_correction_list, dtype=float)
+
+    # Write through a file object so numpy doesn't tack its own extension onto our filename.
+    with open(filename, 'wb') as outfile:
+        savez_compressed(outfile, **arrays)
+
+def load_range_statistics(filename, display_name = None, configuration = DEFAULT_CONFIGURATION):
+    ''' Load a range saved by save_range_statistics, returning [propstats, statscollection, display] exactly as
+    get_stats_and_display_from_properties would.  The per-scan VaginalProperties are not saved, so propstats._propslist
+    holds [name, None] pairs. Warns if the range was computed under different options than those of configuration. '''
+
+    arrays = load(filename)
+
+    format_version = int(arrays["format_version"][0])
+    if (format_version != SAVED_RANGE_FORMAT_VERSION):
+        raise ValueError("Error: " + filename + " is a saved range of format version " + str(format_version)
+                         + ", but only version " + str(SAVED_RANGE_FORMAT_VERSION) + " can be loaded.")
+
+    saved_options = json.loads(str(arrays["options"][0]))
+    for optionname, optionvalue in get_range_options(configuration).iteritems():
+        if (saved_options.get(optionname) != optionvalue):
+            debugprint("WARNING: Range " + filename + " was computed with " + optionname + " = " + str(saved_options.get(optionname))
+                       + " but it is currently " + str(optionvalue), debug_levels.ERRORS)
+
+    propstats = VaginalPropertyStatistics()
+    propstats._propslist = [[str(name), None] for name in arrays["scan_names"]]
+
+    propstats._fidstatcollection = _restore_stat_collection(arrays["property_stat_names"], arrays["property_stat_offsets"],
+                                                             arrays["property_fid_names"], arrays["property_coords"],
+                                                             arrays["property_gaps"])
+
+    statscollection = _restore_stat_collection(arrays["collated_stat_names"], arrays["collated_stat_offsets"],
+                                               arrays["collated_fid_names"], arrays["collated_coords"],
+                                               arrays["collated_gaps"])
+
+    width_offsets = arrays["width_offsets"]
+    width_values = arrays["width_values"]
+    for rowindex in range(len(width_offsets) - 1):
+        propstats._vagwidthlists.append(width_values[width_offsets[rowindex]:width_offsets[rowindex + 1]].tolist())
+
+    propstats._pitch_correction_list = arrays["pitch_corrections"].tolist()
+    propstats._roll_correction_list = arrays["roll_corrections"].tolist()
+    propstats._yaw_correction_list = arrays["yaw_corrections"].tolist()
+
+    propstats.update_statistics()
+
+    if (display_name == None):
+        display_name = str(arrays["display_name"][0])
+
+    display = create_display_from_statistics(display_name, propstats, statscollection, int(arrays["color_strategy"][0]), configuration)
+
+    return [propstats, statscollection, display]
+
+def is_saved_range_filename(filename):
+    ''' Is this the name of a range saved by save_range_statistics (as opposed to an MRML file)? '''
+    return filename.endswith(SAVED_RANGE_EXTENSION)
+
+def get_range_statistics(display_name, filenames, scan_writer = None, configuration = DEFAULT_CONFIGURATION):
+    ''' Get [propstats, statscollection, display] for a range given on the command line - either a single saved range file,
+    or a list of MRML files to load, PICS-correct and compute statistics over.
+    If scan_writer (see Export.open_table_writer) is given, each loaded scan's results are written to it as soon as that scan is done.
+    A saved range has no per-scan fiducials, so nothing is written for it. '''
+
+    if ((len(filenames) == 1) and is_saved_range_filename(filenames[0])):
+        return load_range_statistics(filenames[0], display_name, configuration)
+
+    # Under Procrustes normalization a scan's final coordinates depend on the whole range, and whether landmark QA excludes a scan depends
+    # on the whole range too, so in either case results can't be written until the end.
+    streaming = (scan_writer != None) and not configuration.aligns_by_procrustes() and not configuration.excludes_landmark_outliers()
+
+    propslist = []
+    for vag_props in iterate_loaded_vaginal_properties(filenames, configuration = configuration):
+        if streaming:
+            scan_writer.write_rows(get_scan_result_rows(vag_props, collate_fiducials_for_scan(vag_props, configuration = configuration)))
+        propslist.append(vag_props)
+
+    propslist = screen_vaginal_properties(propslist, configuration)
+
+    if configuration.aligns_by_procrustes():
+        procrustes_align_vaginal_properties(propslist, configuration)
+
+    if (scan_writer != None) and not streaming:
+        for vag_props in propslist:
+            scan_writer.write_rows(get_scan_result_rows(vag_props, collate_fiducials_for_scan(vag_props, configuration = configuration)))
+
+    return get_stats_and_display_from_properties(display_name, propslist, configuration)
+
+def get_range_statistics_by_configuration(display_name, filenames, configurations, processes = BATCH_PROCESSES):
+    ''' Get [propstats, statscollection, display] for the same MRML files under each of configurations in turn, e.g. under both
+    axis codings, or with and without scaling.  Each file is read once, and one pool of processes corrects the scans for every
+    configuration.  Returns one [propstats, statscollection, display] per configuration, in the same order. '''
+
+    pool = None
+    if (processes != 1) and (len(filenames) > 1): pool = Pool(processes)
+
+    try:
+        raw_propslist = load_raw_vaginal_properties(filenames, processes, pool)
+
+        results = []
+        for configuration in configurations:
+            propslist = screen_vaginal_properties(correct_vaginal_properties(raw_propslist, configuration, processes, pool), configuration)
+            if configuration.aligns_by_procrustes(): procrustes_align_vaginal_properties(propslist, configuration)
+            results.append(get_stats_and_display_from_properties(display_name, propslist, configuration))
+    finally:
+        if (pool != None):
+            pool.close()
+            pool.join()
+
+    return results
+
+def export_cohort_results(propstats, allfidstats, basename = COHORT_RESULTS_FILENAME, export_format = EXPORT_FORMAT,
+                          surface_metrics = COMPUTE_SURFACE_METRICS):
+    ''' Write the per-cohort results table (fiducial positions and gaps, row widths, and tilt correction angles) and return its filename.
+    If surface_metrics is True, also summarize the surface meshes of those scans whose fiducials are loaded (i.e. not from a saved range). '''
+
+    writer = open_table_writer(basename, COHORT_RESULT_COLUMNS, export_format)
+
+    tiltlists = [propstats._pitch_correction_list, propstats._roll_correction_list, propstats._yaw_correction_list]
+    writer.write_rows(get_cohort_result_rows(allfidstats.get_all_stats(), propstats._vagwidthlists, tiltlists))
+
+    if surface_metrics:
+        propslist = [vag_props for name, vag_props in propstats._propslist if (vag_props != None)]
+        writer.write_rows(get_surface_result_rows(get_surface_meshes(propslist)))
+
+    writer.close()
+
+    return basename + get_export_extension(export_format)
 
 def add_errorbars_to_graph(graph, fiducialstats):
     ''' Annotate the graph with standard deviation error bars. '''
@@ -430,7 +995,34 @@ def add_errorbars_to_graph(graph, fiducialstats):
             start_coords=[center_x, center_y, min_z]
             end_coords=[center_x, center_y, max_z]
             add_line_to_graph3D(graph, start_coords, end_coords, "lightblue")
-            
+
+def get_fiducial_covariances(statscollection):
+    ''' Return [fiducial names, K x 3 array of their average coordinates, K x 3 x 3 array of their coordinate covariances]
+    for every fiducial in statscollection, with NaNs for any fiducial without data. '''
+
+    names = statscollection.get_all_stats().keys()
+
+    centers = empty((len(names), 3))
+    covariances = empty((len(names), 3, 3))
+    centers.fill(nan)
+    covariances.fill(nan)
+
+    for nameindex in range(len(names)):
+        fidstats = statscollection.get_stats_for_name(names[nameindex])
+        covariance = fidstats.get_covariance()
+        if (covariance is None) or (fidstats._averaged_fid == None): continue
+
+        centers[nameindex] = fidstats._averaged_fid.coords[0:3]
+        covariances[nameindex] = covariance
+
+    return [names, centers, covariances]
+
+def add_error_ellipsoids_to_graph(graph, fiducialstats, multiplier = STD_DEV_GRAPH_MULTIPLIER):
+    ''' Annotate the graph with a confidence ellipsoid around each average fiducial, following the full covariance of its coordinates
+    out to multiplier standard deviations along each principal axis. '''
+
+    [names, centers, covariances] = get_fiducial_covariances(fiducialstats)
+    add_ellipsoids_to_graph3D(graph, centers, covariance_ellipsoid_axes(covariances, multiplier))
             
 #####################
 ### DEFAULT MAIN PROC
@@ -441,22 +1033,29 @@ if __name__ == '__main__':
     from sys import argv
      
     setdebuglevel(debug_levels.ERRORS) 
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     if len(argv) < 2: 
         debugprint("Need to supply at least one mrml file name argument.",debug_levels.ERROR)
     else:
+        # Write each scan's results out as it finishes loading.
+        scan_writer = open_table_writer(SCAN_RESULTS_FILENAME, SCAN_RESULT_COLUMNS, EXPORT_FORMAT)
+
         # ignore the argv[0], as it's just the filename of this python file.
-        propslist = load_vaginal_properties(argv[1:])
-        for props in propslist:
-            pics_correct_and_verify(props)
+        [propstats, allfidstats, averagedisplay] = get_range_statistics("Computed fiducials", argv[1:], scan_writer)
+        scan_writer.close()
 
-        [propstats, allfidstats, averagedisplay] = get_stats_and_display_from_properties("Computed fiducials", propslist)
+        cohort_filename = export_cohort_results(propstats, allfidstats)
+        print("Wrote results for " + str(len(propstats._propslist)) + " scans to " + SCAN_RESULTS_FILENAME + get_export_extension(EXPORT_FORMAT)
+              + " and " + cohort_filename)
 
         avg_graph = create_pelvic_points_graph(None, averagedisplay, "Computed Statistics")
         
-        add_errorbars_to_graph(avg_graph, allfidstats)
-        
-        print_results(propstats, allfidstats)
+        if (ERROR_DISPLAY == ERROR_DISPLAY_OPTIONS.ELLIPSOIDS):
+            add_error_ellipsoids_to_graph(avg_graph, allfidstats)
+        else:
+            add_errorbars_to_graph(avg_graph, allfidstats)
         
         show_all_graphs()
-        # TODO: Print out statistics and properties in some ordered form, here
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to keep an index of previous patients' scans and find those most like a new one.  Fiducials loaded from the MRML files
+# given as arguments are normalized to the PICS system and added to the index (which is created the first time, and saved after every run).
+# Given a second set of MRML files after a ':', each of those scans is looked up in the index and its most similar previous patients listed.
+# Each scan is compared by its rows resampled onto a standard grid, its row widths and its paravaginal gaps.
+
+# Generic custom imports
+import __init__
+from os.path import isfile
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.CohortArrays import build_cohort_arrays
+from PICS3D_libraries.RowResampling import get_resampled_row_fiducials
+from PICS3D_libraries.PatientIndex import build_patient_index, add_cohort_to_index, query_patient_index
+from PICS3D_libraries.PatientIndex import save_patient_index, load_patient_index
+from ComputeStatistics import load_and_correct_vaginal_properties
+
+# Constants
+from Options import SIMILAR_PATIENTS, PATIENT_INDEX_FILENAME, RESAMPLED_ROW_POINTS
+
+def get_patient_feature_cohort(propslist, point_count = RESAMPLED_ROW_POINTS):
+    ''' Stack a list of vaginal properties into a CohortArrays of their rows resampled onto a standard grid, for indexing. '''
+    return build_cohort_arrays(propslist, get_resampled_row_fiducials(propslist, point_count))
+
+def update_patient_index(filename, propslist):
+    ''' Add a list of vaginal properties to the patient index saved at filename (building it from them if there is none yet),
+    save it, and return it. '''
+
+    if isfile(filename):
+        index = load_patient_index(filename)
+        if (len(propslist) > 0): add_cohort_to_index(index, get_patient_feature_cohort(propslist))
+    else:
+        index = build_patient_index(get_patient_feature_cohort(propslist))
+
+    save_patient_index(filename, index)
+
+    return index
+
+def print_similar_patients(index, propslist, k = SIMILAR_PATIENTS):
+    cohort = get_patient_feature_cohort(propslist)
+    [distances, names] = query_patient_index(index, cohort, k)
+
+    for scanindex in range(cohort.get_scan_count()):
+        print("Most similar to " + cohort._scan_names[scanindex] + ":")
+        for neighbour in range(len(names[scanindex])):
+            print("  " + names[scanindex][neighbour] + " (distance " + str(distances[scanindex][neighbour]) + ")")
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    ARGUMENT_LIST_SEPARATOR = ':'
+
+    if ((len(argv) < 2) or (argv.count(ARGUMENT_LIST_SEPARATOR) > 1)):
+        print("Need to supply mrml file names to add to the patient index, optionally followed by a ':' and more mrml file names to look up in it.")
+        print("E.g. FindSimilarPatients.py 101.mrml 102.mrml 103.mrml : 201.mrml 202.mrml")
+        print("  or FindSimilarPatients.py : 201.mrml 202.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    index_arguments = argv[1:]
+    query_arguments = []
+
+    if (ARGUMENT_LIST_SEPARATOR in argv):
+        separator_index = argv.index(ARGUMENT_LIST_SEPARATOR)
+        index_arguments = argv[1:separator_index]
+        query_arguments = argv[(separator_index + 1):]
+
+    index_propslist = load_and_correct_vaginal_properties(expand_input_arguments(index_arguments))
+
+    if (len(index_propslist) == 0) and not isfile(PATIENT_INDEX_FILENAME):
+        print("There is no patient index at " + PATIENT_INDEX_FILENAME + " yet - supply mrml file names to build it from.")
+        exit()
+
+    index = update_patient_index(PATIENT_INDEX_FILENAME, index_propslist)
+    print("Saved a patient index of " + str(index.get_scan_count()) + " scans to " + PATIENT_INDEX_FILENAME)
+
+    if (len(query_arguments) > 0):
+        print_similar_patients(index, load_and_correct_vaginal_properties(expand_input_arguments(query_arguments)))
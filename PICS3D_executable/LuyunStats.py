@@ -5,15 +5,16 @@
 # Generic custom imports 
 import __init__
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
-from PICS3D_libraries.Options import AXIS_CODING_IS
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # Domain specific custom imports
 from PICS3D_libraries.VaginalDisplay import VaginalDisplay
 from PICS3D_libraries.PICSMath import pics_recenter_and_reorient, pics_verify
-from PICS3D_executable.ComputeStatistics import collate_fiducials_reference_points,collate_fiducials_by_edges,collate_fiducials_by_row_and_column
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, get_scan_result_rows, get_lowest_fiducial, SCAN_RESULT_COLUMNS
+from PICS3D_executable.ComputeStatistics import collate_fiducials_for_scan
 
 # Constants
-from Options import COLOR_STRAT
+from Options import COLOR_STRAT, EXPORT_FORMAT, SCAN_RESULTS_FILENAME
 
 #####################
 ### DEFAULT MAIN PROC
@@ -24,11 +25,16 @@ if __name__ == '__main__':
     from sys import argv
              
     setdebuglevel(debug_levels.BASIC_DEBUG)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     if len(argv) < 2: 
         print "Need to supply mrml file name argument."
     else:
         
+        scan_writer = open_table_writer(SCAN_RESULTS_FILENAME, SCAN_RESULT_COLUMNS, EXPORT_FORMAT)
+
         for i in range(1,len(argv)):
             filename = argv[i]
         
@@ -44,53 +50,19 @@ if __name__ == '__main__':
                 
             print(vag_props.to_string())
             
-            # Print all the reference point fiducials as CSV.
-            print("\nLandmark fiducial list: ************")
-            
-            fidstats = collate_fiducials_reference_points([vag_props])
-            fiddict = fidstats.get_all_stats()
-            
-            for fidstat in fiddict.itervalues():
-                print(fidstat._averaged_fid.to_csv())
-            
-            # Print all the vaginal edge point fiducials as CSV.
-            print("\nEdge fiducial list: ************")
-                        
-            fidstats = collate_fiducials_by_edges([vag_props])
-            fiddict = fidstats.get_all_stats()
-            
-            for fidstat in fiddict.itervalues():
-                print(fidstat._averaged_fid.to_csv() + " " 
-                      + " Paravag Gap (Total, IS, LR/AP): " 
-                      + str(fidstat._averaged_paravag_gap) + ","
-                      + str(fidstat._averaged_paravag_gap_is) + ","
-                      + str(fidstat._averaged_paravag_gap_horiz))
-            
+            # Write one row per landmark, edge and individual fiducial to the scan results table.
+            fid_dict = collate_fiducials_for_scan(vag_props, include_all = True)
+            scan_writer.write_rows(get_scan_result_rows(vag_props, fid_dict))
 
-            # Print all the vaginal fiducials as CSV.
-            print("\nDetailed fiducial list: ************")
-            
-            fidstats = collate_fiducials_by_row_and_column([vag_props])
-            fiddict = fidstats.get_all_stats()
-            
-            can_compute_lowest_height = True
-            lowest_height = float("inf") #infinity
-            lowest_fiducial = None
-            
-            for fidstat in fiddict.itervalues():
-                fid = fidstat._averaged_fid
-                
-                if (fid.coords[AXIS_CODING_IS] < lowest_height):
-                    lowest_fiducial = fid
-                    lowest_height = fid.coords[AXIS_CODING_IS]
-            
-                print(fid.to_csv())
-            
             # Print the lowest fiducial point (assuming it's the "worst prolapse").
-            print("\nLowest Fiducial: ************")    
+            print("\nLowest Fiducial: ************")
+            lowest_fiducial = get_lowest_fiducial(fid_dict)
             if (lowest_fiducial == None):
                 print("Could not compute a lowest height fiducial.")
             else: 
                 print("Lowest height fiducial is " + lowest_fiducial.to_string())
-            
+
+        scan_writer.close()
+        print("\nWrote fiducial results to " + SCAN_RESULTS_FILENAME + get_export_extension(EXPORT_FORMAT))
+
         debugprint('Now leaving pelvic points program',debug_levels.DETAILED_DEBUG)
\ No newline at end of file
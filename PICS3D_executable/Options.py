@@ -2,7 +2,7 @@
 # Author: Sean Lisse
 # This code contains all user-editable options for the PICS3D code.
 
-from PICS3D_libraries.Options import enum, AXIS_CODING_IS
+from PICS3D_libraries.Options import enum, AXIS_CODING_IS, AXIS_CODING_OPTIONS, EXPORT_FORMAT_OPTIONS
 from pylab import rcParams
 
 # *****************************************************************
@@ -19,9 +19,244 @@ COMPUTE_CENTER = False
 # Should we compute statistics for all points by name?
 COMPUTE_ALL_INDIVIDUAL_POINTS = False
 
+# Should we compute statistics for each row resampled to RESAMPLED_ROW_POINTS points evenly spaced along it?  Resampled points line up
+# across scans however many columns each was annotated with, so they cover the whole wall rather than just its edges.
+COMPUTE_RESAMPLED_ROWS = False
+RESAMPLED_ROW_POINTS = 11
+
 # How long should the std dev whiskers be?  (length = std_dev * STD_DEV_GRAPH_MULTIPLIER)
+# Covariance ellipsoids reach the same number of standard deviations along each of their principal axes.
 STD_DEV_GRAPH_MULTIPLIER = 2
 
+# Should the averaged display show each fiducial's spread as axis-aligned std dev whiskers, or as a covariance ellipsoid?
+ERROR_DISPLAY_OPTIONS = enum('WHISKERS', 'ELLIPSOIDS')
+ERROR_DISPLAY = ERROR_DISPLAY_OPTIONS.ELLIPSOIDS
+
+# Should ranges be normalized by PICS alone, or should the PICS-normalized scans then be aligned to each other by Generalized
+# Procrustes analysis over all their collated fiducials?  Procrustes alignment keeps the PICS frame, but lessens the effect of any one
+# imprecise reference landmark.  PROCRUSTES_SCALING also scales each scan to best fit the cohort's mean shape.
+NORMALIZATION_OPTIONS = enum('PICS', 'PROCRUSTES')
+NORMALIZATION = NORMALIZATION_OPTIONS.PICS
+PROCRUSTES_SCALING = False
+
+# *****************************************************************
+# Batch processing options
+# *****************************************************************
+
+# How many processes should we use to load and PICS-correct large batches of MRML files?  None means one per CPU.
+BATCH_PROCESSES = None
+
+# Ranges saved by BuildRange end with this extension, and can be given in place of a list of MRML files to
+# ComputeStatistics, CompareToRange and CompareRanges.
+SAVED_RANGE_EXTENSION = ".pics3drange"
+
+# Bump this whenever the layout of a saved range file changes.
+SAVED_RANGE_FORMAT_VERSION = 1
+
+# Where should CompareToRange write its table of per-patient scores when comparing many exemplars to one range?
+RANGE_SCORE_FILENAME = "range_scores.csv"
+
+# ... and its table of each scan's scores against the rest of the range, when scoring a range against itself (leaving one out)?
+LEAVE_ONE_OUT_SCORE_FILENAME = "leave_one_out_scores.csv"
+
+# Which metadata manifest columns should ComputeGroupStatistics group the scans by, when none are given on the command line?  Join several
+# columns with '+' to group by every combination of their values, e.g. ["Diagnosis", "Diagnosis+Age Band"].  None means each column alone.
+GROUP_BY = None
+
+# Base name of ComputeGroupStatistics' table of per-group statistics - the extension is added to match EXPORT_FORMAT.
+GROUP_RESULTS_FILENAME = "group_results"
+
+# Before a batch's scans enter any statistics, landmark QA compares each scan's PICS reference landmark geometry (SCIPP line length,
+# ischial spine width, tilt correction angles, and how far from perpendicular its LR and AP axes lie) with the rest of the batch.
+# Scans with missing, degenerate or outlying landmarks can just be reported, or excluded as well.
+LANDMARK_QA_OPTIONS = enum('OFF', 'REPORT', 'EXCLUDE')
+LANDMARK_QA = LANDMARK_QA_OPTIONS.REPORT
+
+# Base name of CheckLandmarks' table of each scan's landmark QA results - the extension is added to match EXPORT_FORMAT.
+LANDMARK_QA_FILENAME = "landmark_qa"
+
+# *****************************************************************
+# Export options
+# *****************************************************************
+
+# Which format should per-scan and per-cohort result tables be written in?
+EXPORT_FORMAT = EXPORT_FORMAT_OPTIONS.CSV
+
+# Base names of the result tables - the extension (.csv or .npz) is added to match EXPORT_FORMAT.
+SCAN_RESULTS_FILENAME = "scan_results"
+COHORT_RESULTS_FILENAME = "cohort_results"
+
+# Should the cohort results table also summarize the surface triangulated through each scan's row and column fiducials
+# (surface area, and the area and cross section of each row)?
+COMPUTE_SURFACE_METRICS = False
+
+# Which points should CompareFiducials pair up between its two scans - the two edges of each row, each row resampled to
+# RESAMPLED_ROW_POINTS points evenly spaced along it (which pairs up the whole wall), or every row and column fiducial of the second scan
+# with the nearest such fiducial of the first (which needs no shared layout at all)?
+FIDUCIAL_COMPARISON_OPTIONS = enum('EDGES', 'RESAMPLED_ROWS', 'NEAREST')
+FIDUCIAL_COMPARISON = FIDUCIAL_COMPARISON_OPTIONS.EDGES
+
+# When pairing up nearest fiducials, should each fiducial only be matched to fiducials of the same row?
+NEAREST_SAME_ROW = True
+
+# How many seconds should WatchDirectory wait between checks for new, changed or removed scans?
+WATCH_POLL_SECONDS = 5
+
+# Where should WatchDirectory keep its results - one scan results table per scan, plus the cohort results table?
+WATCH_RESULTS_DIRECTORY = "pics3d_results"
+
+# *****************************************************************
+# Analysis server options
+# *****************************************************************
+
+# Where should AnalysisServer listen for HTTP requests?  Set SERVER_SOCKET to a file name to listen on a Unix socket instead.
+SERVER_ADDRESS = "127.0.0.1"
+SERVER_PORT = 8042
+SERVER_SOCKET = None
+
+# How many processes should AnalysisServer use to PICS-correct submitted scans?  None means one per CPU.
+SERVER_PROCESSES = None
+
+# *****************************************************************
+# Range comparison statistics options
+# *****************************************************************
+
+# How many random shufflings should the permutation test use when CompareRanges compares two groups?
+COMPARISON_RESAMPLES = 10000
+
+# Random seed for those shufflings, so that repeated comparisons give identical p-values.
+COMPARISON_SEED = 0
+
+# How should CompareRanges correct its p-values for the number of fiducials and rows it tests at once?
+MULTIPLE_COMPARISON_OPTIONS = enum('HOLM', 'BENJAMINI_HOCHBERG')
+MULTIPLE_COMPARISON_CORRECTION = MULTIPLE_COMPARISON_OPTIONS.HOLM
+
+# Where should CompareRanges write its table of per-fiducial and per-row comparisons?
+RANGE_COMPARISON_FILENAME = "range_comparison.csv"
+
+# How many bootstrap resamples should BootstrapRange draw for its confidence intervals, and at what confidence level?
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_CONFIDENCE = 0.95
+
+# Where should BootstrapRange write its table of confidence intervals (and group comparisons)?
+BOOTSTRAP_FILENAME = "bootstrap_statistics.csv"
+
+# *****************************************************************
+# Parameter sweep options
+# *****************************************************************
+
+# ParameterSweep corrects the cohort under every combination of these settings.
+# SCIPP angles are in degrees above horizontal (the usual DESIRED_SCIPP_ANGLE is 34 degrees).
+SWEEP_AXIS_CODINGS = [AXIS_CODING_OPTIONS.lisse, AXIS_CODING_OPTIONS.pics3d]
+SWEEP_SCIPP_ANGLES = [30, 32, 34, 36, 38]
+SWEEP_SCALE_BY_SCIPP_LINE = [False, True]
+SWEEP_SCALE_BY_IIS_LINE = [False, True]
+
+# Base name of the table of cohort statistics for every combination - the extension is added to match EXPORT_FORMAT.
+SWEEP_RESULTS_FILENAME = "parameter_sweep"
+
+# *****************************************************************
+# Shape model options
+# *****************************************************************
+
+# How many principal modes of shape variation should ShapeModes find?
+SHAPE_MODEL_MODES = 5
+
+# Shape models saved by ShapeModes end with this extension, and can be given to it in place of the cohort's MRML files.
+SAVED_SHAPE_MODEL_EXTENSION = ".pics3dshape"
+SHAPE_MODEL_FILENAME = "shape_model" + SAVED_SHAPE_MODEL_EXTENSION
+
+# Base names of the tables of each scan's mode scores, and of each mode's share of the cohort's variance -
+# the extension is added to match EXPORT_FORMAT.
+SHAPE_SCORES_FILENAME = "shape_scores"
+SHAPE_MODES_FILENAME = "shape_modes"
+
+# *****************************************************************
+# Cohort distance options
+# *****************************************************************
+
+# Over which fiducials should CohortDistances compare every two scans - the standardized fiducials they share (as collated for statistics),
+# or each row resampled to RESAMPLED_ROW_POINTS points evenly spaced along it (which lines up scans annotated with different columns)?
+SCAN_DISTANCE_FIDUCIALS_OPTIONS = enum('SHARED', 'RESAMPLED_ROWS')
+SCAN_DISTANCE_FIDUCIALS = SCAN_DISTANCE_FIDUCIALS_OPTIONS.SHARED
+
+# Distance matrices saved by CohortDistances end with this extension.
+SAVED_SCAN_DISTANCES_EXTENSION = ".pics3ddist"
+SCAN_DISTANCES_FILENAME = "scan_distances" + SAVED_SCAN_DISTANCES_EXTENSION
+
+# *****************************************************************
+# Patient index options
+# *****************************************************************
+
+# How many of the most similar previous patients should FindSimilarPatients list for each new scan?
+SIMILAR_PATIENTS = 5
+
+# The index of previous patients that FindSimilarPatients builds, adds new scans to, and searches.
+SAVED_PATIENT_INDEX_EXTENSION = ".pics3dindex"
+PATIENT_INDEX_FILENAME = "patient_index" + SAVED_PATIENT_INDEX_EXTENSION
+
+# *****************************************************************
+# Longitudinal options
+# *****************************************************************
+
+# CompareTimepoints reads each scan's patient and timepoint from these columns of its metadata manifest.
+LONGITUDINAL_PATIENT_FIELD = "Patient"
+LONGITUDINAL_TIMEPOINT_FIELD = "Timepoint"
+
+# The order of the timepoints, e.g. ["Pre", "Post", "Followup"]; scans at any other timepoint are left out.  None orders them by their
+# first appearance in the metadata manifest.
+LONGITUDINAL_TIMEPOINTS = None
+
+# Should each of a patient's later scans be compared with the patient's first (BASELINE) scan, or with the scan just before it?
+LONGITUDINAL_PAIRING_OPTIONS = enum('BASELINE', 'CONSECUTIVE')
+LONGITUDINAL_PAIRING = LONGITUDINAL_PAIRING_OPTIONS.BASELINE
+
+# Base names of CompareTimepoints' tables of every change of every pair of scans, and of the summary of each change over each kind of
+# pair - the extension is added to match EXPORT_FORMAT.
+PAIR_CHANGES_FILENAME = "pair_changes"
+CHANGE_SUMMARY_FILENAME = "change_summary"
+
+# CompareTimepoints saves a summary figure of the changes in height, and if LONGITUDINAL_PAIR_FIGURES is True, a figure of each pair of
+# scans, as PNG files in this directory.
+LONGITUDINAL_FIGURES_DIRECTORY = "longitudinal_figures"
+LONGITUDINAL_PAIR_FIGURES = True
+
+# *****************************************************************
+# Atlas options
+# *****************************************************************
+
+# The atlas that BuildAtlas creates, adds new scans to, and draws.  It is a directory, whose voxel totals are memory-mapped when opened.
+SAVED_ATLAS_EXTENSION = ".pics3datlas"
+ATLAS_DIRECTORY = "atlas" + SAVED_ATLAS_EXTENSION
+
+# The atlas grid runs from ATLAS_LOWER_CORNER to ATLAS_UPPER_CORNER (PICS coordinates in mm, in AXIS_CODING order) in cubic voxels
+# ATLAS_VOXEL_SIZE mm across.  These only take effect when an atlas is created - later scans are added on the grid it was created with.
+ATLAS_LOWER_CORNER = [-64.0, -32.0, -48.0]
+ATLAS_UPPER_CORNER = [64.0, 128.0, 80.0]
+ATLAS_VOXEL_SIZE = 2.0
+
+# Each scan's rows are resampled to this many points evenly spaced along them before binning, so that the atlas follows the whole wall
+# rather than only the annotated columns.  Set to None to bin just the annotated row and column fiducials.
+ATLAS_ROW_POINTS = 41
+
+# BuildAtlas draws slices through the atlas at this point (PICS coordinates in mm), one across each axis, as PNG files in
+# ATLAS_FIGURES_DIRECTORY.  None slices through the voxel the most scans pass through.
+ATLAS_SLICE_POINT = None
+ATLAS_FIGURES_DIRECTORY = "atlas_figures"
+
+# *****************************************************************
+# Cohort triage options
+# *****************************************************************
+
+# TriageCohort flags every scan with a vaginal wall fiducial at least this far (in mm) below the PICS plane...
+TRIAGE_DEPTH = 10.0
+
+# ... and lists this many of each scan's lowest fiducials.
+LOWEST_POINTS_PER_SCAN = 3
+
+# Base name of TriageCohort's table of each scan's lowest fiducials - the extension is added to match EXPORT_FORMAT.
+TRIAGE_FILENAME = "triage"
+
 # *****************************************************************
 # Basic Graphing options
 # *****************************************************************
@@ -55,6 +290,16 @@ DEFAULT_COLOR=[0.5,0.5,0.75]
 
 REFERENCE_POINT_COLOR = [0,0,0]
 
+# Color and transparency of covariance ellipsoids, and how many facets around each ellipsoid's equator (half as many pole to pole).
+ELLIPSOID_COLOR = 'lightblue'
+ELLIPSOID_ALPHA = 0.3
+ELLIPSOID_MESH_RESOLUTION = 16
+
+# Should we draw the surface triangulated through each scan's row and column fiducials, and in what color and transparency?
+SHOW_SURFACE_MESH = False
+SURFACE_COLOR = 'pink'
+SURFACE_ALPHA = 0.5
+
 # Used for sequential_color_fn
 SEQ_COLOR_FN_STEP_SIZE = 0.1
 
@@ -110,4 +355,8 @@ DRAW_AXIS_LABELS = True
 # *****************************************************************
 
 RANGE_ONE_COLOR = 'darkred'
-RANGE_TWO_COLOR = 'darkblue'
\ No newline at end of file
+RANGE_TWO_COLOR = 'darkblue'
+
+# Colors of the earlier and later scans of a pair in CompareTimepoints' figures
+BEFORE_COLOR = 'grey'
+AFTER_COLOR = 'darkred'
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments once, then normalize them to the PICS system under
+# every combination of the SWEEP_ settings in Options.py (axis coding, SCIPP angle, and SCIPP and IIS scaling), writing the cohort
+# statistics - fiducial heights, paravaginal gaps, row widths and tilt correction angles - for each combination to one table.
+
+# Generic custom imports
+import __init__
+import numpy as np
+from itertools import product
+from collections import OrderedDict
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, degrees_to_rad, rad_to_degrees
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.PICSBatch import build_raw_cohort_arrays, sweep_cohort
+from PICS3D_libraries.CohortArrays import GAP_COMPONENTS
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, COHORT_RESULT_COLUMNS
+from PICS3D_libraries.Options import AXIS_CODING_OPTIONS
+from ComputeStatistics import DEFAULT_CONFIGURATION, load_raw_vaginal_properties, collate_fiducials_for_scan
+from ComputeStatistics import HEIGHT_MEASURE, PARAVAGINAL_GAP_MEASURE, WIDTH_MEASURE
+
+# Constants
+from Options import SWEEP_AXIS_CODINGS, SWEEP_SCIPP_ANGLES, SWEEP_SCALE_BY_SCIPP_LINE, SWEEP_SCALE_BY_IIS_LINE, SWEEP_RESULTS_FILENAME
+from Options import EXPORT_FORMAT
+
+# Columns naming the settings of each row of the sweep table, which go before the usual per-cohort result columns.
+SWEEP_SETTING_COLUMNS = ["Axis Coding", "SCIPP Angle", "Scale By SCIPP Line", "Scale By IIS Line"]
+
+# The options sweep_cohort applies itself, in one batched pass.  Configurations differing in any other option (say, which fiducials
+# are collated) are collated and swept separately.
+BATCHED_SWEEP_OPTIONS = ["AXIS_CODING", "DESIRED_SCIPP_ANGLE", "SCALE_BY_SCIPP_LINE", "SCALE_BY_IIS_LINE", "SCIPP_SCALE_LENGTH",
+                         "IIS_SCALE_LENGTH"]
+
+# Names of the gap components, in GAP_COMPONENTS order, as measure names in the results table.
+GAP_MEASURES = [PARAVAGINAL_GAP_MEASURE, PARAVAGINAL_GAP_MEASURE + " IS", PARAVAGINAL_GAP_MEASURE + " Horizontal"]
+
+def get_sweep_configurations(axis_codings = SWEEP_AXIS_CODINGS, scipp_angles = SWEEP_SCIPP_ANGLES,
+                             scale_by_scipp = SWEEP_SCALE_BY_SCIPP_LINE, scale_by_iis = SWEEP_SCALE_BY_IIS_LINE,
+                             base_configuration = DEFAULT_CONFIGURATION):
+    ''' Build one configuration for every combination of the given settings (SCIPP angles in degrees above horizontal),
+    with every other option as in base_configuration. '''
+
+    configurations = []
+    for axis_coding, angle, scipp, iis in product(axis_codings, scipp_angles, scale_by_scipp, scale_by_iis):
+        configurations.append(base_configuration.copy(AXIS_CODING = axis_coding, DESIRED_SCIPP_ANGLE = -1 * degrees_to_rad(angle),
+                                                      SCALE_BY_SCIPP_LINE = scipp, SCALE_BY_IIS_LINE = iis))
+
+    return configurations
+
+def _get_axis_coding_name(axis_coding):
+    for name in ['lisse', 'pics3d']:
+        if (getattr(AXIS_CODING_OPTIONS, name) == axis_coding): return name
+    return str(axis_coding)
+
+def _summarize_columns(measure, keys, values):
+    ''' Per-cohort table rows (measure, key, count, mean and std dev) for each column of an N x K array of values, ignoring NaN. '''
+
+    counts = (~np.isnan(values)).sum(axis=0)
+    filled = np.where(np.isnan(values), 0, values)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = filled.sum(axis=0) / counts
+        std_devs = np.sqrt((np.where(np.isnan(values), 0, values - means) ** 2).sum(axis=0) / counts)
+
+    rows = []
+    for keyindex in range(len(keys)):
+        if (counts[keyindex] == 0):
+            rows.append([measure, keys[keyindex], 0, None, None])
+        else:
+            rows.append([measure, keys[keyindex], int(counts[keyindex]), means[keyindex], std_devs[keyindex]])
+
+    return rows
+
+def get_sweep_result_rows(configuration, cohort):
+    ''' Build the sweep table rows for a cohort corrected under configuration: the settings, then the per-cohort summary of
+    every fiducial's height and paravaginal gaps, every row's width, and each tilt correction angle. '''
+
+    # Round away the error of converting the SCIPP angle to radians and back.
+    settings = [_get_axis_coding_name(configuration._axis_coding), round(-1 * rad_to_degrees(configuration._desired_scipp_angle), 6),
+                int(configuration._scale_by_scipp_line), int(configuration._scale_by_iis_line)]
+
+    row_keys = ["Row " + str(rowindex + 1) for rowindex in range(cohort._widths.shape[1])]
+
+    rows = _summarize_columns(HEIGHT_MEASURE, cohort._fid_names, cohort.get_heights(configuration._axis_coding_is))
+    for component in [GAP_COMPONENTS.TOTAL, GAP_COMPONENTS.IS, GAP_COMPONENTS.HORIZ]:
+        rows += _summarize_columns(GAP_MEASURES[component], cohort._fid_names, cohort._gaps[:, :, component])
+    rows += _summarize_columns(WIDTH_MEASURE, row_keys, cohort._widths)
+    rows += _summarize_columns("Tilt Correction", ["Pitch", "Roll", "Yaw"], cohort._tilt)
+
+    return [settings + row for row in rows]
+
+def run_parameter_sweep(filenames, configurations, basename = SWEEP_RESULTS_FILENAME, export_format = EXPORT_FORMAT):
+    ''' Load the MRML filenames once, correct them under every one of configurations in batched passes (one for each set of
+    configurations differing only in BATCHED_SWEEP_OPTIONS, each collated under its own settings), and write the cohort statistics for
+    each to one table.  Returns [number of scans swept, table filename].  Raises ValueError for a configuration the sweep can't honour. '''
+
+    for configuration in configurations:
+        if configuration.aligns_by_procrustes():
+            raise ValueError("Error: The parameter sweep cannot align scans by Procrustes analysis; set NORMALIZATION to PICS to sweep.")
+        if configuration.excludes_landmark_outliers():
+            raise ValueError("Error: The parameter sweep cannot exclude landmark QA outliers; set LANDMARK_QA to OFF or REPORT to sweep.")
+
+    collation_groups = OrderedDict()
+    for configindex in range(len(configurations)):
+        options = configurations[configindex].get_options()
+        key = tuple([value for optionname, value in options.iteritems() if (optionname not in BATCHED_SWEEP_OPTIONS)])
+        collation_groups.setdefault(key, []).append(configindex)
+
+    raw_propslist = load_raw_vaginal_properties(filenames)
+
+    cohorts = [None] * len(configurations)
+    scan_count = 0
+    for configindices in collation_groups.values():
+        group = [configurations[configindex] for configindex in configindices]
+        collated_fid_dicts = [collate_fiducials_for_scan(vag_props, configuration = group[0]) for vag_props in raw_propslist]
+
+        raw_cohort = build_raw_cohort_arrays(raw_propslist, collated_fid_dicts)
+        scan_count = raw_cohort.get_scan_count()
+
+        for configindex, cohort in zip(configindices, sweep_cohort(raw_cohort, group)):
+            cohorts[configindex] = cohort
+
+    writer = open_table_writer(basename, SWEEP_SETTING_COLUMNS + COHORT_RESULT_COLUMNS, export_format)
+    for configuration, cohort in zip(configurations, cohorts):
+        writer.write_rows(get_sweep_result_rows(configuration, cohort))
+    writer.close()
+
+    return [scan_count, basename + get_export_extension(export_format)]
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if (len(argv) < 2):
+        print("Need to supply mrml file names, directories or manifests as arguments.")
+        print("E.g. ParameterSweep.py 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    configurations = get_sweep_configurations()
+
+    try:
+        [scan_count, filename] = run_parameter_sweep(argv[1:], configurations)
+    except ValueError as error:
+        print(str(error))
+        exit()
+
+    print("Swept " + str(scan_count) + " scans under " + str(len(configurations)) + " settings, writing the results to " + filename)
@@ -6,20 +6,22 @@ import __init__
 
 # Nonspecific imports
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # My custom domain imports
 from PICS3D_libraries.VaginalDisplay import VaginalDisplay
 
 # Graphing custom imports
 from PICS3D_libraries.Graphing import add_fiducials_to_graph3D, add_line_to_graph3D, add_scatterpoint_to_graph3D
-from PICS3D_libraries.Graphing import set_graph_boundaries3D, show_all_graphs, PelvicGraph3D
+from PICS3D_libraries.Graphing import set_graph_boundaries3D, show_all_graphs, PelvicGraph3D, add_surface_to_graph3D
+from PICS3D_libraries.SurfaceMesh import get_surface_mesh
 from PICS3D_libraries.GraphColoring import calibrate_colorization_strategy_fn
 
 # Constants
 from PICS3D_libraries.Options import COORDS, INTER_ISCHIAL_SPINE_NAME, CREATE_IIS
 from PICS3D_executable.Options import DRAW_PS_IS_LINES
 
-from Options import COLOR_STRAT, PAD_GRAPH
+from Options import COLOR_STRAT, PAD_GRAPH, SHOW_SURFACE_MESH
 
 def create_pelvic_points_graph(graph, vagdisplay, graphname):
 
@@ -29,6 +31,9 @@ def create_pelvic_points_graph(graph, vagdisplay, graphname):
     [color_fn, minmax_distances] = calibrate_colorization_strategy_fn(vagdisplay)
     
     add_fiducials_to_graph3D(graph, vagdisplay, color_fn)
+
+    if SHOW_SURFACE_MESH:
+        add_surface_to_graph3D(graph, get_surface_mesh(vagdisplay))
     
     PS_coords = vagdisplay._Pubic_Symphysis.coords
     L_IS_coords = vagdisplay._Left_IS.coords
@@ -75,6 +80,9 @@ if __name__ == '__main__':
     from sys import argv
      
     setdebuglevel(debug_levels.BASIC_DEBUG) 
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     if len(argv) < 2: 
         print "Need to supply mrml file name argument."
@@ -88,6 +96,9 @@ if __name__ == '__main__':
         graph = create_pelvic_points_graph(None, vagdisplay, filename)
         
         print(vagdisplay.to_string())
+
+        if SHOW_SURFACE_MESH:
+            print("Surface area: " + str(get_surface_mesh(vagdisplay).get_area()) + " mm^2")
         
         show_all_graphs()
         
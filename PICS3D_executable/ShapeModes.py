@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments, normalize them to the PICS system, and build a
+# statistical shape model of them - the principal modes in which their shapes vary about the mean - saving the model for later use.
+# Each scan's scores along those modes are written to a table.  Given a second set of fiducials after a ':', those scans are projected
+# onto the modes too.  A saved shape model can be given in place of the cohort's MRML files to skip straight to projecting; any MRML files
+# following it (before the ':') are added to that model incrementally, without rebuilding it, and the updated model is saved back.
+
+# Generic custom imports
+import __init__
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.ShapeModel import build_shape_model_from_cohort, add_cohort_to_shape_model, project_cohort, save_shape_model
+from PICS3D_libraries.ShapeModel import load_shape_model
+from PICS3D_libraries.Export import open_table_writer, get_export_extension
+from ComputeStatistics import load_and_correct_vaginal_properties, get_cohort_arrays_from_properties
+
+# Constants
+from Options import SHAPE_MODEL_MODES, SAVED_SHAPE_MODEL_EXTENSION, SHAPE_MODEL_FILENAME, SHAPE_SCORES_FILENAME, SHAPE_MODES_FILENAME
+from Options import EXPORT_FORMAT
+
+# Column headings for the table of each mode's share of the cohort's variance
+SHAPE_MODE_COLUMNS = ["Mode", "Singular Value", "Variance", "Explained Variance"]
+
+def get_shape_score_columns(model):
+    return ["Scan"] + ["Mode " + str(modeindex + 1) for modeindex in range(model.get_mode_count())]
+
+def get_shape_mode_rows(model):
+    variances = model.get_mode_variances()
+    ratios = model.get_explained_variance_ratios()
+
+    return [[modeindex + 1, model._singular_values[modeindex], variances[modeindex], ratios[modeindex]]
+            for modeindex in range(model.get_mode_count())]
+
+def get_shape_score_rows(model, cohort):
+    ''' Project every scan of a CohortArrays onto the model's modes, returning one table row of scores per scan. '''
+
+    scores = project_cohort(model, cohort)
+    return [[cohort._scan_names[scanindex]] + scores[scanindex].tolist() for scanindex in range(cohort.get_scan_count())]
+
+def is_saved_shape_model_filename(filename):
+    return filename.endswith(SAVED_SHAPE_MODEL_EXTENSION)
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    ARGUMENT_LIST_SEPARATOR = ':'
+
+    if ((len(argv) < 2) or (argv.count(ARGUMENT_LIST_SEPARATOR) > 1)):
+        print("Need to supply mrml file names (or a saved shape model) as arguments, optionally followed by a ':' and more mrml file names to project onto the model.")
+        print("E.g. ShapeModes.py 101.mrml 102.mrml 103.mrml : 201.mrml 202.mrml")
+        print("  or ShapeModes.py " + SHAPE_MODEL_FILENAME + " : 201.mrml 202.mrml")
+        print("  or ShapeModes.py " + SHAPE_MODEL_FILENAME + " 104.mrml 105.mrml : 201.mrml 202.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    model_arguments = argv[1:]
+    project_arguments = []
+
+    if (ARGUMENT_LIST_SEPARATOR in argv):
+        separator_index = argv.index(ARGUMENT_LIST_SEPARATOR)
+        model_arguments = argv[1:separator_index]
+        project_arguments = argv[(separator_index + 1):]
+
+    cohorts = []
+
+    if ((len(model_arguments) > 0) and is_saved_shape_model_filename(model_arguments[0])):
+        model = load_shape_model(model_arguments[0])
+        print("Loaded a shape model of " + str(model.get_mode_count()) + " modes from " + model_arguments[0])
+
+        if (len(model_arguments) > 1):
+            cohort = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(expand_input_arguments(model_arguments[1:])))
+            cohorts.append(cohort)
+
+            add_cohort_to_shape_model(model, cohort)
+            save_shape_model(model_arguments[0], model)
+            print("Added " + str(cohort.get_scan_count()) + " scans to the shape model, now over " + str(model._scan_count)
+                  + " scans, and saved it to " + model_arguments[0])
+    else:
+        cohort = get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(expand_input_arguments(model_arguments)))
+        cohorts.append(cohort)
+
+        model = build_shape_model_from_cohort(cohort, SHAPE_MODEL_MODES)
+        save_shape_model(SHAPE_MODEL_FILENAME, model)
+        print("Saved a shape model of " + str(model.get_mode_count()) + " modes over " + str(model._scan_count) + " scans to " + SHAPE_MODEL_FILENAME)
+
+    if (len(project_arguments) > 0):
+        cohorts.append(get_cohort_arrays_from_properties(load_and_correct_vaginal_properties(expand_input_arguments(project_arguments))))
+
+    mode_writer = open_table_writer(SHAPE_MODES_FILENAME, SHAPE_MODE_COLUMNS, EXPORT_FORMAT)
+    mode_writer.write_rows(get_shape_mode_rows(model))
+    mode_writer.close()
+
+    score_writer = open_table_writer(SHAPE_SCORES_FILENAME, get_shape_score_columns(model), EXPORT_FORMAT)
+    scan_count = 0
+    for cohort in cohorts:
+        score_writer.write_rows(get_shape_score_rows(model, cohort))
+        scan_count += cohort.get_scan_count()
+    score_writer.close()
+
+    print("Wrote mode scores for " + str(scan_count) + " scans to " + SHAPE_SCORES_FILENAME + get_export_extension(EXPORT_FORMAT)
+          + " and mode variances to " + SHAPE_MODES_FILENAME + get_export_extension(EXPORT_FORMAT))
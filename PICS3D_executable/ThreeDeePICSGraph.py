@@ -5,6 +5,7 @@
 # Generic custom imports 
 import __init__
 from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
 
 # Domain specific custom imports
 from PICS3D_libraries.VaginalDisplay import VaginalDisplay
@@ -24,6 +25,9 @@ if __name__ == '__main__':
     from sys import argv
              
     setdebuglevel(debug_levels.BASIC_DEBUG)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
     
     if len(argv) < 2: 
         print "Need to supply mrml file name argument."
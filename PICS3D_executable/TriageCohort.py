@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to load in a set of fiducials from command-line arguments, normalize them to the PICS system, and triage the cohort:
+# every scan with a vaginal wall fiducial more than TRIAGE_DEPTH below the PICS plane is listed, and each scan's lowest few fiducials are
+# written to a table.  All of the cohort's fiducials are placed in one spatial index, so the whole cohort is searched at once.
+
+# Generic custom imports
+import __init__
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels
+from PICS3D_libraries.MRMLSweep import expand_input_arguments
+
+# Domain specific custom imports
+from PICS3D_libraries.CohortArrays import build_cohort_arrays
+from PICS3D_libraries.CohortPointIndex import CohortPointIndex, get_wall_fid_indices, get_scans_with_points, get_lowest_points
+from PICS3D_libraries.Export import open_table_writer, get_export_extension
+from ComputeStatistics import load_and_correct_vaginal_properties, DEFAULT_CONFIGURATION
+
+# Constants
+from Options import TRIAGE_DEPTH, LOWEST_POINTS_PER_SCAN, TRIAGE_FILENAME, EXPORT_FORMAT
+
+# Column headings for the table of each scan's lowest fiducials
+TRIAGE_COLUMNS = ["Scan", "Rank", "Fiducial", "Height", "Below Triage Depth"]
+
+def get_fiducial_cohort(propslist):
+    ''' Stack every named fiducial of a list of vaginal properties (rather than the standardized ones used for statistics) into a CohortArrays. '''
+    return build_cohort_arrays(propslist, [vag_props._fiducial_points for vag_props in propslist])
+
+def get_triage_rows(cohort, depth = TRIAGE_DEPTH, k = LOWEST_POINTS_PER_SCAN, configuration = DEFAULT_CONFIGURATION):
+    ''' Build one table row for each of the k lowest vaginal wall fiducials of each scan of a CohortArrays. '''
+
+    [lowest, heights] = get_lowest_points(cohort, k, configuration = configuration)
+
+    rows = []
+    for scanindex in range(cohort.get_scan_count()):
+        for rank in range(lowest.shape[1]):
+            if (lowest[scanindex, rank] < 0): continue
+            rows.append([cohort._scan_names[scanindex], rank + 1, cohort._fid_names[lowest[scanindex, rank]], heights[scanindex, rank],
+                         heights[scanindex, rank] <= -depth])
+
+    return rows
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    # Expand any directories or manifests among the arguments into the MRML files they hold.
+    argv = argv[0:1] + expand_input_arguments(argv[1:])
+
+    if (len(argv) < 2):
+        print("Need to supply mrml file names as arguments.")
+        print("E.g. TriageCohort.py 101.mrml 102.mrml 103.mrml")
+        exit()
+
+    # Ignore argv[0], as it's just the filename of this python file.
+    cohort = get_fiducial_cohort(load_and_correct_vaginal_properties(argv[1:], configuration = DEFAULT_CONFIGURATION))
+
+    index = CohortPointIndex(cohort, get_wall_fid_indices(cohort))
+    [scanindices, fidindices] = index.get_points_below(TRIAGE_DEPTH, DEFAULT_CONFIGURATION)
+
+    flagged = get_scans_with_points(scanindices)
+    print(str(len(flagged)) + " of " + str(cohort.get_scan_count()) + " scans have a fiducial at least " + str(TRIAGE_DEPTH)
+          + "mm below the PICS plane:")
+    for scanindex in flagged:
+        fid_names = [cohort._fid_names[fidindex] for fidindex in fidindices[scanindices == scanindex]]
+        print("  " + cohort._scan_names[scanindex] + ": " + ", ".join(fid_names))
+
+    writer = open_table_writer(TRIAGE_FILENAME, TRIAGE_COLUMNS, EXPORT_FORMAT)
+    writer.write_rows(get_triage_rows(cohort, configuration = DEFAULT_CONFIGURATION))
+    writer.close()
+
+    print("Wrote each scan's lowest fiducials to " + TRIAGE_FILENAME + get_export_extension(EXPORT_FORMAT))
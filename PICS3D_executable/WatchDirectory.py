@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# This code is designed to watch a directory tree for Slicer scenes as they are added, changed or removed, normalize each new or changed
+# scan to the PICS system, and keep the cohort statistics and exported result tables up to date without reprocessing the whole cohort.
+
+# Generic custom imports
+import __init__
+from os import path, stat, remove, makedirs, sep
+from time import sleep
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from PICS3D_libraries.Utilities import setdebuglevel, debug_levels, debugprint
+
+# Domain specific custom imports
+from PICS3D_libraries.MRMLSweep import find_mrml_files, get_sweep_item
+from PICS3D_libraries.Export import open_table_writer, get_export_extension, get_scan_result_rows, SCAN_RESULT_COLUMNS
+from PICS3D_libraries.Options import SLICER_VERSIONS, SWEEP_THREADS
+from PICS3D_libraries.VaginalProperties import load_vaginal_properties
+from PICS3D_libraries.PICSMath import pics_correct_and_verify
+from ComputeStatistics import VaginalPropertyStatistics, FiducialStatCollection, DEFAULT_CONFIGURATION
+from ComputeStatistics import add_scan_to_range, remove_scan_from_range, collate_fiducials_for_scan, export_cohort_results
+
+# Constants
+from Options import BATCH_PROCESSES, EXPORT_FORMAT, COHORT_RESULTS_FILENAME, WATCH_POLL_SECONDS, WATCH_RESULTS_DIRECTORY
+
+def _get_file_signature(filename):
+    ''' Return [modification time, size] for filename, or None if it doesn't exist. '''
+    try:
+        filestat = stat(filename)
+    except OSError:
+        return None
+
+    return [filestat.st_mtime, filestat.st_size]
+
+def _read_sweep_item(filename):
+    ''' Thread pool helper - like get_sweep_item, but returns None for a scene that vanished or is only half written. '''
+    try:
+        return get_sweep_item(filename)
+    except Exception as error:
+        debugprint("WARNING: Cannot read " + filename + " yet: " + str(error), debug_levels.BASIC_DEBUG)
+        return None
+
+def _safe_load_worker(filename):
+    ''' Process pool helper - load and PICS-correct one scan, returning [filename, VaginalProperties or None, error message].
+    A scan that can't be read or corrected (e.g. one still missing a reference point) is reported rather than stopping the watch. '''
+    try:
+        vag_props = load_vaginal_properties([filename], DEFAULT_CONFIGURATION)[0]
+        pics_correct_and_verify(vag_props)
+    except Exception as error:
+        return [filename, None, str(error)]
+
+    return [filename, vag_props, None]
+
+class DirectoryWatcher(object):
+    ''' Polls a directory tree for MRML scenes, and the FCSV files they depend on, that have been added, modified or removed. '''
+
+    _dirname = None
+    _items = None # Dictionary of MRML file name to its SweepItem
+    _signatures = None # Dictionary of MRML file name to the signatures of the scene and its dependencies when last reported
+
+    def __init__(self, dirname, threads = SWEEP_THREADS):
+        self._dirname = dirname
+        self._items = {}
+        self._signatures = {}
+        self._pool = ThreadPool(threads)
+
+    def poll(self):
+        ''' Check the directory tree again.  Returns [changed, removed]: the loadable scenes that are new or have changed (including their
+        FCSV files) since the last poll, and the scenes that have been removed or can no longer be loaded. '''
+
+        mrml_files = find_mrml_files(self._dirname, pool = self._pool)
+        mrml_signatures = dict([[filename, _get_file_signature(filename)] for filename in mrml_files])
+
+        # Only re-read scenes that are new or whose MRML file itself has changed.
+        to_read = [filename for filename in mrml_files
+                   if ((filename not in self._items) or (self._items[filename][1] != mrml_signatures[filename]))]
+
+        for filename, item in zip(to_read, self._pool.map(_read_sweep_item, to_read)):
+            self._items[filename] = [item, mrml_signatures[filename]]
+
+        for filename in self._items.keys():
+            if (filename not in mrml_signatures): del self._items[filename]
+
+        signatures = {}
+        for filename in mrml_files:
+            item = self._items[filename][0]
+            if (item == None) or (item._slicer_version == SLICER_VERSIONS.UNKNOWN): continue
+
+            dependency_signatures = [_get_file_signature(dependency) for dependency in item._dependencies]
+            if (None in dependency_signatures): continue
+
+            signatures[filename] = [mrml_signatures[filename]] + dependency_signatures
+
+        changed = [filename for filename in sorted(signatures) if (self._signatures.get(filename) != signatures[filename])]
+        removed = [filename for filename in sorted(self._signatures) if (filename not in signatures)]
+
+        self._signatures = signatures
+
+        return [changed, removed]
+
+def get_scan_results_basename(results_dir, watched_dir, filename):
+    ''' Name the results table for one scan after its path within the watched directory, e.g. 101/Scene.mrml becomes 101__Scene.mrml. '''
+    return path.join(results_dir, path.relpath(filename, watched_dir).replace(sep, "__"))
+
+def process_changes(propstats, statscollection, watched_dir, changed, removed, pool = None, results_dir = WATCH_RESULTS_DIRECTORY):
+    ''' Bring a range's statistics and result tables up to date with the scans the DirectoryWatcher found changed or removed.
+    Only those scans are reprocessed.  Returns the number of scans successfully (re)loaded. '''
+
+    extension = get_export_extension(EXPORT_FORMAT)
+
+    for filename in (removed + changed):
+        remove_scan_from_range(propstats, statscollection, filename)
+
+        scan_filename = get_scan_results_basename(results_dir, watched_dir, filename) + extension
+        if path.isfile(scan_filename): remove(scan_filename)
+
+    if (pool == None) or (len(changed) < 2):
+        results = [_safe_load_worker(filename) for filename in changed]
+    else:
+        results = pool.imap(_safe_load_worker, changed)
+
+    loaded = 0
+    for [filename, vag_props, error] in results:
+        if (vag_props == None):
+            debugprint("ERROR: Could not process " + filename + ": " + error, debug_levels.ERRORS)
+            continue
+
+        add_scan_to_range(propstats, statscollection, vag_props)
+
+        writer = open_table_writer(get_scan_results_basename(results_dir, watched_dir, filename), SCAN_RESULT_COLUMNS, EXPORT_FORMAT)
+        writer.write_rows(get_scan_result_rows(vag_props, collate_fiducials_for_scan(vag_props)))
+        writer.close()
+
+        loaded += 1
+
+    if ((len(changed) > 0) or (len(removed) > 0)):
+        export_cohort_results(propstats, statscollection, path.join(results_dir, COHORT_RESULTS_FILENAME))
+
+    return loaded
+
+#####################
+### DEFAULT MAIN PROC
+#####################
+
+if __name__ == '__main__':
+
+    from sys import argv
+
+    setdebuglevel(debug_levels.ERRORS)
+
+    if ((len(argv) <> 2) or not path.isdir(argv[1])):
+        print("Need to supply the name of a directory to watch for mrml files.")
+        print("E.g. WatchDirectory.py /data/scans")
+        exit()
+
+    if not path.isdir(WATCH_RESULTS_DIRECTORY):
+        makedirs(WATCH_RESULTS_DIRECTORY)
+
+    watcher = DirectoryWatcher(argv[1])
+
+    propstats = VaginalPropertyStatistics()
+    statscollection = FiducialStatCollection()
+
+    pool = None
+    if (BATCH_PROCESSES != 1): pool = Pool(BATCH_PROCESSES)
+
+    print("Watching " + argv[1] + " every " + str(WATCH_POLL_SECONDS) + " seconds, writing results to " + WATCH_RESULTS_DIRECTORY
+          + ".  Press Ctrl-C to stop.")
+
+    try:
+        while True:
+            [changed, removed] = watcher.poll()
+
+            if ((len(changed) > 0) or (len(removed) > 0)):
+                loaded = process_changes(propstats, statscollection, argv[1], changed, removed, pool)
+                print("Processed " + str(loaded) + " new or changed and " + str(len(removed)) + " removed scans; cohort now has "
+                      + str(len(propstats._propslist)) + " scans.")
+
+            sleep(WATCH_POLL_SECONDS)
+
+    except KeyboardInterrupt:
+        print("Stopped watching " + argv[1])
+
+    finally:
+        if (pool != None):
+            pool.terminate()
+            pool.join()
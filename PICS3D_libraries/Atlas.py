@@ -0,0 +1,257 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# A population atlas of the vaginal wall in PICS space: a fixed 3D grid of cubic voxels, each counting how many of the atlas' scans have
+# wall points inside it (so that the fraction of scans passing through every location can be read off), along with the sums needed for the
+# mean and standard deviation of the paravaginal gaps and row widths at those points.
+#
+# Every point of a batch of scans is binned at once - its voxel found by flooring its offset from the grid's corner, and each voxel's totals
+# added up with bincount over just the voxels touched - so the accumulators are plain sums that later scans can be added to.  An atlas is
+# saved as a directory holding a small header and one .npy file of accumulators, which is memory-mapped when the atlas is opened: adding
+# scans only reads and writes the voxels they touch, and a slice can be taken without reading in the whole grid.
+
+from os import path, makedirs
+import numpy
+
+# Generic custom imports
+from Utilities import enum, debugprint, debug_levels
+
+# Domain specific custom imports
+from RowResampling import get_resampled_row_fiducials, get_resampled_fiducial_name
+
+# Bump this whenever the layout of a saved atlas changes.
+ATLAS_FORMAT_VERSION = 1
+
+# The files an atlas directory holds.
+ATLAS_HEADER_FILENAME = "header.npz"
+ATLAS_ACCUMULATORS_FILENAME = "accumulators.npy"
+
+# Index of each per-voxel total in the first axis of VoxelAtlas._accumulators
+# (points, scans with points, and the count, sum and sum of squares of the gaps and of the widths at those points).
+ATLAS_ACCUMULATORS = enum('POINTS', 'SCANS', 'GAP_COUNT', 'GAP_SUM', 'GAP_SQUARED_SUM', 'WIDTH_COUNT', 'WIDTH_SUM', 'WIDTH_SQUARED_SUM')
+
+# How many totals ATLAS_ACCUMULATORS numbers.
+ATLAS_ACCUMULATOR_COUNT = 8
+
+def get_wall_points(propslist, row_points = None):
+    ''' Gather the vaginal wall points of every scan in propslist: its row and column fiducials, or, if row_points is given, each of its rows
+        resampled to row_points points evenly spaced along it.  Returns [P array of the scan index of each point, P x 3 coordinates,
+        P paravaginal gaps, P widths of each point's row], with NaN for a gap or width that is unknown. '''
+
+    if (row_points != None): resampled = get_resampled_row_fiducials(propslist, row_points)
+
+    scanindices = []
+    coords = []
+    gaps = []
+    widths = []
+
+    for scanindex in range(len(propslist)):
+        vag_props = propslist[scanindex]
+
+        for rowindex in range(len(vag_props._rows)):
+            if (row_points == None):
+                # Empty places in the grid hold [] rather than a Fiducial.
+                fids = [fid for fid in vag_props._rows[rowindex] if fid]
+            else:
+                fids = [resampled[scanindex].get(get_resampled_fiducial_name(rowindex + 1, pointindex + 1)) for pointindex in range(row_points)]
+                fids = [fid for fid in fids if (fid != None)]
+
+            width = vag_props._vagwidths[rowindex] if (rowindex < len(vag_props._vagwidths)) else None
+
+            for fid in fids:
+                scanindices.append(scanindex)
+                coords.append(fid.coords[0:3])
+                gaps.append(numpy.nan if (fid.paravaginal_gap == None) else fid.paravaginal_gap)
+                widths.append(numpy.nan if (width == None) else width)
+
+    return [numpy.array(scanindices, dtype=int), numpy.array(coords, dtype=float).reshape((-1, 3)),
+            numpy.array(gaps, dtype=float), numpy.array(widths, dtype=float)]
+
+class VoxelAtlas(object):
+    ''' Per-voxel totals of the wall points of a set of scans, over a fixed grid in PICS space. '''
+
+    _lower = None # 3 array of the coordinates of the grid's lowest corner
+    _voxel_size = None # Edge length of every (cubic) voxel, in mm
+    _shape = None # Tuple of the number of voxels along each axis
+    _scan_names = None # List of the names of every scan added to the atlas
+    _outside_points = None # How many points of those scans fell outside the grid
+    _accumulators = None # ATLAS_ACCUMULATOR_COUNT x X x Y x Z array (usually memory-mapped) of per-voxel totals, indexed by ATLAS_ACCUMULATORS
+
+    def __init__(self, lower, voxel_size, accumulators, scan_names = None, outside_points = 0):
+        self._lower = numpy.asarray(lower, dtype=float)
+        self._voxel_size = float(voxel_size)
+        self._shape = tuple(accumulators.shape[1:])
+        self._scan_names = [] if (scan_names == None) else list(scan_names)
+        self._outside_points = int(outside_points)
+        self._accumulators = accumulators
+
+    def get_scan_count(self):
+        return len(self._scan_names)
+
+    def get_voxel_count(self):
+        return int(numpy.prod(self._shape))
+
+    def get_upper(self):
+        ''' Return the coordinates of the grid's highest corner. '''
+        return self._lower + self._voxel_size * numpy.array(self._shape)
+
+    def get_voxel_indices(self, coords):
+        ''' Find the voxel holding each of a P x 3 array of coordinates.  Returns [P x 3 array of voxel indices, P array of whether each
+            point lies inside the grid at all]. '''
+
+        with numpy.errstate(invalid='ignore'):
+            indices = numpy.floor((numpy.asarray(coords, dtype=float) - self._lower) / self._voxel_size)
+            inside = ((indices >= 0) & (indices < numpy.array(self._shape))).all(axis=1)
+
+        indices[~inside] = 0
+
+        return [indices.astype(int), inside]
+
+    def _accumulate(self, accumulator, voxels, weights = None):
+        ''' Add up weights (or 1) for each of an array of flat voxel indices, and add the totals to one of the accumulators, in place. '''
+
+        if (len(voxels) == 0): return
+
+        [touched, inverse] = numpy.unique(voxels, return_inverse=True)
+        totals = numpy.bincount(inverse, weights=weights, minlength=len(touched))
+
+        # Only the touched voxels are read and written, so a memory-mapped atlas only pages in those.
+        flat = self._accumulators[accumulator].reshape(-1)
+        flat[touched] += totals
+
+    def add_points(self, scan_names, scanindices, coords, gaps, widths):
+        ''' Add the wall points of the named scans (as returned by get_wall_points) to the atlas.  Returns how many points fell inside it. '''
+
+        [indices, inside] = self.get_voxel_indices(coords)
+        self._outside_points += int((~inside).sum())
+
+        voxels = numpy.ravel_multi_index(tuple(indices[inside].T), self._shape)
+        scanindices = scanindices[inside]
+        gaps = gaps[inside]
+        widths = widths[inside]
+
+        self._accumulate(ATLAS_ACCUMULATORS.POINTS, voxels)
+
+        # A scan with several points in one voxel still counts once towards that voxel's scans.
+        scan_voxels = numpy.unique(scanindices.astype(numpy.int64) * self.get_voxel_count() + voxels)
+        self._accumulate(ATLAS_ACCUMULATORS.SCANS, scan_voxels % self.get_voxel_count())
+
+        for values, count, total, squared_total in [
+                [gaps, ATLAS_ACCUMULATORS.GAP_COUNT, ATLAS_ACCUMULATORS.GAP_SUM, ATLAS_ACCUMULATORS.GAP_SQUARED_SUM],
+                [widths, ATLAS_ACCUMULATORS.WIDTH_COUNT, ATLAS_ACCUMULATORS.WIDTH_SUM, ATLAS_ACCUMULATORS.WIDTH_SQUARED_SUM]]:
+            present = ~numpy.isnan(values)
+            self._accumulate(count, voxels[present])
+            self._accumulate(total, voxels[present], values[present])
+            self._accumulate(squared_total, voxels[present], values[present] ** 2)
+
+        self._scan_names += list(scan_names)
+
+        return len(voxels)
+
+    def add_scans(self, propslist, row_points = None):
+        ''' Add the wall points (see get_wall_points) of every scan in propslist to the atlas, skipping any scan it already holds.
+            Returns the list of scans added. '''
+
+        held = set(self._scan_names)
+        added = []
+        for vag_props in propslist:
+            if (vag_props._name in held):
+                debugprint("WARNING: The atlas already holds " + vag_props._name + "; not adding it again.", debug_levels.ERRORS)
+                continue
+
+            held.add(vag_props._name)
+            added.append(vag_props)
+
+        if (len(added) == 0): return added
+
+        [scanindices, coords, gaps, widths] = get_wall_points(added, row_points)
+        self.add_points([vag_props._name for vag_props in added], scanindices, coords, gaps, widths)
+
+        return added
+
+    def get_probabilities(self):
+        ''' Return the fraction of the atlas' scans with a wall point in each voxel. '''
+
+        if (self.get_scan_count() == 0): return numpy.zeros(self._shape)
+        return self._accumulators[ATLAS_ACCUMULATORS.SCANS] / float(self.get_scan_count())
+
+    def _get_means_and_std_devs(self, count, total, squared_total):
+        counts = self._accumulators[count]
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = self._accumulators[total] / counts
+            variances = self._accumulators[squared_total] / counts - means ** 2
+
+        # Rounding can leave a voxel whose values are all the same with a tiny negative variance.
+        return [means, numpy.sqrt(numpy.maximum(variances, 0))]
+
+    def get_gap_statistics(self):
+        ''' Return [mean, (population) standard deviation] of the paravaginal gaps of the points in each voxel, NaN where there are none. '''
+        return self._get_means_and_std_devs(ATLAS_ACCUMULATORS.GAP_COUNT, ATLAS_ACCUMULATORS.GAP_SUM, ATLAS_ACCUMULATORS.GAP_SQUARED_SUM)
+
+    def get_width_statistics(self):
+        ''' Return [mean, (population) standard deviation] of the row widths of the points in each voxel, NaN where there are none. '''
+        return self._get_means_and_std_devs(ATLAS_ACCUMULATORS.WIDTH_COUNT, ATLAS_ACCUMULATORS.WIDTH_SUM, ATLAS_ACCUMULATORS.WIDTH_SQUARED_SUM)
+
+    def get_slice(self, volume, axis, coordinate):
+        ''' Take the 2D slice of an X x Y x Z volume (e.g. from get_probabilities) across axis at coordinate.  Returns [slice, the two axes
+            it spans, [lowest, highest] coordinate along each of them], or None if coordinate is outside the grid. '''
+
+        index = int(numpy.floor((coordinate - self._lower[axis]) / self._voxel_size))
+        if (index < 0) or (index >= self._shape[axis]): return None
+
+        axes = [otheraxis for otheraxis in range(3) if (otheraxis != axis)]
+        upper = self.get_upper()
+
+        return [numpy.take(volume, index, axis=axis), axes, [[self._lower[otheraxis], upper[otheraxis]] for otheraxis in axes]]
+
+def create_atlas(directory, lower, upper, voxel_size):
+    ''' Create an empty atlas in directory, over a grid of voxel_size voxels from the lower corner to (at least) the upper corner.
+        Its accumulators are memory-mapped from the directory; call save_atlas to keep any scans added to it. '''
+
+    lower = numpy.asarray(lower, dtype=float)
+    shape = tuple(int(count) for count in numpy.ceil((numpy.asarray(upper, dtype=float) - lower) / voxel_size))
+
+    if (min(shape) < 1): raise ValueError("Error: An atlas' upper corner must lie above its lower corner on every axis.")
+
+    if not path.isdir(directory): makedirs(directory)
+
+    accumulators = numpy.lib.format.open_memmap(path.join(directory, ATLAS_ACCUMULATORS_FILENAME), mode='w+', dtype=float,
+                                                shape=(ATLAS_ACCUMULATOR_COUNT,) + shape)
+    atlas = VoxelAtlas(lower, voxel_size, accumulators)
+    save_atlas(directory, atlas)
+
+    return atlas
+
+def save_atlas(directory, atlas):
+    ''' Save an atlas opened from (or created in) directory, after adding scans to it. '''
+
+    if isinstance(atlas._accumulators, numpy.memmap):
+        atlas._accumulators.flush()
+    else:
+        numpy.save(path.join(directory, ATLAS_ACCUMULATORS_FILENAME), atlas._accumulators)
+
+    arrays = {}
+    arrays["format_version"] = numpy.array([ATLAS_FORMAT_VERSION])
+    arrays["lower"] = atlas._lower
+    arrays["voxel_size"] = numpy.array([atlas._voxel_size])
+    arrays["scan_names"] = numpy.array(atlas._scan_names)
+    arrays["outside_points"] = numpy.array([atlas._outside_points])
+
+    # Write through a file object so numpy doesn't tack its own extension onto our filename.
+    with open(path.join(directory, ATLAS_HEADER_FILENAME), 'wb') as outfile:
+        numpy.savez_compressed(outfile, **arrays)
+
+def open_atlas(directory, writable = False):
+    ''' Open the atlas saved in directory, memory-mapping its accumulators (read-only, unless writable is True). '''
+
+    arrays = numpy.load(path.join(directory, ATLAS_HEADER_FILENAME))
+
+    format_version = int(arrays["format_version"][0])
+    if (format_version != ATLAS_FORMAT_VERSION):
+        raise ValueError("Error: " + directory + " is a saved atlas of format version " + str(format_version)
+                         + ", but only version " + str(ATLAS_FORMAT_VERSION) + " can be opened.")
+
+    accumulators = numpy.load(path.join(directory, ATLAS_ACCUMULATORS_FILENAME), mmap_mode=('r+' if writable else 'r'))
+
+    return VoxelAtlas(arrays["lower"], arrays["voxel_size"][0], accumulators,
+                      [str(name) for name in arrays["scan_names"]], arrays["outside_points"][0])
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Stack the fiducials, paravaginal gaps, widths and tilt angles of a whole cohort into numpy arrays,
+# so that cohort statistics can be computed with vectorized reductions instead of per-Fiducial loops.
+
+import numpy
+
+# Generic custom imports
+from Utilities import enum, rad_to_degrees
+
+# Constants
+from Options import COORDS
+
+# Index of each paravaginal gap component in the last axis of CohortArrays._gaps
+GAP_COMPONENTS = enum('TOTAL', 'IS', 'HORIZ')
+
+# Index of each tilt correction angle in the last axis of CohortArrays._tilt
+TILT_ANGLES = enum('PITCH', 'ROLL', 'YAW')
+
+class CohortArrays(object):
+    ''' Stacked numerical representation of a cohort of VaginalProperties objects.
+        Missing values (a scan that lacks a fiducial, or has fewer rows than another) are stored as NaN. '''
+
+    _scan_names = None # List of N scan names, in cohort order
+    _fid_names = None # List of F standardized fiducial names, in order of first appearance
+
+    _coords = None # N x F x 3 array of fiducial coordinates
+    _gaps = None # N x F x 3 array of paravaginal gaps, indexed by GAP_COMPONENTS
+    _widths = None # N x R array of vaginal widths by row (row 1 is index 0)
+    _tilt = None # N x 3 array of pelvic tilt correction angles in degrees, indexed by TILT_ANGLES
+
+    def __init__(self, scan_names, fid_names, coords, gaps, widths, tilt):
+        self._scan_names = scan_names
+        self._fid_names = fid_names
+        self._coords = coords
+        self._gaps = gaps
+        self._widths = widths
+        self._tilt = tilt
+
+        self._fid_index = dict(zip(fid_names, range(len(fid_names))))
+
+    def get_fid_index(self, fid_name):
+        ''' Return the column index of the named fiducial, or None if no scan in the cohort has it. '''
+        return self._fid_index.get(fid_name)
+
+    def get_scan_count(self):
+        return len(self._scan_names)
+
+    def get_heights(self, axis = COORDS.Z):
+        ''' Return an N x F array of fiducial coordinates along a single axis (e.g. AXIS_CODING_IS for heights). '''
+        return self._coords[:, :, axis]
+
+    def align_to(self, fid_names, values):
+        ''' Given an N x F(x...) array of per-fiducial values from this cohort, return it re-indexed to the columns fid_names,
+            with NaN for any name this cohort does not contain.  Used to line two cohorts up against each other. '''
+
+        aligned = numpy.empty((values.shape[0], len(fid_names)) + values.shape[2:])
+        aligned.fill(numpy.nan)
+
+        for newindex in range(len(fid_names)):
+            oldindex = self.get_fid_index(fid_names[newindex])
+            if (oldindex == None): continue
+            aligned[:, newindex] = values[:, oldindex]
+
+        return aligned
+
+def build_cohort_arrays(propslist, collated_fid_dicts):
+    ''' Stack a list of VaginalProperties into a CohortArrays.
+        collated_fid_dicts holds one dictionary per entry in propslist, mapping standardized fiducial names to that scan's Fiducial. '''
+
+    scan_names = [vag_props._name for vag_props in propslist]
+
+    # Gather the union of standardized names, keeping the order in which we first see them.
+    fid_names = []
+    seen_names = set()
+    for fid_dict in collated_fid_dicts:
+        for fidname in fid_dict:
+            if (fidname in seen_names): continue
+            seen_names.add(fidname)
+            fid_names.append(fidname)
+
+    fid_index = dict(zip(fid_names, range(len(fid_names))))
+
+    scan_count = len(propslist)
+    row_count = 0
+    for vag_props in propslist:
+        row_count = max(row_count, len(vag_props._vagwidths))
+
+    coords = numpy.empty((scan_count, len(fid_names), 3))
+    gaps = numpy.empty((scan_count, len(fid_names), 3))
+    widths = numpy.empty((scan_count, row_count))
+    tilt = numpy.empty((scan_count, 3))
+
+    for array in (coords, gaps, widths, tilt): array.fill(numpy.nan)
+
+    for scanindex in range(scan_count):
+        vag_props = propslist[scanindex]
+
+        for fidname, fid in collated_fid_dicts[scanindex].iteritems():
+            if (fid == None): continue
+
+            colindex = fid_index[fidname]
+            # PICS-corrected coordinates carry a trailing homogeneous component, which we drop.
+            coords[scanindex, colindex] = fid.coords[0:3]
+
+            fid_gaps = [fid.paravaginal_gap, fid.paravaginal_gap_is, fid.paravaginal_gap_horiz]
+            for gapindex in range(3):
+                if (fid_gaps[gapindex] != None):
+                    gaps[scanindex, colindex, gapindex] = fid_gaps[gapindex]
+
+        widths[scanindex, 0:len(vag_props._vagwidths)] = vag_props._vagwidths
+
+        angles = [vag_props._pelvic_tilt_correction_angle_about_LR_axis,
+                  vag_props._pelvic_tilt_correction_angle_about_AP_axis,
+                  vag_props._pelvic_tilt_correction_angle_about_IS_axis]
+
+        for angleindex in range(3):
+            if (angles[angleindex] != None):
+                tilt[scanindex, angleindex] = rad_to_degrees(angles[angleindex])
+
+    return CohortArrays(scan_names, fid_names, coords, gaps, widths, tilt)
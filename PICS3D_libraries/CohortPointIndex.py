@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# A spatial index over every PICS-normalized fiducial of a cohort at once, for triage questions such as "which scans have a fiducial more than
+# 10mm below the PICS plane?" or "whose fiducials lie within this region?", without looping over every scan's fiducials.  Each indexed point
+# remembers which scan and which fiducial it came from, so every query answers with [scan indices, fiducial indices] into the CohortArrays.
+#
+# Also ranks each scan's lowest fiducials (the "worst prolapse" of get_lowest_fiducial, and the next worst) across the whole cohort at once.
+
+import numpy
+
+# Domain specific custom imports
+from SpatialIndex import KDTree
+from Configuration import DEFAULT_PICS_CONFIGURATION
+
+# Constants
+from Options import REFERENCE_POINT_NAMES, INTER_ISCHIAL_SPINE_NAME
+
+def get_wall_fid_indices(cohort):
+    ''' Return the column indices of a CohortArrays' fiducials that mark the vaginal wall, i.e. all but the PICS reference points
+        and the inter-ischial-spine point (which, when CREATE_IIS is set, is computed from them). '''
+
+    not_wall = REFERENCE_POINT_NAMES | set([INTER_ISCHIAL_SPINE_NAME])
+    return [fidindex for fidindex in range(len(cohort._fid_names)) if (cohort._fid_names[fidindex] not in not_wall)]
+
+class CohortPointIndex(object):
+    ''' A KDTree over the fiducial coordinates of every scan of a CohortArrays. '''
+
+    _cohort = None # The CohortArrays indexed
+    _tree = None # KDTree over every present coordinate of the indexed fiducials
+    _point_scans = None # P array of the scan index of each point in _tree
+    _point_fids = None # P array of the fiducial index of each point in _tree
+
+    def __init__(self, cohort, fid_indices = None):
+        ''' Index the fiducials of cohort numbered fid_indices (by default, all of them), leaving out any a scan lacks. '''
+
+        if (fid_indices is None): fid_indices = range(len(cohort._fid_names))
+        fid_indices = numpy.asarray(fid_indices, dtype=int)
+
+        coords = cohort._coords[:, fid_indices]
+        [scanindices, columns] = numpy.nonzero(~numpy.isnan(coords).any(axis=2))
+
+        self._cohort = cohort
+        self._tree = KDTree(coords[scanindices, columns])
+        self._point_scans = scanindices
+        self._point_fids = fid_indices[columns]
+
+    def get_point_count(self):
+        return self._tree.get_point_count()
+
+    def _points_to_fiducials(self, pointindices):
+        return [self._point_scans[pointindices], self._point_fids[pointindices]]
+
+    def get_points_in_box(self, lower, upper):
+        ''' Return [scan indices, fiducial indices] of every indexed fiducial inside the box with corners lower and upper. '''
+        return self._points_to_fiducials(self._tree.query_box(lower, upper))
+
+    def get_points_within(self, center, radius):
+        ''' Return [scan indices, fiducial indices] of every indexed fiducial no further than radius from center. '''
+        return self._points_to_fiducials(self._tree.query_radius(center, radius))
+
+    def get_points_beyond(self, normal, offset):
+        ''' Return [scan indices, fiducial indices] of every indexed fiducial at least offset along normal. '''
+        return self._points_to_fiducials(self._tree.query_half_space(normal, offset))
+
+    def get_points_below(self, depth, configuration = DEFAULT_PICS_CONFIGURATION):
+        ''' Return [scan indices, fiducial indices] of every indexed fiducial at least depth below the PICS plane (through the origin),
+            along the inferior-superior axis of configuration's axis coding. '''
+
+        normal = numpy.zeros(3)
+        normal[configuration._axis_coding_is] = -1
+
+        return self.get_points_beyond(normal, depth)
+
+    def get_nearest_points(self, points, k = 1):
+        ''' Find the k indexed fiducials nearest each of an M x 3 array of points.
+            Returns [M x k distances, M x k scan indices, M x k fiducial indices], nearest first, with -1 indices where there are too few. '''
+
+        [distances, pointindices] = self._tree.query(points, k)
+        if (self.get_point_count() == 0): return [distances, pointindices, pointindices.copy()]
+
+        found = (pointindices >= 0)
+
+        return [distances, numpy.where(found, self._point_scans[pointindices], -1), numpy.where(found, self._point_fids[pointindices], -1)]
+
+def get_scans_with_points(scanindices):
+    ''' Return the sorted indices of the scans among the results of a CohortPointIndex query, each once. '''
+    return numpy.unique(scanindices)
+
+def get_lowest_points(cohort, k, fid_indices = None, configuration = DEFAULT_PICS_CONFIGURATION):
+    ''' Rank each scan's k lowest fiducials (of those numbered fid_indices; by default, the vaginal wall) along the inferior-superior
+        axis of configuration's axis coding.
+        Returns [N x k fiducial indices, N x k heights], lowest first, with -1 and NaN where a scan has fewer than k such fiducials. '''
+
+    if (fid_indices is None): fid_indices = get_wall_fid_indices(cohort)
+    fid_indices = numpy.asarray(fid_indices, dtype=int)
+
+    heights = cohort._coords[:, fid_indices, configuration._axis_coding_is]
+    k = min(k, len(fid_indices))
+    rows = numpy.arange(cohort.get_scan_count())[:, numpy.newaxis]
+
+    if (k == 0): return [numpy.zeros((len(rows), 0), dtype=int), numpy.zeros((len(rows), 0))]
+
+    # Missing fiducials sort after every real one; take each scan's k lowest without sorting the rest, then sort just those.
+    ranked = numpy.where(numpy.isnan(heights), numpy.inf, heights)
+    lowest = numpy.argpartition(ranked, k - 1, axis=1)[:, 0:k]
+    lowest = lowest[rows, numpy.argsort(ranked[rows, lowest], axis=1)]
+
+    lowest_heights = heights[rows, lowest]
+    found = ~numpy.isnan(lowest_heights)
+
+    return [numpy.where(found, fid_indices[lowest], -1), lowest_heights]
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# A configuration object holding the options that change how scans are PICS-corrected and measured, so that one process (or one pool
+# of worker processes) can run the same fiducials under several configurations - e.g. lisse and pics3d coding, with and without scaling -
+# instead of being limited to whatever Options.py said when the modules were imported.
+
+from collections import OrderedDict
+
+# Constants
+from Options import COORDS, AXIS_CODING, AXIS_CODING_OPTIONS, DESIRED_SCIPP_ANGLE, CREATE_IIS
+from Options import SCALE_BY_SCIPP_LINE, SCALE_BY_IIS_LINE, SCIPP_SCALE_LENGTH, IIS_SCALE_LENGTH
+
+class PICSConfiguration(object):
+    ''' The PICS correction and measurement options for a set of scans.  Every option defaults to its value in Options.py;
+    pass any of them by their Options.py name to override it, e.g. PICSConfiguration(AXIS_CODING = AXIS_CODING_OPTIONS.pics3d). '''
+
+    # The names (as in Options.py) and default values of every option held.  Subclasses extend this with options of their own.
+    OPTION_DEFAULTS = OrderedDict([("AXIS_CODING", AXIS_CODING),
+                                   ("DESIRED_SCIPP_ANGLE", DESIRED_SCIPP_ANGLE),
+                                   ("SCALE_BY_SCIPP_LINE", SCALE_BY_SCIPP_LINE),
+                                   ("SCALE_BY_IIS_LINE", SCALE_BY_IIS_LINE),
+                                   ("SCIPP_SCALE_LENGTH", SCIPP_SCALE_LENGTH),
+                                   ("IIS_SCALE_LENGTH", IIS_SCALE_LENGTH),
+                                   ("CREATE_IIS", CREATE_IIS)])
+
+    def __init__(self, **options):
+        for optionname in options:
+            if (optionname not in self.OPTION_DEFAULTS):
+                raise ValueError("Error: Unknown configuration option " + optionname)
+
+        for optionname, default in self.OPTION_DEFAULTS.iteritems():
+            setattr(self, "_" + optionname.lower(), options.get(optionname, default))
+
+        # Which axes go where follows from the axis coding, just as in Options.py.
+        if (self._axis_coding == AXIS_CODING_OPTIONS.lisse):
+            self._axis_coding_lr = COORDS.X
+            self._axis_coding_is = COORDS.Z
+            self._axis_coding_ap = COORDS.Y
+        elif (self._axis_coding == AXIS_CODING_OPTIONS.pics3d):
+            self._axis_coding_lr = COORDS.Z
+            self._axis_coding_is = COORDS.Y
+            self._axis_coding_ap = COORDS.X
+        else:
+            raise ValueError("Error: Unknown axis coding " + str(self._axis_coding))
+
+    def get_options(self):
+        ''' Return an OrderedDict of every option's name (as in Options.py) and value in this configuration. '''
+        return OrderedDict([[optionname, getattr(self, "_" + optionname.lower())] for optionname in self.OPTION_DEFAULTS])
+
+    def copy(self, **options):
+        ''' Return a new configuration of the same kind, with the same options except for any given here. '''
+        new_options = self.get_options()
+        new_options.update(options)
+        return self.__class__(**new_options)
+
+    def to_string(self):
+        return ", ".join([optionname + " = " + str(value) for optionname, value in self.get_options().iteritems()])
+
+# The configuration given by Options.py, used wherever no other configuration is passed in.
+DEFAULT_PICS_CONFIGURATION = PICSConfiguration()
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Write per-scan and per-cohort results as tables, either as buffered CSV or as a columnar numpy archive,
+# so that downstream tools can read them directly instead of scraping printed output.
+
+import csv
+import numpy
+
+# Generic custom imports
+from Utilities import rad_to_degrees
+
+# Domain specific custom imports
+from Fiducials import get_fiducial_row_and_column
+
+# Constants
+from Options import COORDS, AXIS_CODING_IS, EXPORT_FORMAT_OPTIONS, EXPORT_BUFFER_ROWS
+
+# Columns of the per-scan table built by get_scan_result_rows - one row per fiducial per scan.
+SCAN_RESULT_COLUMNS = ["Scan", "Fiducial", "Original Name", "X", "Y", "Z",
+                       "Paravaginal Gap", "Paravaginal Gap IS", "Paravaginal Gap Horizontal",
+                       "Row", "Column", "Row Width", "Pitch", "Roll", "Yaw", "Lowest"]
+
+# Columns of the per-cohort table - one row per measure and key (fiducial name, row, or tilt angle).
+COHORT_RESULT_COLUMNS = ["Measure", "Key", "Count", "Mean", "Std Dev"]
+
+# Columns of the per-group table - one row per grouping (metadata field or fields), group, measure and key.
+GROUP_RESULT_COLUMNS = ["Grouping", "Group"] + COHORT_RESULT_COLUMNS
+
+# Columns of the longitudinal tables - one row per change per pair of scans, and one row per change per kind of pair (e.g. pre to post).
+PAIR_CHANGE_COLUMNS = ["Patient", "Before", "After", "Measure", "Key", "Change"]
+CHANGE_SUMMARY_COLUMNS = ["Before", "After", "Measure", "Key", "Count", "Mean", "Std Dev", "Paired t", "Paired p"]
+
+# Columns holding text rather than numbers, for the columnar format.
+TEXT_COLUMNS = {"Scan", "Fiducial", "Original Name", "Measure", "Key", "Axis Coding", "Problems", "Grouping", "Group",
+                "Patient", "Before", "After"}
+
+class CSVTableWriter(object):
+    ''' Writes rows to a CSV file, holding up to buffer_rows rows in memory and writing them out together. '''
+
+    def __init__(self, filename, columns, buffer_rows = EXPORT_BUFFER_ROWS):
+        self._filename = filename
+        self._buffer_rows = buffer_rows
+        self._buffer = []
+
+        self._file = open(filename, 'wb')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self._buffer.extend(rows)
+        if (len(self._buffer) >= self._buffer_rows): self.flush()
+
+    def flush(self):
+        # Missing values are written as empty cells.
+        self._writer.writerows([["" if (value == None) else value for value in row] for row in self._buffer])
+        self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+class ColumnarTableWriter(object):
+    ''' Collects rows into one numpy array per column, and saves them all as a compressed .npz archive on close.
+        Text columns become string arrays, and every other column a float array with NaN for missing values.
+        The archive also holds a "columns" array listing the column names in order. '''
+
+    def __init__(self, filename, columns, buffer_rows = EXPORT_BUFFER_ROWS):
+        self._filename = filename
+        self._columns = columns
+        self._buffer_rows = buffer_rows
+        self._buffer = []
+
+        # One list of array chunks per column, converted from the row buffer each time it fills.
+        self._chunks = [[] for column in columns]
+
+    def write_rows(self, rows):
+        self._buffer.extend(rows)
+        if (len(self._buffer) >= self._buffer_rows): self.flush()
+
+    def flush(self):
+        if (len(self._buffer) == 0): return
+
+        for colindex in range(len(self._columns)):
+            values = [row[colindex] for row in self._buffer]
+
+            if (self._columns[colindex] in TEXT_COLUMNS):
+                self._chunks[colindex].append(numpy.array(values, dtype=str))
+            else:
+                self._chunks[colindex].append(numpy.array([numpy.nan if (value == None) else value for value in values], dtype=float))
+
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+
+        arrays = {"columns": numpy.array(self._columns)}
+        for colindex in range(len(self._columns)):
+            column = self._columns[colindex]
+
+            if (len(self._chunks[colindex]) == 0):
+                arrays[column] = numpy.array([], dtype=(str if (column in TEXT_COLUMNS) else float))
+            else:
+                arrays[column] = numpy.concatenate(self._chunks[colindex])
+
+        # Write through a file object so numpy doesn't append its own extension.
+        with open(self._filename, 'wb') as outfile:
+            numpy.savez_compressed(outfile, **arrays)
+
+def get_export_extension(export_format):
+    if (export_format == EXPORT_FORMAT_OPTIONS.COLUMNAR): return ".npz"
+    return ".csv"
+
+def open_table_writer(basename, columns, export_format):
+    ''' Open a table writer of the given EXPORT_FORMAT_OPTIONS format, writing to basename plus the matching extension. '''
+
+    filename = basename + get_export_extension(export_format)
+
+    if (export_format == EXPORT_FORMAT_OPTIONS.COLUMNAR):
+        return ColumnarTableWriter(filename, columns)
+
+    return CSVTableWriter(filename, columns)
+
+def get_lowest_fiducial(fid_dict, is_axis = AXIS_CODING_IS):
+    ''' Return the row-and-column fiducial in fid_dict with the lowest coordinate along is_axis, the inferior-superior axis
+        (assumed to be the "worst prolapse"), or None if there are no row-and-column fiducials. '''
+
+    lowest_fiducial = None
+    for fid in fid_dict.itervalues():
+        if (fid == None) or (get_fiducial_row_and_column(fid)[0] == None): continue
+        if (lowest_fiducial == None) or (fid.coords[is_axis] < lowest_fiducial.coords[is_axis]):
+            lowest_fiducial = fid
+
+    return lowest_fiducial
+
+def get_scan_result_rows(vag_props, fid_dict):
+    ''' Build the per-scan table rows for one set of vaginal properties.
+        fid_dict is an ordered dictionary mapping standardized fiducial names to that scan's Fiducials.
+        The "Lowest" column flags the fiducial found by get_lowest_fiducial. '''
+
+    tilt = []
+    for angle in [vag_props._pelvic_tilt_correction_angle_about_LR_axis,
+                  vag_props._pelvic_tilt_correction_angle_about_AP_axis,
+                  vag_props._pelvic_tilt_correction_angle_about_IS_axis]:
+        tilt.append(None if (angle == None) else rad_to_degrees(angle))
+
+    lowest_fiducial = get_lowest_fiducial(fid_dict, vag_props._configuration._axis_coding_is)
+
+    rows = []
+    for fidname, fid in fid_dict.iteritems():
+        if (fid == None): continue
+
+        [rownum, colnum] = get_fiducial_row_and_column(fid)
+
+        row_width = None
+        if (rownum != None) and (rownum <= len(vag_props._vagwidths)):
+            row_width = vag_props._vagwidths[rownum - 1]
+
+        rows.append([vag_props._name, fidname, fid.name,
+                     fid.coords[COORDS.X], fid.coords[COORDS.Y], fid.coords[COORDS.Z],
+                     fid.paravaginal_gap, fid.paravaginal_gap_is, fid.paravaginal_gap_horiz,
+                     rownum, colnum, row_width] + tilt + [int(fid is lowest_fiducial)])
+
+    return rows
+
+def _summary_row(measure, key, values):
+    ''' One per-cohort table row summarizing a list of values, ignoring Nones. '''
+
+    values = [value for value in values if (value != None)]
+    if (len(values) == 0): return [measure, key, 0, None, None]
+
+    return [measure, key, len(values), numpy.mean(values), numpy.std(values)]
+
+def get_cohort_result_rows(statscollection, widthlists, tiltlists):
+    ''' Build the per-cohort table rows: the position and paravaginal gaps of every collated fiducial,
+        the width of every row, and each pelvic tilt correction angle.
+        statscollection is an OrderedDict of standardized names to objects holding a _fid_collated_list of Fiducials,
+        widthlists holds one list of widths per row, and tiltlists holds the pitch, roll and yaw angle lists in degrees. '''
+
+    rows = []
+
+    for fidname, stats in statscollection.iteritems():
+        fids = [fid for fid in stats._fid_collated_list if (fid != None)]
+
+        for axis, axisname in [[COORDS.X, "X"], [COORDS.Y, "Y"], [COORDS.Z, "Z"]]:
+            rows.append(_summary_row("Position " + axisname, fidname, [fid.coords[axis] for fid in fids]))
+
+        rows.append(_summary_row("Paravaginal Gap", fidname, [fid.paravaginal_gap for fid in fids]))
+        rows.append(_summary_row("Paravaginal Gap IS", fidname, [fid.paravaginal_gap_is for fid in fids]))
+        rows.append(_summary_row("Paravaginal Gap Horizontal", fidname, [fid.paravaginal_gap_horiz for fid in fids]))
+
+    for rowindex in range(len(widthlists)):
+        rows.append(_summary_row("Width", "Row " + str(rowindex + 1), widthlists[rowindex]))
+
+    for anglename, anglelist in zip(["Pitch", "Roll", "Yaw"], tiltlists):
+        rows.append(_summary_row("Tilt Correction", anglename, anglelist))
+
+    return rows
+
+def get_surface_result_rows(meshes):
+    ''' Build per-cohort table rows summarizing a list of SurfaceMeshes, one per scan: total surface area, and for each row the area of
+        the strip of surface below it and the chord, depth and enclosed area of its cross section. '''
+
+    row_count = max([0] + [max([0] + mesh._vertex_rows.tolist()) for mesh in meshes])
+
+    def row_values(values):
+        # Pad each scan's per-row values out to row_count, with None for missing values.
+        padded = [[None] * row_count for mesh in meshes]
+        for scanindex in range(len(meshes)):
+            for rowindex in range(len(values[scanindex])):
+                if not numpy.isnan(values[scanindex][rowindex]): padded[scanindex][rowindex] = values[scanindex][rowindex]
+        return padded
+
+    strips = row_values([mesh.get_row_strip_areas() for mesh in meshes])
+    cross_sections = [mesh.get_row_cross_sections() for mesh in meshes]
+    chords = row_values([cross_section[0] for cross_section in cross_sections])
+    depths = row_values([cross_section[1] for cross_section in cross_sections])
+    areas = row_values([cross_section[2] for cross_section in cross_sections])
+
+    rows = [_summary_row("Surface Area", "Total", [mesh.get_area() for mesh in meshes])]
+
+    # The last row has no strip of surface below it.
+    for rowindex in range(row_count - 1):
+        rows.append(_summary_row("Surface Strip Area", "Row " + str(rowindex + 1), [scanvalues[rowindex] for scanvalues in strips]))
+
+    for measure, values in [["Cross Section Chord", chords], ["Cross Section Depth", depths], ["Cross Section Area", areas]]:
+        for rowindex in range(row_count):
+            rows.append(_summary_row(measure, "Row " + str(rowindex + 1), [scanvalues[rowindex] for scanvalues in values]))
+
+    return rows
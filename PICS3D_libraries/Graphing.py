@@ -3,10 +3,12 @@
 # This code is designed to load in a set of fiducials from command-line arguments and normalize them to the PICS system, analyze them mathematically, then display the results.
 
 from mpl_toolkits.mplot3d import Axes3D #Seemingly meaningless but forces projection='3d' to work!  Do NOT remove this line!
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 import matplotlib.pyplot as plt
 
 from PICS3D_libraries.Options import COORDS, REFERENCE_POINT_NAMES
 from PICS3D_executable.Options import DEFAULT_COLOR, GRAPH_TITLE, SHOW_REFERENCE_POINTS, DRAW_PARAVAG_GAP_LINES, GRAPH_VIEW_ELEVATION, GRAPH_VIEW_AZIMUTH, DRAW_AXIS_LABELS
+from PICS3D_executable.Options import ELLIPSOID_COLOR, ELLIPSOID_ALPHA, ELLIPSOID_MESH_RESOLUTION, SURFACE_COLOR, SURFACE_ALPHA
 
 # Our generic libraries
 from Utilities import debugprint, debug_levels
@@ -128,18 +130,61 @@ def add_legend_to_graph3D(graph, minlabel, maxlabel, mincolor, maxcolor):
     
     graph._ax.legend([minline,maxline], [minlabel,maxlabel], numpoints=2, loc="lower right")
     
-# BELOW FUNCTION CURRENTLY UNUSED
+# Unit sphere meshes, by resolution, built once by get_unit_sphere_mesh and shared by every ellipsoid drawn.
+_unit_sphere_meshes = {}
+
+def get_unit_sphere_mesh(resolution = ELLIPSOID_MESH_RESOLUTION):
+    ''' Return [vertices, faces] of a unit sphere with resolution facets around the equator: a V x 3 array of points on the sphere,
+        and an F x 4 array of the vertex indices of each quadrilateral facet.  Built once per resolution, then reused. '''
+
+    if (resolution not in _unit_sphere_meshes):
+        u = np.linspace(0, 2 * np.pi, resolution + 1)
+        v = np.linspace(0, np.pi, (resolution // 2) + 1)
+
+        # Vertex (i, j) sits at longitude u[i] and colatitude v[j], and is stored at index i * len(v) + j.
+        vertices = np.empty((len(u), len(v), 3))
+        vertices[:, :, COORDS.X] = np.outer(np.cos(u), np.sin(v))
+        vertices[:, :, COORDS.Y] = np.outer(np.sin(u), np.sin(v))
+        vertices[:, :, COORDS.Z] = np.outer(np.ones(len(u)), np.cos(v))
+
+        [i, j] = np.meshgrid(np.arange(len(u) - 1), np.arange(len(v) - 1), indexing='ij')
+        corners = [i * len(v) + j, (i + 1) * len(v) + j, (i + 1) * len(v) + j + 1, i * len(v) + j + 1]
+        faces = np.concatenate([corner.reshape((-1, 1)) for corner in corners], axis=1)
+
+        _unit_sphere_meshes[resolution] = [vertices.reshape((-1, 3)), faces]
+
+    return _unit_sphere_meshes[resolution]
+
+def add_ellipsoids_to_graph3D(graph, centers, axes, newcolor = ELLIPSOID_COLOR, alpha = ELLIPSOID_ALPHA):
+    ''' Draw K ellipsoids as a single collection, by stretching one shared unit sphere mesh.
+        centers is a K x 3 array, and axes a K x 3 x 3 array whose columns are each ellipsoid's semi-axes.  Ellipsoids with NaNs are skipped. '''
+
+    centers = np.asarray(centers, dtype=float)
+    axes = np.asarray(axes, dtype=float)
+
+    drawable = ~(np.isnan(centers).any(axis=1) | np.isnan(axes).any(axis=(1, 2)))
+    if not drawable.any(): return
+
+    [vertices, faces] = get_unit_sphere_mesh()
+
+    # Every vertex of every ellipsoid at once: center + axes * unit sphere point.
+    points = centers[drawable][:, np.newaxis, :] + np.einsum('vj,kij->kvi', vertices, axes[drawable])
+    polygons = points[:, faces].reshape((-1, faces.shape[1], 3))
+
+    graph._ax.add_collection3d(Poly3DCollection(polygons, facecolors=newcolor, edgecolors='none', alpha=alpha))
+
 def add_ellipsoid_to_graph3D(graph, center_coords, x_diam, y_diam, z_diam): 
-    ''' Ellipsoid code from http://matplotlib.org/examples/mplot3d/surface3d_demo2.html'''
-    
-    u = np.linspace(0, 2 * np.pi, 100)
-    v = np.linspace(0, np.pi, 100)
+    ''' Draw a single axis-aligned ellipsoid reaching x_diam, y_diam and z_diam from center_coords along each axis. '''
 
-    x = center_coords[COORDS.X] + x_diam * np.outer(np.cos(u), np.sin(v))
-    y = center_coords[COORDS.Y] + y_diam * np.outer(np.sin(u), np.sin(v))
-    z = center_coords[COORDS.Z] + z_diam * np.outer(np.ones(np.size(u)), np.cos(v))
-    graph._ax.plot_surface(x, y, z,  rstride=4, cstride=4, color='b')
+    add_ellipsoids_to_graph3D(graph, [center_coords[0:3]], [np.diag([x_diam, y_diam, z_diam])], 'b', 1)
         
+def add_surface_to_graph3D(graph, mesh, newcolor = SURFACE_COLOR, alpha = SURFACE_ALPHA):
+    ''' Draw every triangle of a SurfaceMesh as a single collection. '''
+
+    if (mesh.get_triangle_count() == 0): return
+
+    graph._ax.add_collection3d(Poly3DCollection(mesh._vertices[mesh._faces], facecolors=newcolor, edgecolors='grey', linewidths=0.2, alpha=alpha))
+
 def set_graph_boundaries3D(graph, min_x, max_x, min_y, max_y, min_z, max_z):
     
     # HACK HACK HACK
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Per-group cohort statistics for studies that stratify one set of scans many ways - by diagnosis, age band, parity, timepoint and so on.
+# The cohort is loaded and stacked into a CohortArrays once; every measure the cohort results table summarizes (fiducial positions and
+# paravaginal gaps, row widths and tilt correction angles) becomes one column of an N x K matrix; and each grouping is then summarized with
+# segmented reductions: the scans are sorted by group, so that each group's scans lie in one contiguous segment, and every group's count,
+# mean and standard deviation of every measure comes out of a few numpy reduceat calls.
+
+import numpy
+
+# Domain specific custom imports
+from CohortArrays import GAP_COMPONENTS, TILT_ANGLES
+
+# Joins several metadata fields into one grouping, e.g. "Diagnosis+Age Band" groups by every combination of the two.
+GROUPING_FIELD_SEPARATOR = "+"
+
+# Joins the values of several metadata fields into the name of one of their combined groups.
+GROUP_NAME_SEPARATOR = " / "
+
+def get_cohort_measures(cohort):
+    ''' Lay out every measure of a CohortArrays as the columns of one matrix, in the order get_cohort_result_rows lists them.
+        Returns [K measure names, K keys, N x K array of values] with NaN where a scan lacks a value. '''
+
+    measures = []
+    keys = []
+    columns = []
+
+    fid_measures = [["Position X", cohort._coords[:, :, 0]], ["Position Y", cohort._coords[:, :, 1]], ["Position Z", cohort._coords[:, :, 2]],
+                    ["Paravaginal Gap", cohort._gaps[:, :, GAP_COMPONENTS.TOTAL]],
+                    ["Paravaginal Gap IS", cohort._gaps[:, :, GAP_COMPONENTS.IS]],
+                    ["Paravaginal Gap Horizontal", cohort._gaps[:, :, GAP_COMPONENTS.HORIZ]]]
+
+    for fidindex in range(len(cohort._fid_names)):
+        for measure, values in fid_measures:
+            measures.append(measure)
+            keys.append(cohort._fid_names[fidindex])
+            columns.append(values[:, fidindex])
+
+    for rowindex in range(cohort._widths.shape[1]):
+        measures.append("Width")
+        keys.append("Row " + str(rowindex + 1))
+        columns.append(cohort._widths[:, rowindex])
+
+    for anglename, angleindex in [["Pitch", TILT_ANGLES.PITCH], ["Roll", TILT_ANGLES.ROLL], ["Yaw", TILT_ANGLES.YAW]]:
+        measures.append("Tilt Correction")
+        keys.append(anglename)
+        columns.append(cohort._tilt[:, angleindex])
+
+    if (len(columns) == 0): return [measures, keys, numpy.zeros((cohort.get_scan_count(), 0))]
+
+    return [measures, keys, numpy.column_stack(columns)]
+
+def get_group_indices(labels):
+    ''' Number the distinct labels of N scans.  Scans with an empty label belong to no group.
+        Returns [sorted list of G group names, N array of each scan's group index, -1 for none]. '''
+
+    labels = numpy.asarray(labels, dtype=str)
+    if (len(labels) == 0): return [[], numpy.zeros(0, dtype=int)]
+
+    [names, groups] = numpy.unique(labels, return_inverse=True)
+    names = list(names)
+
+    # numpy.unique sorts, so an empty label can only be the first group.
+    if (len(names) > 0) and (names[0] == ""):
+        names = names[1:]
+        groups = groups - 1
+
+    return [names, groups]
+
+def segmented_statistics(values, groups, group_count):
+    ''' Summarize each column of an N x K array of values (NaN where missing) over each of group_count groups of its rows, where groups
+        holds each row's group index (-1 for none).  Returns [G x K counts, G x K means, G x K population standard deviations],
+        with NaN means and standard deviations where a group has no values. '''
+
+    values = numpy.asarray(values, dtype=float)
+
+    counts = numpy.zeros((group_count, values.shape[1]), dtype=int)
+    sums = numpy.zeros((group_count, values.shape[1]))
+    squared_deviations = numpy.zeros((group_count, values.shape[1]))
+
+    grouped = (groups >= 0)
+    if (group_count == 0) or not grouped.any():
+        nans = numpy.empty((group_count, values.shape[1]))
+        nans.fill(numpy.nan)
+        return [counts, nans, nans.copy()]
+
+    # Sort the rows by group, so that each group is one contiguous segment starting where searchsorted says.
+    order = numpy.argsort(groups[grouped], kind='mergesort')
+    sorted_groups = groups[grouped][order]
+    sorted_values = values[grouped][order]
+
+    starts = numpy.searchsorted(sorted_groups, numpy.arange(group_count))
+    has_rows = numpy.zeros(group_count, dtype=bool)
+    has_rows[sorted_groups] = True
+
+    # reduceat can't start a segment past the last row, and gives a single row for an empty segment, so reduce only the non-empty groups.
+    segment_starts = starts[has_rows]
+
+    present = ~numpy.isnan(sorted_values)
+    filled = numpy.where(present, sorted_values, 0)
+
+    counts[has_rows] = numpy.add.reduceat(present.astype(int), segment_starts, axis=0)
+    sums[has_rows] = numpy.add.reduceat(filled, segment_starts, axis=0)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+
+        # A second pass about each group's mean keeps the variance accurate for measures far from zero.
+        deviations = numpy.where(present, sorted_values - means[sorted_groups], 0)
+        squared_deviations[has_rows] = numpy.add.reduceat(deviations ** 2, segment_starts, axis=0)
+
+        std_devs = numpy.sqrt(squared_deviations / counts)
+
+    return [counts, means, std_devs]
+
+def get_grouping_labels(scan_names, fields, metadata, grouping):
+    ''' Return the group label of each of scan_names under grouping - a metadata field name, or several joined by GROUPING_FIELD_SEPARATOR.
+        metadata maps scan names to their list of values, in the order of fields.  Scans without metadata, or with an empty value for any
+        of grouping's fields, get an empty label. '''
+
+    field_names = grouping.split(GROUPING_FIELD_SEPARATOR)
+    for field_name in field_names:
+        if (field_name not in fields): raise ValueError("Error: Unknown metadata field " + field_name)
+
+    field_indices = [fields.index(field_name) for field_name in field_names]
+
+    labels = []
+    for scan_name in scan_names:
+        values = metadata.get(scan_name)
+        if (values == None):
+            labels.append("")
+            continue
+
+        field_values = [values[fieldindex] for fieldindex in field_indices]
+        labels.append("" if ("" in field_values) else GROUP_NAME_SEPARATOR.join(field_values))
+
+    return labels
+
+def get_group_result_rows(cohort, fields, metadata, groupings):
+    ''' Build the per-group table rows (see Export.GROUP_RESULT_COLUMNS) of a CohortArrays under each of groupings, each a metadata field
+        name or several joined by GROUPING_FIELD_SEPARATOR.  metadata maps scan names to their list of values, in the order of fields. '''
+
+    [measures, keys, values] = get_cohort_measures(cohort)
+
+    rows = []
+    for grouping in groupings:
+        [group_names, groups] = get_group_indices(get_grouping_labels(cohort._scan_names, fields, metadata, grouping))
+        [counts, means, std_devs] = segmented_statistics(values, groups, len(group_names))
+
+        for groupindex in range(len(group_names)):
+            for measureindex in range(len(measures)):
+                if (counts[groupindex, measureindex] == 0):
+                    summary = [0, None, None]
+                else:
+                    summary = [counts[groupindex, measureindex], means[groupindex, measureindex], std_devs[groupindex, measureindex]]
+
+                rows.append([grouping, group_names[groupindex], measures[measureindex], keys[measureindex]] + summary)
+
+    return rows
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Quality checks on the PICS reference landmarks of a cohort, run before the scans' statistics are computed.  A misplaced or mislabeled
+# reference point (say, the left and right ischial spines swapped, or the SC joint placed a few slices off) silently skews every coordinate
+# of its scan, so each scan's landmark geometry is measured - SCIPP line length, ischial spine width, the pelvic tilt correction angles,
+# and how far from perpendicular the LR and AP axes built from the landmarks lie - and compared with the rest of the cohort using robust
+# statistics (the median and median absolute deviation), which a few bad scans cannot drag along with them.
+#
+# Every scan of the cohort is measured at once on stacked arrays, with the same batched axis code as PICSBatch.
+
+import numpy
+
+# Generic custom imports
+from Utilities import rad_to_degrees
+
+# Domain specific custom imports
+from PICSBatch import PICS_REFERENCE_NAMES, REFERENCE_INDEX, build_pics_axes, get_pics_tilt
+from Configuration import DEFAULT_PICS_CONFIGURATION
+
+# Constants
+from Options import PUBIC_SYMPHYSIS_NAME, SC_JOINT_NAME, LEFT_ISCHIAL_SPINE_NAME, RIGHT_ISCHIAL_SPINE_NAME
+
+# A scan is an outlier if any of its features lies more than this many robust standard deviations from the cohort's median.
+# 3.5 is the usual cut-off for the modified z-score of Iglewicz and Hoaglin.
+LANDMARK_OUTLIER_THRESHOLD = 3.5
+
+# Fewer scans than this say too little about the cohort to call any of them an outlier, so only missing or degenerate landmarks are flagged.
+LANDMARK_QA_MINIMUM_SCANS = 5
+
+# The landmark geometry features measured for each scan, in the column order of LandmarkReport._features.
+LANDMARK_FEATURES = ["SCIPP Length", "IIS Width", "Pitch", "Roll", "Yaw", "Axis Skew"]
+
+# Scale factors turning a median absolute deviation, or failing that a mean absolute deviation, into an estimate of the standard
+# deviation of normally distributed values.
+MAD_TO_STD_DEV = 1.4826
+MEAN_ABSOLUTE_DEVIATION_TO_STD_DEV = 1.2533
+
+def get_reference_points(propslist):
+    ''' Return an N x 4 x 3 array of the raw (radiological) coordinates of each scan's PICS_REFERENCE_NAMES, with NaN for any a scan lacks.
+        Works on PICS-corrected scans (from the raw coordinates they keep) as well as on scans that have only been loaded. '''
+
+    reference_points = numpy.empty((len(propslist), len(PICS_REFERENCE_NAMES), 3))
+    reference_points.fill(numpy.nan)
+
+    for scanindex in range(len(propslist)):
+        vag_props = propslist[scanindex]
+
+        if (vag_props._raw_coords is not None):
+            raw_coords = vag_props._raw_coords
+        else:
+            raw_coords = dict([[name, fid.coords] for name, fid in vag_props._fiducial_points.iteritems()])
+
+        for name in PICS_REFERENCE_NAMES:
+            if (name in raw_coords): reference_points[scanindex, REFERENCE_INDEX[name]] = raw_coords[name][0:3]
+
+    return reference_points
+
+def get_landmark_features(reference_points, configuration = DEFAULT_PICS_CONFIGURATION):
+    ''' Measure the LANDMARK_FEATURES of every scan from an N x 4 x 3 array of raw reference point coordinates, returning an N x 6 array.
+        Lengths are in the scans' raw units (mm) and angles in degrees.  A scan lacking a landmark, or whose landmarks are degenerate
+        (e.g. two of them in the same place), has NaN features. '''
+
+    pubic_symphysis = reference_points[:, REFERENCE_INDEX[PUBIC_SYMPHYSIS_NAME]]
+    sc_joint = reference_points[:, REFERENCE_INDEX[SC_JOINT_NAME]]
+    left_is = reference_points[:, REFERENCE_INDEX[LEFT_ISCHIAL_SPINE_NAME]]
+    right_is = reference_points[:, REFERENCE_INDEX[RIGHT_ISCHIAL_SPINE_NAME]]
+
+    features = numpy.empty((len(reference_points), len(LANDMARK_FEATURES)))
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        features[:, 0] = numpy.sqrt(((sc_joint - pubic_symphysis) ** 2).sum(axis=-1))
+        features[:, 1] = numpy.sqrt(((left_is - right_is) ** 2).sum(axis=-1))
+
+        [LR_axis, AP_axis, IS_axis] = build_pics_axes(reference_points, configuration)
+        features[:, 2:5] = rad_to_degrees(get_pics_tilt(LR_axis, AP_axis, IS_axis))
+
+        # The LR axis comes from the ischial spines alone and the AP axis from the SCIPP line alone, so nothing makes them perpendicular;
+        # the angle by which they miss says how consistently the landmarks were placed.
+        features[:, 5] = rad_to_degrees(numpy.arcsin(numpy.minimum(numpy.abs((LR_axis * AP_axis).sum(axis=-1)), 1)))
+
+        # Coincident landmarks give zero-length axes, which come out as zero rather than NaN.
+        degenerate = ~(features[:, 0] > 0) | ~(features[:, 1] > 0)
+
+    features[degenerate] = numpy.nan
+
+    return features
+
+def get_robust_z_scores(values):
+    ''' Return the modified z-score of each of an N x D array of values against its column: the distance from the column's median in
+        robust standard deviations (the median absolute deviation, or the mean absolute deviation where more than half the values tie).
+        NaN values are left out of each column's statistics and have NaN scores; a column that does not vary at all scores 0. '''
+
+    values = numpy.asarray(values, dtype=float)
+    scores = numpy.zeros(values.shape)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        medians = numpy.nanmedian(values, axis=0)
+        deviations = numpy.abs(values - medians)
+
+        scales = MAD_TO_STD_DEV * numpy.nanmedian(deviations, axis=0)
+        tied = ~(scales > 0)
+        scales[tied] = MEAN_ABSOLUTE_DEVIATION_TO_STD_DEV * numpy.nanmean(deviations[:, tied], axis=0)
+
+        varies = (scales > 0)
+        scores[:, varies] = deviations[:, varies] / scales[varies]
+
+    scores[numpy.isnan(values)] = numpy.nan
+
+    return scores
+
+class LandmarkReport(object):
+    ''' The landmark QA results for each scan of a cohort. '''
+
+    _scan_names = None # List of N scan names
+    _features = None # N x len(LANDMARK_FEATURES) array of each scan's landmark features, NaN where they could not be measured
+    _z_scores = None # N x len(LANDMARK_FEATURES) array of each feature's robust z-score against the cohort (0 if there are too few scans)
+    _outliers = None # N x len(LANDMARK_FEATURES) boolean array, True where a feature's z-score is past the threshold
+    _missing = None # N x 4 boolean array, True where a scan lacks one of PICS_REFERENCE_NAMES
+
+    def __init__(self, scan_names, features, z_scores, outliers, missing):
+        self._scan_names = scan_names
+        self._features = features
+        self._z_scores = z_scores
+        self._outliers = outliers
+        self._missing = missing
+
+    def get_scan_count(self):
+        return len(self._scan_names)
+
+    def get_failed(self):
+        ''' Return an N boolean array, True for each scan with a missing or degenerate landmark or an outlying feature. '''
+        return self._missing.any(axis=1) | numpy.isnan(self._features).any(axis=1) | self._outliers.any(axis=1)
+
+    def get_failed_scans(self):
+        ''' Return the indices of the scans that failed QA. '''
+        return numpy.nonzero(self.get_failed())[0]
+
+    def get_problems(self, scanindex):
+        ''' Describe what is wrong with a scan's landmarks, as a list of strings (empty if it passed). '''
+
+        missing = [PICS_REFERENCE_NAMES[refindex] for refindex in range(len(PICS_REFERENCE_NAMES)) if self._missing[scanindex, refindex]]
+        if (len(missing) > 0): return ["missing " + ", ".join(missing)]
+
+        if numpy.isnan(self._features[scanindex]).any(): return ["degenerate reference landmarks"]
+
+        return [LANDMARK_FEATURES[featureindex] + " of " + ("%.1f" % self._features[scanindex, featureindex])
+                + " is " + ("%.1f" % self._z_scores[scanindex, featureindex]) + " robust std devs from the median"
+                for featureindex in range(len(LANDMARK_FEATURES)) if self._outliers[scanindex, featureindex]]
+
+def check_landmarks(propslist, configuration = DEFAULT_PICS_CONFIGURATION, threshold = LANDMARK_OUTLIER_THRESHOLD,
+                    minimum_scans = LANDMARK_QA_MINIMUM_SCANS):
+    ''' Measure the reference landmark geometry of every scan in a list of vaginal properties (corrected or not) and compare each scan with
+        the rest, returning a LandmarkReport.  Features are only scored against the cohort if at least minimum_scans could be measured. '''
+
+    reference_points = get_reference_points(propslist)
+    features = get_landmark_features(reference_points, configuration)
+
+    measured = ~numpy.isnan(features).any(axis=1)
+    z_scores = numpy.zeros(features.shape)
+    if (measured.sum() >= minimum_scans):
+        z_scores[measured] = get_robust_z_scores(features[measured])
+    z_scores[~measured] = numpy.nan
+
+    with numpy.errstate(invalid='ignore'):
+        outliers = (z_scores > threshold)
+
+    return LandmarkReport([vag_props._name for vag_props in propslist], features, z_scores, outliers,
+                          numpy.isnan(reference_points).any(axis=2))
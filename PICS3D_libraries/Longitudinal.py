@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Longitudinal comparison of scans of the same patients at different timepoints, e.g. before and after surgery.  Every scan is stacked into
+# one CohortArrays; each patient's timepoints are paired up; and the change between the two scans of every pair - each fiducial's
+# displacement, each paravaginal gap's change, each row width's change and each tilt angle's change - is taken for all pairs at once by
+# subtracting the stacked arrays.  The changes themselves form a CohortArrays (one "scan" per pair), so they can be laid out and summarized
+# with the same code as any cohort: each kind of pair (e.g. pre to post) gets the mean and spread of every change and a paired t test.
+
+import numpy
+
+# Generic custom imports
+from Utilities import debugprint, debug_levels
+
+# Domain specific custom imports
+from CohortArrays import CohortArrays
+from GroupStatistics import get_cohort_measures, get_group_indices, segmented_statistics
+from StatMath import student_t_two_sided_p_values
+
+# Separates the two timepoints of a pair in the names of change "scans" and of kinds of pairs.
+TIMEPOINT_PAIR_SEPARATOR = " -> "
+
+def get_timepoint_pairs(patients, timepoints, timepoint_order = None, consecutive = False):
+    ''' Pair up the scans of each patient, given each scan's patient and timepoint.  Timepoints are ordered as in timepoint_order (scans at
+        any other timepoint are left out), or if it is None, in the order each timepoint first appears in timepoints - so that a manifest
+        listing "pre" before "post" pairs them that way round.  Each of a patient's later timepoints is paired with the patient's first
+        (baseline) timepoint, or, if consecutive is True, with the timepoint just before it.
+        Returns [P patient names, P array of the earlier scan index of each pair, P array of the later scan index]. '''
+
+    if (timepoint_order == None):
+        timepoint_order = []
+        for timepoint in timepoints:
+            if (timepoint not in timepoint_order): timepoint_order.append(timepoint)
+    timepoint_rank = dict(zip(timepoint_order, range(len(timepoint_order))))
+
+    # Gather each patient's scans by timepoint rank, keeping the order in which we first see each patient.
+    patient_scans = {}
+    patient_names = []
+    for scanindex in range(len(patients)):
+        if (timepoints[scanindex] not in timepoint_rank): continue
+
+        if (patients[scanindex] not in patient_scans):
+            patient_scans[patients[scanindex]] = {}
+            patient_names.append(patients[scanindex])
+
+        scans = patient_scans[patients[scanindex]]
+        rank = timepoint_rank[timepoints[scanindex]]
+
+        if (rank in scans):
+            debugprint("WARNING: " + patients[scanindex] + " has more than one scan at " + timepoints[scanindex] + "; using the first.",
+                       debug_levels.ERRORS)
+        else:
+            scans[rank] = scanindex
+
+    pair_patients = []
+    before = []
+    after = []
+    for patient in patient_names:
+        scans = [patient_scans[patient][rank] for rank in sorted(patient_scans[patient])]
+
+        for laterindex in range(1, len(scans)):
+            pair_patients.append(patient)
+            before.append(scans[laterindex - 1] if consecutive else scans[0])
+            after.append(scans[laterindex])
+
+    return [pair_patients, numpy.array(before, dtype=int), numpy.array(after, dtype=int)]
+
+class LongitudinalChanges(object):
+    ''' The changes between pairs of scans of the same patients. '''
+
+    _patients = None # List of P patient names, one per pair
+    _before_timepoints = None # List of P timepoints of the earlier scan of each pair
+    _after_timepoints = None # List of P timepoints of the later scan of each pair
+    _before_scans = None # List of P scan names of the earlier scan of each pair
+    _after_scans = None # List of P scan names of the later scan of each pair
+    _changes = None # CohortArrays of each pair's later values less its earlier ones, one "scan" per pair
+
+    def __init__(self, patients, before_timepoints, after_timepoints, before_scans, after_scans, changes):
+        self._patients = patients
+        self._before_timepoints = before_timepoints
+        self._after_timepoints = after_timepoints
+        self._before_scans = before_scans
+        self._after_scans = after_scans
+        self._changes = changes
+
+    def get_pair_count(self):
+        return len(self._patients)
+
+    def get_pair_kinds(self):
+        ''' Return the kind of each pair, e.g. "Pre -> Post", for summarizing like pairs together. '''
+        return [before + TIMEPOINT_PAIR_SEPARATOR + after for before, after in zip(self._before_timepoints, self._after_timepoints)]
+
+    def get_displacements(self):
+        ''' Return a P x F array of the distance each fiducial moved between the scans of each pair, NaN where either scan lacks it. '''
+        return numpy.sqrt((self._changes._coords ** 2).sum(axis=2))
+
+def compute_longitudinal_changes(cohort, patients, timepoints, before, after):
+    ''' Take the change between the scans numbered before and after (see get_timepoint_pairs) of a CohortArrays, for every pair at once.
+        patients and timepoints give the patient and timepoint of each of the cohort's scans.  Returns a LongitudinalChanges. '''
+
+    pair_names = [patients[after[pairindex]] + ": " + timepoints[before[pairindex]] + TIMEPOINT_PAIR_SEPARATOR + timepoints[after[pairindex]]
+                  for pairindex in range(len(before))]
+
+    changes = CohortArrays(pair_names, cohort._fid_names,
+                           cohort._coords[after] - cohort._coords[before],
+                           cohort._gaps[after] - cohort._gaps[before],
+                           cohort._widths[after] - cohort._widths[before],
+                           cohort._tilt[after] - cohort._tilt[before])
+
+    return LongitudinalChanges([patients[scanindex] for scanindex in after],
+                               [timepoints[scanindex] for scanindex in before], [timepoints[scanindex] for scanindex in after],
+                               [cohort._scan_names[scanindex] for scanindex in before], [cohort._scan_names[scanindex] for scanindex in after],
+                               changes)
+
+def get_change_measures(changes):
+    ''' Lay out every change of a LongitudinalChanges as the columns of one matrix: each measure of get_cohort_measures, then the
+        displacement of each fiducial.  Returns [K measure names, K keys, P x K array of changes] with NaN where a pair lacks a value. '''
+
+    [measures, keys, values] = get_cohort_measures(changes._changes)
+
+    measures = measures + ["Displacement"] * len(changes._changes._fid_names)
+    keys = keys + list(changes._changes._fid_names)
+
+    return [measures, keys, numpy.hstack([values, changes.get_displacements()])]
+
+def _none_if_nan(value):
+    return None if numpy.isnan(value) else value
+
+def get_pair_change_rows(changes):
+    ''' Build one table row (see Export.PAIR_CHANGE_COLUMNS) for every change of every pair of a LongitudinalChanges. '''
+
+    [measures, keys, values] = get_change_measures(changes)
+    [pairindices, measureindices] = numpy.nonzero(~numpy.isnan(values))
+
+    return [[changes._patients[pairindex], changes._before_timepoints[pairindex], changes._after_timepoints[pairindex],
+             measures[measureindex], keys[measureindex], values[pairindex, measureindex]]
+            for pairindex, measureindex in zip(pairindices, measureindices)]
+
+def summarize_changes(changes):
+    ''' Summarize every change over each kind of pair of a LongitudinalChanges.  Returns [G pair kinds, K measure names, K keys,
+        G x K counts, means, (population) standard deviations, paired t statistics and two-sided p-values], the last two NaN where
+        there are fewer than two pairs or the change never varies. '''
+
+    [measures, keys, values] = get_change_measures(changes)
+    [kinds, groups] = get_group_indices(changes.get_pair_kinds())
+    [counts, means, std_devs] = segmented_statistics(values, groups, len(kinds))
+
+    # A paired t test is a one-sample t test of the changes against zero, using the sample standard deviation.
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        sample_std_devs = std_devs * numpy.sqrt(counts / (counts - 1.0))
+        t = means / (sample_std_devs / numpy.sqrt(counts))
+        t[(counts < 2) | ~numpy.isfinite(t)] = numpy.nan
+
+    return [kinds, measures, keys, counts, means, std_devs, t, student_t_two_sided_p_values(t, counts - 1.0)]
+
+def get_change_summary_rows(changes):
+    ''' Build one table row (see Export.CHANGE_SUMMARY_COLUMNS) for every change of every kind of pair of a LongitudinalChanges. '''
+
+    [kinds, measures, keys, counts, means, std_devs, t, p_values] = summarize_changes(changes)
+
+    kind_timepoints = dict(zip(changes.get_pair_kinds(), zip(changes._before_timepoints, changes._after_timepoints)))
+
+    rows = []
+    for kindindex in range(len(kinds)):
+        [before, after] = kind_timepoints[kinds[kindindex]]
+
+        for measureindex in range(len(measures)):
+            rows.append([before, after, measures[measureindex], keys[measureindex], counts[kindindex, measureindex]]
+                        + [_none_if_nan(statistic[kindindex, measureindex]) for statistic in [means, std_devs, t, p_values]])
+
+    return rows
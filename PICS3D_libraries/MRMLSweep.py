@@ -5,8 +5,12 @@
 # Tested on /home/slisse/working/MRI_data/Reproducing_Larsen/138/Slicer4-Scene.mrml
 
 # System imports
-from os import path, getcwd
+import csv
+from collections import OrderedDict
+from os import path, getcwd, listdir, lstat
+from stat import S_ISDIR, S_ISLNK
 from xml.parsers import expat
+from multiprocessing.pool import ThreadPool
 
 # Generic custom imports 
 from Utilities import debugprint, debug_levels
@@ -16,6 +20,7 @@ from Fiducials import Fiducial
 from Options import SLICER4_2_FIDUCIAL_XML_NODE_NAME, SLICER4_2_FIDUCIAL_COORD_ATTR_NAME, SLICER4_2_FIDUCIAL_NAME_ATTR_NAME
 from Options import SLICER4_3_FIDUCIAL_XML_NODE_NAME, SLICER4_3_FIDUCIAL_CSV_FILENAME_ATTR_NAME
 from Options import SLICER4_3_CSV_NAME_INDEX, SLICER4_3_CSV_X_INDEX, SLICER4_3_CSV_Y_INDEX, SLICER4_3_CSV_Z_INDEX
+from Options import SLICER_VERSIONS, MRML_EXTENSION, MANIFEST_EXTENSION, SWEEP_THREADS
 
 def load_fiducials_from_mrml_slicer_v_4_2(filename, fiducial_list):
     ''' Load a Fiducial from an mrml file created by slicer version 4.0 through 4.2. '''
@@ -49,38 +54,44 @@ def load_fiducials_from_mrml_slicer_v_4_2(filename, fiducial_list):
 
 
 
-def load_fiducials_from_mrml_slicer_v_4_3(filename, fiducial_list):
-    ''' Load a Fiducial from an mrml file created by slicer version 4.3 and beyond. '''
-    
+def get_fcsv_dependencies(filename, contents = None):
+    ''' Return the full names of the FCSV files holding the fiducials of a Slicer 4.3+ MRML file.
+    contents may be given if the file has already been read. '''
+
     #List to hold the names of all the FCSV files we have to parse for fiducials...
     csv_file_list = []
-    
+
     def start_element(nodename, attrs):
         ''' Internal helper for loading Fiducial xml nodes from Slicer4.3 MRML files'''
         # debugprint("Checking XML element: " + nodename, debug_levels.DETAILED_DEBUG)
-    
+
         if (nodename == SLICER4_3_FIDUCIAL_XML_NODE_NAME):
-            csv_file_name = attrs[SLICER4_3_FIDUCIAL_CSV_FILENAME_ATTR_NAME] 
-            
+            csv_file_name = attrs[SLICER4_3_FIDUCIAL_CSV_FILENAME_ATTR_NAME]
+
             csv_file_list.append(csv_file_name)
 
-    debugprint("Attempting to load fiducials from MRML file as Slicer 4.3: " + filename, debug_levels.BASIC_DEBUG)
-    with open(filename) as openfile: contents = str(openfile.read())
-    
+    if (contents == None):
+        with open(filename) as openfile: contents = str(openfile.read())
+
     xmlparser = expat.ParserCreate()
-    xmlparser.StartElementHandler=start_element    
-    
+    xmlparser.StartElementHandler=start_element
+
     # Use the XML parser and our start_element function above to populate csv_file_list with the names
     # of CSV files that potentially contain fiducials.
     xmlparser.Parse(contents)
-     
+
     relative_path = path.dirname(filename)
-     
+
+    return [path.join(getcwd(), relative_path, csv_file_name) for csv_file_name in csv_file_list]
+
+def load_fiducials_from_mrml_slicer_v_4_3(filename, fiducial_list):
+    ''' Load a Fiducial from an mrml file created by slicer version 4.3 and beyond. '''
+
+    debugprint("Attempting to load fiducials from MRML file as Slicer 4.3: " + filename, debug_levels.BASIC_DEBUG)
+
     # Run through the CSV files one at a time, read each line and parse it as a Comma Separated Value
     # list of strings.       
-    for csv_file_name in csv_file_list:
-        
-        full_file_name = path.join(getcwd(), relative_path, csv_file_name)
+    for full_file_name in get_fcsv_dependencies(filename):
         
         debugprint("Loading fiducials from CSV file: '" + full_file_name + "'", debug_levels.DETAILED_DEBUG)
         
@@ -109,4 +120,204 @@ def load_fiducials_from_mrml_slicer_v_4_3(filename, fiducial_list):
             z = fidvalues[SLICER4_3_CSV_Z_INDEX]
         
             debugprint("Creating Fiducial from CSV: " + name + "," + x + "," + y + "," + z, debug_levels.DETAILED_DEBUG)
-            fiducial_list[name] = Fiducial(name,float(x),float(y),float(z))
\ No newline at end of file
+            fiducial_list[name] = Fiducial(name,float(x),float(y),float(z))
+
+class SweepItem(object):
+    ''' One MRML scene found by a sweep, ready to hand to a loader. '''
+
+    _filename = None # Name of the MRML file
+    _slicer_version = None # One of SLICER_VERSIONS, detected from the file's content
+    _dependencies = None # Full names of the FCSV files the scene's fiducials live in (Slicer 4.3+ only)
+    _missing_dependencies = None # Those of _dependencies which do not exist
+
+    def __init__(self, filename, slicer_version, dependencies, missing_dependencies):
+        self._filename = filename
+        self._slicer_version = slicer_version
+        self._dependencies = dependencies
+        self._missing_dependencies = missing_dependencies
+
+    def is_loadable(self):
+        return ((self._slicer_version != SLICER_VERSIONS.UNKNOWN) and (len(self._missing_dependencies) == 0))
+
+def detect_slicer_version(contents):
+    ''' Work out which Slicer version wrote an MRML file from its contents, by looking for the node that holds its fiducials. '''
+
+    if (("<" + SLICER4_3_FIDUCIAL_XML_NODE_NAME) in contents): return SLICER_VERSIONS.SLICER4_3
+    if (("<" + SLICER4_2_FIDUCIAL_XML_NODE_NAME) in contents): return SLICER_VERSIONS.SLICER4_2
+
+    return SLICER_VERSIONS.UNKNOWN
+
+def get_sweep_item(filename):
+    ''' Read an MRML file just far enough to build its SweepItem. '''
+
+    with open(filename) as openfile: contents = str(openfile.read())
+
+    slicer_version = detect_slicer_version(contents)
+
+    dependencies = []
+    if (slicer_version == SLICER_VERSIONS.SLICER4_3):
+        dependencies = get_fcsv_dependencies(filename, contents)
+
+    missing_dependencies = [dependency for dependency in dependencies if not path.isfile(dependency)]
+
+    return SweepItem(filename, slicer_version, dependencies, missing_dependencies)
+
+def _scan_directory(dirname):
+    ''' Thread pool helper - list one directory and stat everything in it, returning [MRML file names, subdirectory names].
+    Symbolic links to directories are not followed, so a link loop can't trap the sweep. '''
+
+    mrml_files = []
+    subdirs = []
+
+    try:
+        names = listdir(dirname)
+    except OSError as error:
+        debugprint("WARNING: Cannot list directory " + dirname + ": " + str(error), debug_levels.ERRORS)
+        return [mrml_files, subdirs]
+
+    for name in names:
+        fullname = path.join(dirname, name)
+
+        try:
+            mode = lstat(fullname).st_mode
+        except OSError:
+            continue
+
+        if S_ISDIR(mode):
+            subdirs.append(fullname)
+        elif name.lower().endswith(MRML_EXTENSION) and (not S_ISLNK(mode) or path.isfile(fullname)):
+            mrml_files.append(fullname)
+
+    return [mrml_files, subdirs]
+
+def find_mrml_files(dirname, threads = SWEEP_THREADS, pool = None):
+    ''' Recursively list every MRML file under dirname, listing each level of the tree across a pool of threads.
+    Returns the file names, sorted.  An existing ThreadPool may be passed in to reuse its threads. '''
+
+    mrml_files = []
+
+    own_pool = (pool == None)
+    if own_pool: pool = ThreadPool(threads)
+
+    try:
+        pending = [dirname]
+
+        while (len(pending) > 0):
+            results = pool.map(_scan_directory, pending)
+
+            pending = []
+            for [files, subdirs] in results:
+                mrml_files.extend(files)
+                pending.extend(subdirs)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    mrml_files.sort()
+
+    return mrml_files
+
+def sweep_directory(dirname, threads = SWEEP_THREADS):
+    ''' Recursively find every MRML scene under dirname, listing the tree and reading the scenes across a pool of threads.
+    Returns a list of SweepItems sorted by file name, including scenes that cannot be loaded (see SweepItem.is_loadable). '''
+
+    pool = ThreadPool(threads)
+
+    try:
+        mrml_files = find_mrml_files(dirname, threads, pool)
+        items = pool.map(get_sweep_item, mrml_files)
+    finally:
+        pool.close()
+        pool.join()
+
+    return items
+
+def read_manifest(filename):
+    ''' Read a manifest file, returning its entries - one file or directory name per line, relative to the manifest's own directory.
+    Blank lines and lines starting with '#' are skipped. '''
+
+    entries = []
+
+    with open(filename) as openfile:
+        for line in openfile:
+            line = line.strip()
+            if ((len(line) == 0) or line.startswith('#')): continue
+
+            entries.append(path.normpath(path.join(path.dirname(filename), line)))
+
+    return entries
+
+def read_metadata_manifest(filename):
+    ''' Read a metadata manifest - a CSV table whose first column names a scan (an MRML file, directory or manifest, relative to the
+    metadata manifest's own directory) and whose other columns hold that scan's metadata, such as diagnosis, age band or timepoint.
+    The first line holds the column names.  Blank lines and lines starting with '#' are skipped.
+    Returns [metadata field names, list of [entry, list of metadata values]]. '''
+
+    fields = None
+    entries = []
+
+    with open(filename, 'rb') as openfile:
+        for row in csv.reader(openfile):
+            row = [value.strip() for value in row]
+            if ((len(row) == 0) or (len(row[0]) == 0) or row[0].startswith('#')): continue
+
+            if (fields == None):
+                fields = row[1:]
+                continue
+
+            # Short rows are missing their last values.
+            values = (row[1:] + [""] * len(fields))[0:len(fields)]
+            entries.append([path.normpath(path.join(path.dirname(filename), row[0])), values])
+
+    if (fields == None): fields = []
+
+    return [fields, entries]
+
+def expand_metadata_manifest(filename, threads = SWEEP_THREADS):
+    ''' Read a metadata manifest (see read_metadata_manifest) and expand each of its entries as expand_input_arguments does, giving every
+    MRML file found the metadata of the entry it came from.  Returns [metadata field names, OrderedDict of MRML file name to values]. '''
+
+    [fields, entries] = read_metadata_manifest(filename)
+
+    metadata = OrderedDict()
+    for entry, values in entries:
+        for mrml_filename in expand_input_arguments([entry], threads):
+            metadata[mrml_filename] = values
+
+    return [fields, metadata]
+
+def expand_input_arguments(arguments, threads = SWEEP_THREADS, visited_manifests = None):
+    ''' Expand a list of command-line arguments into MRML file names: each directory becomes the loadable scenes swept from beneath it,
+    and each manifest becomes the (expanded) entries it lists.  Anything else (MRML files, saved ranges, separators) is passed through as-is,
+    so every executable can accept directories and manifests wherever it accepts file names.
+    visited_manifests is the set of real paths of the manifests already expanded; a manifest listed again (e.g. by one of the manifests it
+    lists) is skipped, so that manifests listing each other don't recurse forever. '''
+
+    if (visited_manifests == None): visited_manifests = set()
+
+    expanded = []
+
+    for argument in arguments:
+        if path.isdir(argument):
+            for item in sweep_directory(argument, threads):
+                if item.is_loadable():
+                    expanded.append(item._filename)
+                elif (item._slicer_version == SLICER_VERSIONS.UNKNOWN):
+                    debugprint("WARNING: Skipping " + item._filename + ", which holds no fiducials we recognize.", debug_levels.ERRORS)
+                else:
+                    debugprint("WARNING: Skipping " + item._filename + ", which is missing " + ", ".join(item._missing_dependencies), debug_levels.ERRORS)
+
+        elif (argument.endswith(MANIFEST_EXTENSION) and path.isfile(argument)):
+            manifest_path = path.realpath(argument)
+            if (manifest_path in visited_manifests):
+                debugprint("WARNING: Skipping " + argument + ", which has already been expanded.", debug_levels.ERRORS)
+                continue
+
+            visited_manifests.add(manifest_path)
+            expanded.extend(expand_input_arguments(read_manifest(argument), threads, visited_manifests))
+
+        else:
+            expanded.append(argument)
+
+    return expanded
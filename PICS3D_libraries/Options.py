@@ -32,6 +32,9 @@ SLICER4_3_CSV_X_INDEX=1
 SLICER4_3_CSV_Y_INDEX=2
 SLICER4_3_CSV_Z_INDEX=3
 
+# Slicer versions whose MRML fiducial formats we can tell apart by their content.
+SLICER_VERSIONS = enum('UNKNOWN', 'SLICER4_2', 'SLICER4_3')
+
 # *****************************************************************
 # ********** OK TO CHANGE CAREFULLY BELOW HERE. ************
 # *****************************************************************
@@ -57,6 +60,7 @@ CREATE_IIS = False
 LEFT_EDGE_PREFIX="L_"
 RIGHT_EDGE_PREFIX="R_"
 CENTER_PREFIX="Mid_"
+RESAMPLED_PREFIX="S_"
 
 # *****************************************************************
 # PICS3D and scaling options
@@ -109,4 +113,26 @@ if (AXIS_CODING == AXIS_CODING_OPTIONS.lisse):
 if (AXIS_CODING == AXIS_CODING_OPTIONS.pics3d):
     AXIS_CODING_LR = COORDS.Z
     AXIS_CODING_IS = COORDS.Y
-    AXIS_CODING_AP = COORDS.X
\ No newline at end of file
+    AXIS_CODING_AP = COORDS.X
+
+# *****************************************************************
+# Export options
+# *****************************************************************
+
+# Result tables can be written as CSV text, or as a compressed numpy archive holding one array per column.
+EXPORT_FORMAT_OPTIONS = enum('CSV', 'COLUMNAR')
+
+# How many rows should a result table hold in memory before writing them out in one go?
+EXPORT_BUFFER_ROWS = 1000
+
+# *****************************************************************
+# Directory sweep options
+# *****************************************************************
+
+# Any argument naming a directory is swept (recursively) for files ending in MRML_EXTENSION,
+# and any argument ending in MANIFEST_EXTENSION is read as a list of files or directories, one per line.
+MRML_EXTENSION = ".mrml"
+MANIFEST_EXTENSION = ".manifest"
+
+# How many threads should list directories and read MRML files at once during a sweep?
+SWEEP_THREADS = 8
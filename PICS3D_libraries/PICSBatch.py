@@ -0,0 +1,301 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Batched PICS normalization - build the PICS transform of every scan in a cohort under many configurations at once,
+# and apply them all as stacked matrix products over the cohort's raw coordinates, instead of correcting one scan at a time.
+# Mirrors PICSMath (transforms and scaling), VaginalProperties (paravaginal gaps and row widths) and
+# set_pelvic_tilt_correction_info (tilt angles), so a sweep gives the same numbers as correcting each scan under each configuration.
+
+import numpy
+
+# Generic custom imports
+from Utilities import debug_levels, debugprint, rad_to_degrees
+
+# Domain specific custom imports
+from CohortArrays import CohortArrays
+from VectorMath import NEGLIGABLY_SMALL_NUMBER
+
+# Constants
+from Options import COORDS, AXIS_CODING_OPTIONS
+from Options import PUBIC_SYMPHYSIS_NAME, SC_JOINT_NAME, LEFT_ISCHIAL_SPINE_NAME, RIGHT_ISCHIAL_SPINE_NAME, INTER_ISCHIAL_SPINE_NAME
+
+# The reference points every transform is built from, in the order RawCohortArrays._reference_indices holds them.
+PICS_REFERENCE_NAMES = [PUBIC_SYMPHYSIS_NAME, SC_JOINT_NAME, LEFT_ISCHIAL_SPINE_NAME, RIGHT_ISCHIAL_SPINE_NAME]
+REFERENCE_INDEX = dict(zip(PICS_REFERENCE_NAMES, range(len(PICS_REFERENCE_NAMES))))
+
+class RawCohortArrays(object):
+    ''' Stacked raw (radiological, uncorrected) coordinates of a cohort, with index arrays saying which point plays which part -
+        reference point, collated fiducial, or place in the row grid - in each scan.  Index arrays hold -1 where a scan has no such point. '''
+
+    _scan_names = None # List of N scan names
+    _point_names = None # List of P raw fiducial names, the union over all scans
+    _points = None # N x P x 3 array of raw coordinates, NaN where a scan lacks the point
+
+    _reference_indices = None # N x 4 array of point indices of each scan's PICS_REFERENCE_NAMES
+    _fid_names = None # List of F standardized (collated) fiducial names
+    _collated_indices = None # N x F array of point indices of each scan's collated fiducials
+    _row_indices = None # N x R x C array of point indices of each scan's row grid (row 1, column 1 is [:, 0, 0])
+    _row_counts = None # N array of the number of rows each scan has a width for
+
+    def __init__(self, scan_names, point_names, points, reference_indices, fid_names, collated_indices, row_indices, row_counts):
+        self._scan_names = scan_names
+        self._point_names = point_names
+        self._points = points
+        self._reference_indices = reference_indices
+        self._fid_names = fid_names
+        self._collated_indices = collated_indices
+        self._row_indices = row_indices
+        self._row_counts = row_counts
+
+    def get_scan_count(self):
+        return len(self._scan_names)
+
+def build_raw_cohort_arrays(propslist, collated_fid_dicts):
+    ''' Stack a list of loaded but not yet PICS-corrected VaginalProperties into a RawCohortArrays.
+        collated_fid_dicts holds one dictionary per entry in propslist, mapping standardized fiducial names to that scan's Fiducial.
+        Scans lacking any of the PICS reference points cannot be corrected, so are left out with an error message. '''
+
+    usable = []
+    for scanindex in range(len(propslist)):
+        fid_points = propslist[scanindex]._fiducial_points
+        missing = [name for name in PICS_REFERENCE_NAMES if not fid_points.has_key(name)]
+
+        if (len(missing) > 0):
+            debugprint("Error!  Leaving " + propslist[scanindex]._name + " out of the sweep, as it is missing " + ", ".join(missing),
+                       debug_levels.ERRORS)
+        else:
+            usable.append(scanindex)
+
+    propslist = [propslist[scanindex] for scanindex in usable]
+    collated_fid_dicts = [collated_fid_dicts[scanindex] for scanindex in usable]
+
+    # Gather the union of raw point names and of standardized names, keeping the order in which we first see them.
+    point_names = []
+    fid_names = []
+    for vag_props, fid_dict in zip(propslist, collated_fid_dicts):
+        for names, new_names in [[point_names, vag_props._fiducial_points.keys()], [fid_names, fid_dict.keys()]]:
+            for name in new_names:
+                # The inter-ischial spine point is created by compute_properties, not loaded.
+                if (name not in names) and (name != INTER_ISCHIAL_SPINE_NAME): names.append(name)
+
+    point_index = dict(zip(point_names, range(len(point_names))))
+    fid_index = dict(zip(fid_names, range(len(fid_names))))
+
+    scan_count = len(propslist)
+    row_count = max([len(vag_props._rows) for vag_props in propslist] + [0])
+    column_count = max([len(row) for vag_props in propslist for row in vag_props._rows] + [0])
+
+    points = numpy.empty((scan_count, len(point_names), 3))
+    points.fill(numpy.nan)
+
+    reference_indices = numpy.empty((scan_count, len(PICS_REFERENCE_NAMES)), dtype=int)
+    collated_indices = -1 * numpy.ones((scan_count, len(fid_names)), dtype=int)
+    row_indices = -1 * numpy.ones((scan_count, row_count, column_count), dtype=int)
+    row_counts = numpy.zeros(scan_count, dtype=int)
+
+    for scanindex in range(scan_count):
+        vag_props = propslist[scanindex]
+
+        # Find each of this scan's Fiducials by identity, since collation and the row grid hand us Fiducials rather than names.
+        scan_point_index = {}
+        for name, fid in vag_props._fiducial_points.iteritems():
+            if (name not in point_index): continue
+            points[scanindex, point_index[name]] = fid.coords[0:3]
+            scan_point_index[id(fid)] = point_index[name]
+
+        for name in PICS_REFERENCE_NAMES:
+            reference_indices[scanindex, REFERENCE_INDEX[name]] = point_index[name]
+
+        for fidname, fid in collated_fid_dicts[scanindex].iteritems():
+            if (fid != None) and (id(fid) in scan_point_index):
+                collated_indices[scanindex, fid_index[fidname]] = scan_point_index[id(fid)]
+
+        for rowindex in range(len(vag_props._rows)):
+            for colindex in range(len(vag_props._rows[rowindex])):
+                fid = vag_props._rows[rowindex][colindex]
+                if fid and (id(fid) in scan_point_index):
+                    row_indices[scanindex, rowindex, colindex] = scan_point_index[id(fid)]
+
+        row_counts[scanindex] = len(vag_props._rows)
+
+    return RawCohortArrays([vag_props._name for vag_props in propslist], point_names, points,
+                           reference_indices, fid_names, collated_indices, row_indices, row_counts)
+
+def _normalize_rows(vectors):
+    ''' Normalize every vector along the last axis of vectors, leaving zero vectors as zero (as VectorMath.normalize does). '''
+
+    magnitudes = numpy.sqrt((vectors ** 2).sum(axis=-1))[..., numpy.newaxis]
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(magnitudes == 0, 0, vectors / magnitudes)
+
+def _gather_points(points, indices):
+    ''' Given ... x N x P x 3 points and an N x (...) array of point indices (-1 for missing), gather the indexed points
+        into a ... x N x (...) x 3 array, with NaN for the missing ones. '''
+
+    scan_index = numpy.arange(indices.shape[0]).reshape((-1,) + (1,) * (indices.ndim - 1))
+    gathered = points[..., scan_index, numpy.maximum(indices, 0), :]
+
+    return numpy.where((indices >= 0)[..., numpy.newaxis], gathered, numpy.nan)
+
+def build_pics_axes(reference_points, configuration):
+    ''' Build the LR, AP and IS axes of every scan under configuration from an N x 4 x 3 array of raw PICS_REFERENCE_NAMES coordinates,
+        as pics_get_LR_axis, pics_get_AP_axis and pics_get_IS_axis would.  Returns [LR axes, AP axes, IS axes], each N x 3. '''
+
+    pubic_symphysis = reference_points[:, REFERENCE_INDEX[PUBIC_SYMPHYSIS_NAME]]
+    sc_joint = reference_points[:, REFERENCE_INDEX[SC_JOINT_NAME]]
+    left_is = reference_points[:, REFERENCE_INDEX[LEFT_ISCHIAL_SPINE_NAME]]
+    right_is = reference_points[:, REFERENCE_INDEX[RIGHT_ISCHIAL_SPINE_NAME]]
+
+    # See pics_get_LR_axis, pics_get_AP_axis and pics_get_IS_axis.
+    LR_axis = _normalize_rows(left_is - right_is)
+
+    SCIPP_line = _normalize_rows(sc_joint - pubic_symphysis)
+    angle_adjustment = configuration._desired_scipp_angle - numpy.arctan(SCIPP_line[:, COORDS.Z] / SCIPP_line[:, COORDS.Y])
+
+    AP_axis = numpy.zeros(LR_axis.shape)
+    AP_axis[:, COORDS.Y] = -1 * numpy.cos(angle_adjustment)
+    AP_axis[:, COORDS.Z] = numpy.sin(angle_adjustment)
+    AP_axis = _normalize_rows(AP_axis)
+
+    IS_axis = numpy.cross(LR_axis, AP_axis)
+
+    return [LR_axis, AP_axis, IS_axis]
+
+def get_pics_tilt(LR_axis, AP_axis, IS_axis):
+    ''' Return an N x 3 array of the pitch, roll and yaw tilt correction angles, in radians, of N x 3 arrays of PICS axes:
+        the angle of each new axis from the radiological one, as in set_pelvic_tilt_correction_info. '''
+
+    tilt = numpy.empty((LR_axis.shape[0], 3))
+    for angleindex, reference_axis, axis in [[0, [-1, 0, 0], LR_axis], [1, [0, -1, 0], AP_axis], [2, [0, 0, 1], IS_axis]]:
+        tilt[:, angleindex] = numpy.arccos(_normalize_rows(axis).dot(reference_axis))
+
+    return tilt
+
+def build_pics_transforms(reference_points, configuration):
+    ''' Build the PICS transform of every scan under configuration, exactly as pics_recenter_and_reorient would (including scaling).
+        reference_points is an N x 4 x 3 array of raw PICS_REFERENCE_NAMES coordinates.
+        Returns [transforms, tilt]: an N x 4 x 4 array of row-vector transforms (so [x, y, z, 1] times a transform gives the PICS
+        coordinates), and an N x 3 array of pitch, roll and yaw tilt correction angles in radians. '''
+
+    pubic_symphysis = reference_points[:, REFERENCE_INDEX[PUBIC_SYMPHYSIS_NAME]]
+    sc_joint = reference_points[:, REFERENCE_INDEX[SC_JOINT_NAME]]
+    left_is = reference_points[:, REFERENCE_INDEX[LEFT_ISCHIAL_SPINE_NAME]]
+    right_is = reference_points[:, REFERENCE_INDEX[RIGHT_ISCHIAL_SPINE_NAME]]
+
+    [LR_axis, AP_axis, IS_axis] = build_pics_axes(reference_points, configuration)
+
+    # Each new axis becomes a column of the rotation, as in lisse_axes_matrix_fn and pics3d_axes_matrix_fn.
+    if (configuration._axis_coding == AXIS_CODING_OPTIONS.lisse):
+        rotation = numpy.concatenate([axis[:, :, numpy.newaxis] for axis in [LR_axis, AP_axis, IS_axis]], axis=2)
+    elif (configuration._axis_coding == AXIS_CODING_OPTIONS.pics3d):
+        rotation = numpy.concatenate([axis[:, :, numpy.newaxis] for axis in [AP_axis, IS_axis, LR_axis]], axis=2)
+    else:
+        raise ValueError("Error: Unknown axis coding " + str(configuration._axis_coding))
+
+    transforms = numpy.zeros((reference_points.shape[0], 4, 4))
+    transforms[:, 0:3, 0:3] = rotation
+    transforms[:, 3, 0:3] = numpy.einsum('si,sij->sj', -1 * pubic_symphysis, rotation)
+    transforms[:, 3, 3] = 1
+
+    # Scaling is measured on the corrected points, as in pics_normalize_to_SCIPP_line and pics_normalize_to_ischial_spine_width.
+    if configuration._scale_by_scipp_line:
+        corrected_SCIPP = numpy.einsum('si,sij->sj', sc_joint - pubic_symphysis, rotation)
+        scale_factor = configuration._scipp_scale_length / numpy.sqrt((corrected_SCIPP ** 2).sum(axis=-1))
+        transforms[:, :, 0:3] *= scale_factor[:, numpy.newaxis, numpy.newaxis]
+
+    if configuration._scale_by_iis_line:
+        corrected_IIS = numpy.einsum('si,sij->sj', left_is - right_is, transforms[:, 0:3, 0:3])
+        scale_factor = configuration._iis_scale_length / numpy.sqrt((corrected_IIS ** 2).sum(axis=-1))
+        transforms[:, :, configuration._axis_coding_lr] *= scale_factor[:, numpy.newaxis]
+
+    return [transforms, get_pics_tilt(LR_axis, AP_axis, IS_axis)]
+
+def apply_transforms(points, transforms):
+    ''' Apply G x N stacked 4 x 4 row-vector transforms to N x P x 3 points in one batched product, returning G x N x P x 3 points. '''
+
+    homogeneous = numpy.concatenate([points, numpy.ones(points.shape[:-1] + (1,))], axis=-1)
+
+    return numpy.einsum('spi,gsij->gspj', homogeneous, transforms)[..., 0:3]
+
+def _perpendicular_components(reference_vectors, comparison_vectors):
+    ''' VectorMath.perpendicular_component, broadcast over the leading axes. '''
+
+    reference_magnitudes = numpy.sqrt((reference_vectors ** 2).sum(axis=-1))[..., numpy.newaxis]
+    comparison_magnitudes = numpy.sqrt((comparison_vectors ** 2).sum(axis=-1))[..., numpy.newaxis]
+
+    reference_normals = _normalize_rows(reference_vectors)
+    parallel = reference_normals * (reference_normals * comparison_vectors).sum(axis=-1)[..., numpy.newaxis]
+
+    negligible = (reference_magnitudes < NEGLIGABLY_SMALL_NUMBER) | (comparison_magnitudes < NEGLIGABLY_SMALL_NUMBER)
+
+    return numpy.where(negligible, 0, comparison_vectors - parallel)
+
+def compute_paravaginal_gaps(coords, reference_points, is_axes):
+    ''' Compute the paravaginal gaps of G x N x F corrected fiducial coordinates, as VaginalProperties does one fiducial at a time.
+        reference_points holds the G x N x 4 x 3 corrected reference points, and is_axes the inferior-superior axis of each of the G
+        configurations.  Returns a G x N x F x 3 array indexed by CohortArrays.GAP_COMPONENTS. '''
+
+    pubic_symphysis = reference_points[:, :, numpy.newaxis, REFERENCE_INDEX[PUBIC_SYMPHYSIS_NAME]]
+    left_PIS = reference_points[:, :, numpy.newaxis, REFERENCE_INDEX[LEFT_ISCHIAL_SPINE_NAME]] - pubic_symphysis
+    right_PIS = reference_points[:, :, numpy.newaxis, REFERENCE_INDEX[RIGHT_ISCHIAL_SPINE_NAME]] - pubic_symphysis
+
+    fid_vectors = coords - pubic_symphysis
+
+    left_perpendicular = _perpendicular_components(left_PIS, fid_vectors)
+    right_perpendicular = _perpendicular_components(right_PIS, fid_vectors)
+
+    left_closer = ((left_perpendicular ** 2).sum(axis=-1) <= (right_perpendicular ** 2).sum(axis=-1))[..., numpy.newaxis]
+    gap_vectors = numpy.where(left_closer, left_perpendicular, right_perpendicular)
+
+    # Points whose nearest approach is in front of the pubic symphysis connect to the symphysis itself (see get_paravaginal_gap_vector).
+    in_front = (((left_PIS * fid_vectors).sum(axis=-1) < (-1 * NEGLIGABLY_SMALL_NUMBER))
+                | ((right_PIS * fid_vectors).sum(axis=-1) < (-1 * NEGLIGABLY_SMALL_NUMBER)))[..., numpy.newaxis]
+    gap_vectors = numpy.where(in_front, fid_vectors, gap_vectors)
+
+    # Pick out each configuration's inferior-superior component with a one-hot mask.
+    is_mask = numpy.zeros((len(is_axes), 1, 1, 3))
+    is_mask[numpy.arange(len(is_axes)), 0, 0, is_axes] = 1
+
+    gaps = numpy.empty(coords.shape)
+    gaps[..., 0] = numpy.sqrt((gap_vectors ** 2).sum(axis=-1))
+    gaps[..., 1] = (gap_vectors * is_mask).sum(axis=-1)
+    gaps[..., 2] = numpy.sqrt(((gap_vectors * (1 - is_mask)) ** 2).sum(axis=-1))
+
+    return gaps
+
+def compute_row_widths(grid_coords, row_counts):
+    ''' Compute the width of every row from G x N x R x C x 3 corrected row grid coordinates (NaN where there is no point), as the
+        sum of the distances between neighbouring points.  Rows past a scan's row count are NaN, as in build_cohort_arrays. '''
+
+    steps = numpy.sqrt(((grid_coords[..., 1:, :] - grid_coords[..., :-1, :]) ** 2).sum(axis=-1))
+    widths = numpy.where(numpy.isnan(steps), 0, steps).sum(axis=-1)
+
+    has_row = (numpy.arange(grid_coords.shape[2])[numpy.newaxis, :] < row_counts[:, numpy.newaxis])
+
+    return numpy.where(has_row, widths, numpy.nan)
+
+def sweep_cohort(raw_cohort, configurations):
+    ''' Correct a RawCohortArrays under each of configurations, returning one CohortArrays per configuration, holding the same values
+        build_cohort_arrays would give after correcting every scan with pics_recenter_and_reorient under that configuration. '''
+
+    reference_points = _gather_points(raw_cohort._points, raw_cohort._reference_indices)
+
+    transforms = []
+    tilts = []
+    for configuration in configurations:
+        [scan_transforms, tilt] = build_pics_transforms(reference_points, configuration)
+        transforms.append(scan_transforms)
+        tilts.append(rad_to_degrees(tilt))
+
+    # One batched product corrects every point of every scan under every configuration.
+    corrected = apply_transforms(raw_cohort._points, numpy.array(transforms))
+
+    coords = _gather_points(corrected, raw_cohort._collated_indices)
+    corrected_references = _gather_points(corrected, raw_cohort._reference_indices)
+    is_axes = numpy.array([configuration._axis_coding_is for configuration in configurations], dtype=int)
+
+    gaps = compute_paravaginal_gaps(coords, corrected_references, is_axes)
+    widths = compute_row_widths(_gather_points(corrected, raw_cohort._row_indices), raw_cohort._row_counts)
+
+    return [CohortArrays(raw_cohort._scan_names, raw_cohort._fid_names, coords[index], gaps[index], widths[index], tilts[index])
+            for index in range(len(configurations))]
@@ -3,6 +3,7 @@
 # Collection of math scripts to transform fiducials into the PICS3D system.
 
 # Built in library imports
+from collections import OrderedDict
 from numpy import arctan, sin, cos, matrix, array
 
 # Generic custom imports 
@@ -11,10 +12,11 @@ from Utilities import debug_levels, debugprint, rad_to_degrees
 # Domain specific custom imports
 from Fiducials import vector_from_fiducials 
 from VectorMath import magnitude, normalize, orthogonalize, get_angle_between
+from PICSBatch import PICS_REFERENCE_NAMES
 
 # Constants
-from Options import COORDS, DESIRED_SCIPP_ANGLE, AXIS_CODING, AXIS_CODING_OPTIONS, AXIS_CODING_AP, AXIS_CODING_IS
-from Options import SCALE_BY_SCIPP_LINE, SCALE_BY_IIS_LINE, SCIPP_SCALE_LENGTH, IIS_SCALE_LENGTH
+# Options that vary between runs (axis coding, SCIPP angle, scaling) come from each scan's PICSConfiguration, vag_props._configuration.
+from Options import COORDS, AXIS_CODING_OPTIONS
 from Options import LEFT_ISCHIAL_SPINE_NAME, RIGHT_ISCHIAL_SPINE_NAME, PUBIC_SYMPHYSIS_NAME, SC_JOINT_NAME
 
 def lisse_axes_matrix_fn(vag_props):
@@ -123,7 +125,7 @@ def pics_get_AP_axis(vag_props):
     
     # Determine our angular adjustment in order to reach 34 degrees above the horizontal for the SCIPP line
    
-    angle_adjustment = DESIRED_SCIPP_ANGLE - SCIPP_angle_from_horiz
+    angle_adjustment = vag_props._configuration._desired_scipp_angle - SCIPP_angle_from_horiz
     
     debugprint("SCIPP AP to IS angle is " + str(rad_to_degrees(SCIPP_angle_from_horiz)), debug_levels.DETAILED_DEBUG)
     debugprint("Adjustment AP to IS angle is " + str(rad_to_degrees(angle_adjustment)), debug_levels.DETAILED_DEBUG)
@@ -158,11 +160,12 @@ def pics_generate_transformation_matrix(vag_props):
         and create a matrix from that information.  NO scaling for now - but we may reconsider this in the future.'''
     
     fiducial_points = vag_props._fiducial_points
+    axis_coding = vag_props._configuration._axis_coding
 
-    if (AXIS_CODING == AXIS_CODING_OPTIONS.lisse):
+    if (axis_coding == AXIS_CODING_OPTIONS.lisse):
         transform_matrix=lisse_axes_matrix_fn(vag_props)
 
-    if (AXIS_CODING == AXIS_CODING_OPTIONS.pics3d):
+    if (axis_coding == AXIS_CODING_OPTIONS.pics3d):
         transform_matrix=pics3d_axes_matrix_fn(vag_props)
         
     # To find out how much to translate each old point to the new coordinate system,
@@ -190,7 +193,7 @@ def pics_normalize_to_SCIPP_line(vag_props):
     
     SCIPP_line = pics_get_SCIPP_line(fid_points)
     
-    scale_factor = SCIPP_SCALE_LENGTH/magnitude(SCIPP_line)
+    scale_factor = vag_props._configuration._scipp_scale_length/magnitude(SCIPP_line)
     
     scale_matrix = matrix([[scale_factor,0,0,0],
                               [0,scale_factor,0,0],
@@ -200,6 +203,8 @@ def pics_normalize_to_SCIPP_line(vag_props):
     for fid in fid_points:
         fid_points[fid].coords = transform_coords_by_matrix(fid_points[fid].coords, scale_matrix)
 
+    vag_props._pics_transform = vag_props._pics_transform * scale_matrix
+
 def pics_normalize_to_ischial_spine_width(vag_props):
     ''' Scale all points along the inter-ischial spine line and about the origin, so that the width of the pelvis is normalized. '''
     
@@ -207,16 +212,17 @@ def pics_normalize_to_ischial_spine_width(vag_props):
     
     IIS_line = vector_from_fiducials(fid_points[RIGHT_ISCHIAL_SPINE_NAME], fid_points[LEFT_ISCHIAL_SPINE_NAME])
     
-    scale_factor = IIS_SCALE_LENGTH/magnitude(IIS_line)
+    scale_factor = vag_props._configuration._iis_scale_length/magnitude(IIS_line)
+    axis_coding = vag_props._configuration._axis_coding
     
-    if(AXIS_CODING == AXIS_CODING_OPTIONS.lisse):
+    if(axis_coding == AXIS_CODING_OPTIONS.lisse):
         # Scale along the 'x' axis, which is L<->R.
         scale_matrix = matrix([[scale_factor,0,0,0],
                               [0,1,0,0],
                               [0,0,1,0],
                               [0,0,0,0]])
         
-    if(AXIS_CODING == AXIS_CODING_OPTIONS.pics3d):
+    if(axis_coding == AXIS_CODING_OPTIONS.pics3d):
         # Scale along the 'Z' axis, which is L<->R.
         scale_matrix = matrix([[1,0,0,0],
                               [0,1,0,0],
@@ -226,42 +232,39 @@ def pics_normalize_to_ischial_spine_width(vag_props):
     for fid in fid_points:
         fid_points[fid].coords = transform_coords_by_matrix(fid_points[fid].coords, scale_matrix)
 
+    vag_props._pics_transform = vag_props._pics_transform * scale_matrix
+
+def get_missing_reference_points(fid_points):
+    ''' Return the names of the PICS reference points missing from a dictionary of fiducial points (empty if none are). '''
+    return [name for name in PICS_REFERENCE_NAMES if not fid_points.has_key(name)]
+
 def pics_recenter_and_reorient(vag_props):
-    ''' Rotate, translate, and (someday perhaps) scale all of our fiducial points to fit the PICS reference system. ''' 
+    ''' Rotate, translate, and (someday perhaps) scale all of our fiducial points to fit the PICS reference system. 
+    Raises ValueError, naming the missing points, if vag_props lacks any of the PICS reference points. ''' 
 
     fid_points = vag_props._fiducial_points
 
     ### Here we encode and graph by minimum distance from one of the P->IS lines.        
-    if not (fid_points.has_key(PUBIC_SYMPHYSIS_NAME) 
-        and fid_points.has_key(LEFT_ISCHIAL_SPINE_NAME) 
-        and fid_points.has_key(RIGHT_ISCHIAL_SPINE_NAME)
-        and fid_points.has_key(SC_JOINT_NAME)):
-
-        debugprint("Error!  Cannot find one of the points named: " + PUBIC_SYMPHYSIS_NAME 
-              + ", " + SC_JOINT_NAME 
-              + ", " + LEFT_ISCHIAL_SPINE_NAME 
-              + ", or " + RIGHT_ISCHIAL_SPINE_NAME
-              + " in properties list for " + vag_props._name, debug_levels.ERRORS)
-
-        fidpoints = fid_points
-        if not fidpoints.has_key(PUBIC_SYMPHYSIS_NAME): debugprint("Missing " + PUBIC_SYMPHYSIS_NAME, debug_levels.ERRORS)   
-        if not fidpoints.has_key(LEFT_ISCHIAL_SPINE_NAME): debugprint("Missing " + LEFT_ISCHIAL_SPINE_NAME, debug_levels.ERRORS)
-        if not fidpoints.has_key(RIGHT_ISCHIAL_SPINE_NAME): debugprint("Missing " + RIGHT_ISCHIAL_SPINE_NAME, debug_levels.ERRORS)
-
-        exit()   
-        return
+    missing = get_missing_reference_points(fid_points)
+    if (len(missing) > 0):
+        # Leave it to the caller whether one unusable scan should stop a whole batch.
+        raise ValueError("Error: Cannot PICS-correct " + vag_props._name + " without its reference points - missing " + ", ".join(missing))
 
     set_pelvic_tilt_correction_info(vag_props)
 
     transformation_matrix = pics_generate_transformation_matrix(vag_props)
+
+    # Keep the raw coordinates and the transform (which any scaling below folds into), so single points can be updated later.
+    vag_props._raw_coords = OrderedDict([[fid, fid_points[fid].coords[0:3].copy()] for fid in fid_points])
+    vag_props._pics_transform = transformation_matrix
  
     for fid in fid_points:
         fid_points[fid].coords = transform_coords_by_matrix(fid_points[fid].coords, transformation_matrix)
 
-    if SCALE_BY_SCIPP_LINE:
+    if vag_props._configuration._scale_by_scipp_line:
         pics_normalize_to_SCIPP_line(vag_props)
         
-    if SCALE_BY_IIS_LINE:
+    if vag_props._configuration._scale_by_iis_line:
         pics_normalize_to_ischial_spine_width(vag_props)
     
     vag_props.compute_properties()
@@ -270,16 +273,17 @@ def pics_recenter_and_reorient(vag_props):
 def pics_verify(vag_props):
     
     fid_points = vag_props._fiducial_points
+    configuration = vag_props._configuration
     
     # Determine the sacrococcygeal->inferior pubic point line ("SCIPP line")
     SCIPP_line = normalize(pics_get_SCIPP_line(fid_points))
     
     # Determine the current angle of the SCIPP line from the horizontal
     # Do that by taking the SCIPP angle from the Y axis in the 'old' YZ plane
-    SCIPP_angle_from_horiz = arctan(SCIPP_line[AXIS_CODING_IS]/SCIPP_line[AXIS_CODING_AP])
+    SCIPP_angle_from_horiz = arctan(SCIPP_line[configuration._axis_coding_is]/SCIPP_line[configuration._axis_coding_ap])
     
     debugprint("Final SCIPP angle from horizontal is: " + str(rad_to_degrees(SCIPP_angle_from_horiz)) 
-               + " degrees and should be: " + str(-1 * rad_to_degrees(DESIRED_SCIPP_ANGLE)) + " degrees", debug_levels.BASIC_DEBUG)
+               + " degrees and should be: " + str(-1 * rad_to_degrees(configuration._desired_scipp_angle)) + " degrees", debug_levels.BASIC_DEBUG)
 
 def pics_correct_and_verify(vag_props):
     pics_recenter_and_reorient(vag_props)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# An index of previous patients' scans for finding those most like a new one.  Each scan is summarized by a feature vector - its fiducial
+# coordinates on a standard grid, its row widths and its paravaginal gaps - standardized so that every feature counts equally, and the
+# nearest scans are those whose standardized features lie closest to the new scan's.
+#
+# Feature vectors run to a few hundred dimensions, too many for a k-d tree to prune anything, so the index instead keeps the standardized
+# vectors and their squared lengths, and answers a whole batch of queries with one matrix product.  Scans are added (or replaced) as they
+# are processed, under the standardization the index was built with, and the index can be saved and reloaded.
+
+import numpy
+
+# Generic custom imports
+from CohortArrays import GAP_COMPONENTS
+
+# Bump this whenever the layout of a saved patient index file changes.
+PATIENT_INDEX_FORMAT_VERSION = 1
+
+def get_feature_names(cohort):
+    ''' Name each feature of a CohortArrays' scans: the X, Y and Z coordinates and total paravaginal gap of each fiducial, and the width of each row. '''
+
+    names = []
+    for fid_name in cohort._fid_names:
+        names += [fid_name + " X", fid_name + " Y", fid_name + " Z"]
+    names += [fid_name + " Gap" for fid_name in cohort._fid_names]
+    names += ["Width Row " + str(rowindex + 1) for rowindex in range(cohort._widths.shape[1])]
+
+    return names
+
+def get_feature_matrix(cohort, feature_names = None):
+    ''' Return the N x D array of features of a CohortArrays' scans, in the order of feature_names (by default, all of get_feature_names),
+        with NaN for any feature a scan (or the whole cohort) lacks. '''
+
+    features = numpy.hstack([cohort._coords.reshape((cohort.get_scan_count(), -1)),
+                             cohort._gaps[:, :, GAP_COMPONENTS.TOTAL],
+                             cohort._widths])
+
+    if (feature_names == None): return features
+
+    feature_index = dict(zip(get_feature_names(cohort), range(features.shape[1])))
+
+    aligned = numpy.empty((cohort.get_scan_count(), len(feature_names)))
+    aligned.fill(numpy.nan)
+    for newindex in range(len(feature_names)):
+        oldindex = feature_index.get(feature_names[newindex])
+        if (oldindex != None): aligned[:, newindex] = features[:, oldindex]
+
+    return aligned
+
+class PatientIndex(object):
+    ''' Standardized feature vectors of indexed scans, for k-nearest-neighbour lookup. '''
+
+    _feature_names = None # List of D feature names
+    _means = None # D array of each feature's mean over the scans the index was built from
+    _scales = None # D array of each feature's standard deviation over those scans (1 where it did not vary)
+    _scan_names = None # List of N indexed scan names
+    _features = None # N x D array of standardized features, 0 (the mean) where a scan lacks a feature
+    _squared_norms = None # N array of the squared length of each scan's standardized features
+
+    def __init__(self, feature_names, means, scales, scan_names = None, features = None):
+        self._feature_names = list(feature_names)
+        self._means = means
+        self._scales = scales
+        self._scan_names = []
+        self._features = numpy.zeros((0, len(feature_names)))
+        self._squared_norms = numpy.zeros(0)
+
+        if (scan_names != None): self._set_scans(list(scan_names), features)
+
+    def get_scan_count(self):
+        return len(self._scan_names)
+
+    def _set_scans(self, scan_names, features):
+        self._scan_names = scan_names
+        self._features = features
+        self._squared_norms = (features ** 2).sum(axis=1)
+
+    def standardize(self, values):
+        ''' Standardize an N x D array of features in _feature_names order, filling in missing (NaN) features with the mean. '''
+
+        standardized = (numpy.asarray(values, dtype=float) - self._means) / self._scales
+        standardized[numpy.isnan(standardized)] = 0
+
+        return standardized
+
+    def add_scans(self, scan_names, values):
+        ''' Index the named scans' N x D features (in _feature_names order), replacing any scan already indexed under the same name. '''
+
+        if (len(scan_names) == 0): return
+
+        standardized = self.standardize(values)
+
+        replaced = set(scan_names)
+        kept = [scanindex for scanindex in range(self.get_scan_count()) if (self._scan_names[scanindex] not in replaced)]
+
+        self._set_scans([self._scan_names[scanindex] for scanindex in kept] + list(scan_names),
+                        numpy.vstack([self._features[kept], standardized]))
+
+    def query(self, values, k):
+        ''' Find the k indexed scans nearest each of an M x D array of features.  Returns [M x k distances, M x k scan indices],
+            nearest first; if fewer than k scans are indexed, all of them are returned. '''
+
+        queries = self.standardize(values)
+        k = min(k, self.get_scan_count())
+
+        # |q - x|^2 = |q|^2 + |x|^2 - 2 q.x, for every query and scan at once.
+        squared = (queries ** 2).sum(axis=1)[:, numpy.newaxis] + self._squared_norms[numpy.newaxis, :] - 2 * numpy.dot(queries, self._features.T)
+        squared = numpy.maximum(squared, 0)
+
+        if (k == 0): return [numpy.zeros((len(queries), 0)), numpy.zeros((len(queries), 0), dtype=int)]
+
+        # Find each query's k nearest without sorting the rest, then sort just those k.
+        nearest = numpy.argpartition(squared, k - 1, axis=1)[:, 0:k]
+        nearest_squared = squared[numpy.arange(len(queries))[:, numpy.newaxis], nearest]
+        order = numpy.argsort(nearest_squared, axis=1)
+        rows = numpy.arange(len(queries))[:, numpy.newaxis]
+
+        return [numpy.sqrt(nearest_squared[rows, order]), nearest[rows, order]]
+
+def build_patient_index(cohort):
+    ''' Build a PatientIndex of every scan of a CohortArrays, standardizing each feature by its mean and standard deviation over the cohort. '''
+
+    features = get_feature_matrix(cohort)
+
+    with numpy.errstate(invalid='ignore'):
+        means = numpy.nanmean(features, axis=0) if (len(features) > 0) else numpy.zeros(features.shape[1])
+        scales = numpy.nanstd(features, axis=0) if (len(features) > 0) else numpy.ones(features.shape[1])
+
+    means[numpy.isnan(means)] = 0
+    scales[~(scales > 0)] = 1
+
+    index = PatientIndex(get_feature_names(cohort), means, scales)
+    index.add_scans(cohort._scan_names, features)
+
+    return index
+
+def add_cohort_to_index(index, cohort):
+    ''' Add (or replace) every scan of a CohortArrays in a PatientIndex, ignoring any feature the index was not built with. '''
+    index.add_scans(cohort._scan_names, get_feature_matrix(cohort, index._feature_names))
+
+def query_patient_index(index, cohort, k):
+    ''' Find the k indexed scans most like each scan of a CohortArrays.  Returns [M lists of distances, M lists of indexed scan names],
+        up to k each; a scan already in the index is left out of its own matches. '''
+
+    # Ask for one extra so there are still k left once a query's own entry is dropped.
+    [distances, indices] = index.query(get_feature_matrix(cohort, index._feature_names), k + 1)
+
+    kept_distances = []
+    kept_names = []
+    for scanindex in range(cohort.get_scan_count()):
+        matches = [neighbour for neighbour in range(len(indices[scanindex]))
+                   if (index._scan_names[indices[scanindex][neighbour]] != cohort._scan_names[scanindex])][0:k]
+        kept_distances.append([distances[scanindex][neighbour] for neighbour in matches])
+        kept_names.append([index._scan_names[indices[scanindex][neighbour]] for neighbour in matches])
+
+    return [kept_distances, kept_names]
+
+def save_patient_index(filename, index):
+    ''' Save a PatientIndex to filename, to be loaded with load_patient_index. '''
+
+    arrays = {}
+    arrays["format_version"] = numpy.array([PATIENT_INDEX_FORMAT_VERSION])
+    arrays["feature_names"] = numpy.array(index._feature_names)
+    arrays["means"] = index._means
+    arrays["scales"] = index._scales
+    arrays["scan_names"] = numpy.array(index._scan_names)
+    arrays["features"] = index._features
+
+    # Write through a file object so numpy doesn't tack its own extension onto our filename.
+    with open(filename, 'wb') as outfile:
+        numpy.savez_compressed(outfile, **arrays)
+
+def load_patient_index(filename):
+    ''' Load a PatientIndex saved by save_patient_index. '''
+
+    arrays = numpy.load(filename)
+
+    format_version = int(arrays["format_version"][0])
+    if (format_version != PATIENT_INDEX_FORMAT_VERSION):
+        raise ValueError("Error: " + filename + " is a saved patient index of format version " + str(format_version)
+                         + ", but only version " + str(PATIENT_INDEX_FORMAT_VERSION) + " can be loaded.")
+
+    return PatientIndex([str(name) for name in arrays["feature_names"]], arrays["means"], arrays["scales"],
+                        [str(name) for name in arrays["scan_names"]], arrays["features"])
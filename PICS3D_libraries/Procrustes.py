@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Generalized Procrustes alignment of a cohort - rotate and translate (and optionally scale) every scan onto the cohort's mean shape
+# over the fiducials they share, then recompute the mean and repeat until it settles.  Unlike PICS normalization, which places each
+# scan by its four reference points alone, this uses every collated fiducial, so one imprecise landmark moves a scan much less.
+#
+# Every scan is fit at once: the cross-covariances of the whole cohort are stacked into an N x 3 x 3 array and decomposed by one batched SVD.
+# Transforms are 4 x 4 row-vector matrices, as in PICSMath (coords * transform), so they fold straight into a scan's _pics_transform.
+
+import numpy
+
+# How many times should the mean shape be re-estimated, and how small a change (in mm) counts as converged?
+PROCRUSTES_ITERATIONS = 20
+PROCRUSTES_TOLERANCE = 1e-4
+
+# Scans sharing fewer fiducials than this with the mean shape cannot be rotated reliably, so are left where they are.
+MINIMUM_SHARED_FIDUCIALS = 3
+
+def _nan_mean_shape(shapes):
+    ''' Return the F x 3 mean of N x F x 3 shapes over the scans that have each fiducial, NaN for fiducials no scan has. '''
+
+    present = ~numpy.isnan(shapes)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(present, shapes, 0).sum(axis=0) / present.sum(axis=0)
+
+def apply_row_transforms(shapes, transforms):
+    ''' Apply N stacked 4 x 4 row-vector transforms to N x F x 3 shapes, returning the transformed N x F x 3 shapes. '''
+    return numpy.einsum('nfi,nij->nfj', shapes, transforms[:, 0:3, 0:3]) + transforms[:, numpy.newaxis, 3, 0:3]
+
+def fit_similarity_transforms(shapes, target, scale = False):
+    ''' Find, for each of N x F x 3 shapes, the rotation and translation (and uniform scale, if scale is True) that best fits it onto
+        the F x 3 target shape in the least squares sense, over the fiducials both have (Kabsch's method, without reflections).
+        Returns an N x 4 x 4 array of row-vector transforms - identity for any shape sharing too few fiducials with the target. '''
+
+    weights = ~(numpy.isnan(shapes).any(axis=2) | numpy.isnan(target).any(axis=1)[numpy.newaxis, :])
+    counts = weights.sum(axis=1)
+    fittable = (counts >= MINIMUM_SHARED_FIDUCIALS)
+
+    mask = weights[:, :, numpy.newaxis]
+    safe_counts = numpy.maximum(counts, 1)[:, numpy.newaxis]
+
+    # Each shape's centroid, and the target's centroid over just the fiducials that shape has.
+    shape_centroids = numpy.where(mask, shapes, 0).sum(axis=1) / safe_counts
+    target_centroids = numpy.where(mask, target[numpy.newaxis], 0).sum(axis=1) / safe_counts
+
+    centered_shapes = numpy.where(mask, shapes - shape_centroids[:, numpy.newaxis], 0)
+    centered_targets = numpy.where(mask, target[numpy.newaxis] - target_centroids[:, numpy.newaxis], 0)
+
+    covariances = numpy.einsum('nfi,nfj->nij', centered_shapes, centered_targets)
+    [u, s, vt] = numpy.linalg.svd(covariances)
+
+    # Flip the least significant axis wherever the best fit would otherwise be a reflection.
+    signs = numpy.ones((len(shapes), 3))
+    signs[:, 2] = numpy.sign(numpy.linalg.det(numpy.einsum('nij,njk->nik', u, vt)))
+    signs[signs == 0] = 1
+
+    rotations = numpy.einsum('nij,nj,njk->nik', u, signs, vt)
+
+    scales = numpy.ones(len(shapes))
+    if scale:
+        sizes = (centered_shapes ** 2).sum(axis=(1, 2))
+        fittable &= (sizes > 0)
+        scales[fittable] = (s * signs).sum(axis=1)[fittable] / sizes[fittable]
+
+    linear = rotations * scales[:, numpy.newaxis, numpy.newaxis]
+
+    transforms = numpy.tile(numpy.eye(4), (len(shapes), 1, 1))
+    transforms[fittable, 0:3, 0:3] = linear[fittable]
+    transforms[fittable, 3, 0:3] = (target_centroids - numpy.einsum('ni,nij->nj', shape_centroids, linear))[fittable]
+
+    return transforms
+
+def generalized_procrustes(shapes, scale = False, iterations = PROCRUSTES_ITERATIONS, tolerance = PROCRUSTES_TOLERANCE):
+    ''' Align N x F x 3 shapes (NaN for missing fiducials) to their common mean shape.
+        The mean starts as the plain average of the shapes and is re-fit to that starting mean after every iteration, so the result stays
+        in the frame (and, when scaling, the size) the shapes came in - for PICS-normalized shapes, the PICS frame.
+        Returns [N x 4 x 4 row-vector transforms, F x 3 mean shape, number of iterations run]. '''
+
+    shapes = numpy.asarray(shapes, dtype=float)
+
+    reference = _nan_mean_shape(shapes)
+    mean = reference
+
+    for iteration in range(1, iterations + 1):
+        transforms = fit_similarity_transforms(shapes, mean, scale)
+
+        new_mean = _nan_mean_shape(apply_row_transforms(shapes, transforms))
+        anchor = fit_similarity_transforms(new_mean[numpy.newaxis], reference, scale)
+        new_mean = apply_row_transforms(new_mean[numpy.newaxis], anchor)[0]
+
+        with numpy.errstate(invalid='ignore'):
+            change = numpy.nanmax(numpy.abs(new_mean - mean)) if not numpy.isnan(new_mean).all() else 0
+
+        mean = new_mean
+        if (change < tolerance): break
+
+    return [fit_similarity_transforms(shapes, mean, scale), mean, iteration]
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Bootstrap resampling over stacked cohort arrays (see CohortArrays).  Permutation tests between two cohorts are StatMath.permutation_tests.
+#
+# Every resample is expressed as a row of a weight matrix with one column per scan, counting how many times each scan was drawn.
+# A weighted mean over all resamples at once is then a single matrix product, so thousands of resamples cost a handful of numpy calls
+# rather than thousands of FiducialStatistics recomputations.
+
+import numpy
+from multiprocessing import Pool
+
+# How many resamples should we evaluate in each vectorized chunk?  Chunks are also the unit of work handed to each process,
+# and each chunk draws from its own seed, so changing this changes the random draws (but not the number of processes).
+RESAMPLING_CHUNK_SIZE = 500
+
+def bootstrap_indices(random_state, resamples, sample_count):
+    ''' Draw a resamples x sample_count matrix of indices, each row sampled with replacement from 0..sample_count-1. '''
+    return random_state.randint(0, sample_count, (resamples, sample_count))
+
+def permutation_indices(random_state, resamples, sample_count):
+    ''' Draw a resamples x sample_count matrix of indices, each row an independent random permutation of 0..sample_count-1. '''
+    return numpy.argsort(random_state.random_sample((resamples, sample_count)), axis=1)
+
+def bootstrap_weights(random_state, resamples, sample_count):
+    ''' Draw bootstrap resamples as a resamples x sample_count matrix counting how many times each sample was drawn. '''
+
+    indices = bootstrap_indices(random_state, resamples, sample_count)
+
+    # Offset each row's indices into its own block so that one bincount tallies every row at once.
+    offsets = numpy.arange(resamples)[:, numpy.newaxis] * sample_count
+    counts = numpy.bincount((indices + offsets).ravel(), minlength=resamples * sample_count)
+
+    return counts.reshape((resamples, sample_count)).astype(float)
+
+def weighted_means(weights, values):
+    ''' Given a B x N weight matrix and an N x P array of values (NaN where missing), return the B x P weighted means,
+        ignoring missing values.  Columns with no weighted values give NaN. '''
+
+    valid = ~numpy.isnan(values)
+    filled = numpy.where(valid, values, 0)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return weights.dot(filled) / weights.dot(valid.astype(float))
+
+def _chunk_seeds(seed, resamples):
+    ''' Split "resamples" into chunks of RESAMPLING_CHUNK_SIZE, returning [chunk seed, chunk size] pairs.
+        Each chunk seeds its own RandomState from the pair (seed, chunk index), so the draws don't depend on how chunks are scheduled. '''
+
+    chunks = []
+    chunkindex = 0
+
+    while (resamples > 0):
+        chunk = min(resamples, RESAMPLING_CHUNK_SIZE)
+        chunks.append([[seed, chunkindex], chunk])
+
+        resamples -= chunk
+        chunkindex += 1
+
+    return chunks
+
+# Data shared with each worker process by _initialize_worker, so that it is sent once per process rather than once per chunk.
+_worker_values = None
+
+def _initialize_worker(values):
+    global _worker_values
+    _worker_values = values
+
+def _bootstrap_chunk(arguments):
+    ''' Evaluate one chunk of bootstrap resamples of the weighted means of _worker_values. '''
+
+    [chunk_seed, chunk] = arguments
+    random_state = numpy.random.RandomState(chunk_seed)
+
+    weights = bootstrap_weights(random_state, chunk, _worker_values.shape[0])
+
+    return weighted_means(weights, _worker_values)
+
+def _map_chunks(chunk_fn, values, tasks, processes):
+    ''' Run chunk_fn over every task, either here or across a pool of processes that have each been handed "values" once. '''
+
+    if ((processes == 1) or (len(tasks) < 2)):
+        _initialize_worker(values)
+        return [chunk_fn(task) for task in tasks]
+
+    pool = Pool(processes, _initialize_worker, (values,))
+
+    try:
+        return pool.map(chunk_fn, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def bootstrap_means(values, resamples, seed = 0, processes = 1):
+    ''' Bootstrap the mean of a stacked cohort array over its first (scan) axis, ignoring NaNs.
+        values may have any shape N x ... (e.g. N x F x 3 fiducial positions, N x F gaps, N x R widths).
+        Returns a resamples x ... array of resampled means.  processes of None means one per CPU. '''
+
+    values = numpy.asarray(values, dtype=float)
+    flat_values = values.reshape((values.shape[0], -1))
+
+    tasks = _chunk_seeds(seed, resamples)
+    results = _map_chunks(_bootstrap_chunk, flat_values, tasks, processes)
+
+    return numpy.concatenate(results).reshape((resamples,) + values.shape[1:])
+
+def bootstrap_confidence_intervals(values, resamples, confidence = 0.95, seed = 0, processes = 1):
+    ''' Percentile bootstrap confidence intervals for the mean of a stacked cohort array over its first (scan) axis.
+        Returns [lower, upper], each shaped like values.shape[1:]. '''
+
+    resampled_means = bootstrap_means(values, resamples, seed, processes)
+
+    tail = 100.0 * (1.0 - confidence) / 2.0
+
+    # Resamples with no valid values at all (NaN) are set aside by nanpercentile.
+    lower = numpy.nanpercentile(resampled_means, tail, axis=0)
+    upper = numpy.nanpercentile(resampled_means, 100.0 - tail, axis=0)
+
+    return [lower, upper]
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Resample every row of the fiducial grid to a fixed number of evenly spaced points along its length, so that scans annotated with
+# different numbers of columns all map onto the same dense grid and can be compared point for point across the whole wall,
+# rather than only at their edges, midpoints, or exactly matching A#L# names.
+#
+# Each row is treated as the polyline through its points from left to right - the same polyline VaginalProperties sums for the row's width,
+# except that a missing column is bridged rather than breaking the row in two - and points are placed at equal steps of arc length along it.
+# Rows of every scan are resampled together in a handful of array operations.
+
+from collections import OrderedDict
+import numpy
+
+# Domain specific custom imports
+from Fiducials import Fiducial
+
+# Constants
+from Options import RESAMPLED_PREFIX
+
+def get_resampled_fiducial_name(rownum, pointnum):
+    ''' Name the pointnum'th (from 1, at the left edge) resampled point of row rownum (from 1, at the apex). '''
+    return RESAMPLED_PREFIX + str(rownum) + "_" + str(pointnum)
+
+def get_row_grid(propslist):
+    ''' Stack the row grids of a list of VaginalProperties into an N x R x C x 3 array of coordinates, NaN where a scan has no such point. '''
+
+    row_count = max([len(vag_props._rows) for vag_props in propslist] + [0])
+    column_count = max([len(row) for vag_props in propslist for row in vag_props._rows] + [0])
+
+    grid = numpy.empty((len(propslist), row_count, column_count, 3))
+    grid.fill(numpy.nan)
+
+    for scanindex in range(len(propslist)):
+        rows = propslist[scanindex]._rows
+        for rowindex in range(len(rows)):
+            for colindex in range(len(rows[rowindex])):
+                # Empty places in the grid hold [] rather than a Fiducial.
+                fid = rows[rowindex][colindex]
+                if fid: grid[scanindex, rowindex, colindex] = fid.coords[0:3]
+
+    return grid
+
+def resample_rows(grid_coords, point_count):
+    ''' Resample every row of a ... x C x 3 array of row coordinates (NaN where there is no point) to point_count points evenly spaced
+        by arc length from its first point to its last, returning a ... x point_count x 3 array.  Rows of fewer than two points are NaN. '''
+
+    grid_coords = numpy.asarray(grid_coords, dtype=float)
+    leading_shape = grid_coords.shape[:-2]
+    column_count = grid_coords.shape[-2]
+
+    if (column_count == 0):
+        resampled = numpy.empty(leading_shape + (point_count, 3))
+        resampled.fill(numpy.nan)
+        return resampled
+
+    rows = grid_coords.reshape((-1, column_count, 3))
+    row_count = rows.shape[0]
+    row_indices = numpy.arange(row_count)[:, numpy.newaxis]
+
+    # Pack each row's points to the front, keeping them in order, so that consecutive entries are neighbours along the polyline.
+    present = ~numpy.isnan(rows).any(axis=2)
+    order = numpy.argsort(~present, axis=1, kind='mergesort')
+    packed = rows[row_indices, order]
+    counts = present.sum(axis=1)
+
+    steps = numpy.sqrt(((packed[:, 1:] - packed[:, :-1]) ** 2).sum(axis=2))
+    steps = numpy.where(numpy.isnan(steps), 0, steps)
+    cumulative = numpy.concatenate([numpy.zeros((row_count, 1)), numpy.cumsum(steps, axis=1)], axis=1)
+
+    lengths = cumulative[numpy.arange(row_count), numpy.maximum(counts - 1, 0)]
+    targets = numpy.linspace(0, 1, point_count)[numpy.newaxis, :] * lengths[:, numpy.newaxis]
+
+    # The segment holding each target is the last of the row's points at or before it along the row.
+    within_row = (numpy.arange(column_count)[numpy.newaxis, :] < counts[:, numpy.newaxis])
+    reached = within_row[:, numpy.newaxis, :] & (cumulative[:, numpy.newaxis, :] <= targets[:, :, numpy.newaxis])
+    segments = numpy.clip(reached.sum(axis=2) - 1, 0, numpy.maximum(counts - 2, 0)[:, numpy.newaxis])
+
+    if (column_count > 1):
+        segment_lengths = steps[row_indices, numpy.minimum(segments, column_count - 2)]
+    else:
+        segment_lengths = numpy.zeros(segments.shape)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        fractions = numpy.where(segment_lengths > 0, (targets - cumulative[row_indices, segments]) / segment_lengths, 0)
+
+    starts = packed[row_indices, segments]
+    ends = packed[row_indices, numpy.minimum(segments + 1, column_count - 1)]
+    resampled = starts + fractions[:, :, numpy.newaxis] * (ends - starts)
+
+    resampled[counts < 2] = numpy.nan
+
+    return resampled.reshape(leading_shape + (point_count, 3))
+
+def get_resampled_row_fiducials(propslist, point_count):
+    ''' Resample the rows of every scan in propslist, returning one OrderedDict per scan that maps each resampled point's name
+        (see get_resampled_fiducial_name) to a Fiducial there, with its paravaginal gaps computed against that scan.
+        Each scan keeps its resampled Fiducials until its rows change, and only scans without them are resampled (all at once). '''
+
+    stale = [vag_props for vag_props in propslist
+             if (vag_props._resampled_row_fiducials == None) or (vag_props._resampled_row_fiducials[0] != point_count)]
+
+    if (len(stale) > 0):
+        resampled = resample_rows(get_row_grid(stale), point_count)
+
+    for scanindex in range(len(stale)):
+        vag_props = stale[scanindex]
+        fid_dict = OrderedDict()
+
+        for rowindex in range(resampled.shape[1]):
+            for pointindex in range(point_count):
+                coords = resampled[scanindex, rowindex, pointindex]
+                if numpy.isnan(coords).any(): continue
+
+                fid = Fiducial(get_resampled_fiducial_name(rowindex + 1, pointindex + 1), coords[0], coords[1], coords[2])
+                vag_props._compute_fiducial_gaps(fid)
+                fid_dict[fid.name] = fid
+
+        vag_props._resampled_row_fiducials = [point_count, fid_dict]
+
+    return [vag_props._resampled_row_fiducials[1] for vag_props in propslist]
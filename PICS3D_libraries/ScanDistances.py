@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Pairwise dissimilarity between every two scans of a cohort - the root mean square distance between the fiducials they share - as the basis
+# for clustering patients by shape and looking up the patients most like a given one.
+#
+# The N x N matrix is computed in square blocks of scans: within a block, every pair's distance comes from a few matrix products over the
+# whole block at once, and for large cohorts the blocks are spread across a pool of processes.  Since the matrix is symmetric with a zero
+# diagonal, only its upper triangle is kept, as a condensed single precision array of N(N-1)/2 distances.
+
+import numpy
+from multiprocessing import Pool
+
+# How many scans should each side of a block hold?  Blocks are also the unit of work handed to each process.
+SCAN_DISTANCE_BLOCK_SIZE = 256
+
+# Bump this whenever the layout of a saved scan distance file changes.
+SCAN_DISTANCES_FORMAT_VERSION = 1
+
+# Stacked N x F x 3 fiducial coordinates of the cohort being compared, handed to each worker process once.
+_worker_coords = None
+
+def _initialize_worker(coords):
+    global _worker_coords
+    _worker_coords = coords
+
+def get_block_distances(coords1, coords2):
+    ''' Return the A x B matrix of root mean square distances between each of A x F x 3 shapes coords1 and each of B x F x 3 shapes coords2,
+        over the fiducials each pair shares (NaN where there are none). '''
+
+    present1 = ~numpy.isnan(coords1).any(axis=2)
+    present2 = ~numpy.isnan(coords2).any(axis=2)
+
+    # Zero out missing fiducials, so that they drop out of every sum below.
+    filled1 = numpy.where(present1[:, :, numpy.newaxis], coords1, 0)
+    filled2 = numpy.where(present2[:, :, numpy.newaxis], coords2, 0)
+    squares1 = (filled1 ** 2).sum(axis=2)
+    squares2 = (filled2 ** 2).sum(axis=2)
+    weights1 = present1.astype(float)
+    weights2 = present2.astype(float)
+
+    # Over the shared fiducials, |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, and each term sums over every pair at once as a matrix product.
+    shared = numpy.dot(weights1, weights2.T)
+    sum_squares = (numpy.dot(squares1, weights2.T) + numpy.dot(weights1, squares2.T)
+                   - 2 * numpy.dot(filled1.reshape((len(coords1), -1)), filled2.reshape((len(coords2), -1)).T))
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.sqrt(numpy.maximum(sum_squares, 0) / shared)
+
+def get_condensed_index(row, column, scan_count):
+    ''' Return the position of the distance between scans row and column (row < column) in a condensed distance array. '''
+    return (scan_count * row) - (row * (row + 1) // 2) + (column - row - 1)
+
+def _block_worker(arguments):
+    ''' Process pool helper - the distances between the scans of block [start1, end1) and those of block [start2, end2) of _worker_coords. '''
+
+    [start1, end1, start2, end2] = arguments
+    return get_block_distances(_worker_coords[start1:end1], _worker_coords[start2:end2])
+
+def compute_scan_distances(coords, block_size = SCAN_DISTANCE_BLOCK_SIZE, processes = 1):
+    ''' Compute the root mean square distance between every two of N x F x 3 shapes (NaN for missing fiducials), over the fiducials each pair
+        shares.  Returns a condensed float32 array of the N(N-1)/2 distances above the diagonal, row by row, as get_condensed_index numbers
+        them.  processes of None means one per CPU; 1 means compute everything here. '''
+
+    coords = numpy.asarray(coords, dtype=float)
+    scan_count = len(coords)
+
+    block_starts = range(0, scan_count, block_size)
+    tasks = [[start1, min(start1 + block_size, scan_count), start2, min(start2 + block_size, scan_count)]
+             for start1 in block_starts for start2 in block_starts if (start2 >= start1)]
+
+    if ((processes == 1) or (len(tasks) < 2)):
+        _initialize_worker(coords)
+        blocks = [_block_worker(task) for task in tasks]
+    else:
+        pool = Pool(processes, _initialize_worker, (coords,))
+        try:
+            blocks = pool.map(_block_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    condensed = numpy.empty(scan_count * (scan_count - 1) // 2, dtype=numpy.float32)
+
+    for [start1, end1, start2, end2], block in zip(tasks, blocks):
+        # Copy out each of the block's rows that lie above the diagonal.
+        for row in range(start1, end1):
+            first_column = max(start2, row + 1)
+            if (first_column >= end2): continue
+
+            position = get_condensed_index(row, first_column, scan_count)
+            condensed[position:(position + end2 - first_column)] = block[row - start1, (first_column - start2):]
+
+    return condensed
+
+def get_scan_count_from_condensed(condensed):
+    ''' Return the number of scans N whose distances a condensed array of N(N-1)/2 distances holds. '''
+
+    scan_count = int(round((1 + numpy.sqrt(1 + 8 * len(condensed))) / 2))
+    if ((scan_count * (scan_count - 1) // 2) != len(condensed)):
+        raise ValueError("Error: " + str(len(condensed)) + " is not the length of a condensed distance array.")
+
+    return scan_count
+
+def condensed_to_square(condensed):
+    ''' Expand a condensed distance array to the full symmetric N x N matrix, with zeros on the diagonal. '''
+
+    scan_count = get_scan_count_from_condensed(condensed)
+
+    square = numpy.zeros((scan_count, scan_count), dtype=condensed.dtype)
+    [rows, columns] = numpy.triu_indices(scan_count, 1)
+    square[rows, columns] = condensed
+    square[columns, rows] = condensed
+
+    return square
+
+def get_scan_distances_to(condensed, scanindex):
+    ''' Return the distances from one scan to every scan (zero to itself), read straight from a condensed distance array. '''
+
+    scan_count = get_scan_count_from_condensed(condensed)
+    others = numpy.arange(scan_count)
+
+    positions = get_condensed_index(numpy.minimum(others, scanindex), numpy.maximum(others, scanindex), scan_count)
+    distances = condensed[numpy.where(others == scanindex, 0, positions)].copy()
+    distances[scanindex] = 0
+
+    return distances
+
+def save_scan_distances(filename, scan_names, condensed):
+    ''' Save the condensed distances between the named scans to filename, to be loaded with load_scan_distances. '''
+
+    arrays = {}
+    arrays["format_version"] = numpy.array([SCAN_DISTANCES_FORMAT_VERSION])
+    arrays["scan_names"] = numpy.array(scan_names)
+    arrays["distances"] = condensed
+
+    # Write through a file object so numpy doesn't tack its own extension onto our filename.
+    with open(filename, 'wb') as outfile:
+        numpy.savez_compressed(outfile, **arrays)
+
+def load_scan_distances(filename):
+    ''' Load [scan names, condensed distances] saved by save_scan_distances. '''
+
+    arrays = numpy.load(filename)
+
+    format_version = int(arrays["format_version"][0])
+    if (format_version != SCAN_DISTANCES_FORMAT_VERSION):
+        raise ValueError("Error: " + filename + " is a saved scan distance file of format version " + str(format_version)
+                         + ", but only version " + str(SCAN_DISTANCES_FORMAT_VERSION) + " can be loaded.")
+
+    return [[str(name) for name in arrays["scan_names"]], arrays["distances"]]
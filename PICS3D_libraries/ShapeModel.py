@@ -0,0 +1,256 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# A statistical shape model of a cohort: the mean PICS-normalized fiducial positions, plus the principal modes in which the cohort's
+# shapes vary about that mean.  Each scan is then summarized by a handful of mode scores - how far along each mode its shape lies.
+#
+# Modes come from a randomized SVD, so only the leading modes are ever computed, and models can be extended with new scans as they
+# arrive without revisiting the old ones.  Scans missing some fiducials are filled in from the modes themselves rather than dropped.
+
+import numpy
+
+# Bump this whenever the layout of a saved shape model file changes.
+SHAPE_MODEL_FORMAT_VERSION = 1
+
+# How many extra random directions should the randomized SVD sample beyond the modes wanted, and how many power iterations should it
+# use to sharpen them?  More of either costs time but captures the trailing modes more accurately.
+SVD_OVERSAMPLES = 10
+SVD_POWER_ITERATIONS = 2
+
+# How many times should missing fiducials be re-estimated from the modes, and how small a change (in mm) counts as converged?
+IMPUTATION_ITERATIONS = 20
+IMPUTATION_TOLERANCE = 1e-3
+
+def randomized_svd(matrix, rank, oversamples = SVD_OVERSAMPLES, power_iterations = SVD_POWER_ITERATIONS, seed = 0):
+    ''' Return [U, S, Vt], the leading rank singular vectors and values of matrix, using a random projection onto a few more than
+        rank directions (after Halko, Martinsson and Tropp).  Falls back to a full SVD when the matrix is too small for that to pay. '''
+
+    rank = min(rank, min(matrix.shape))
+    sample_count = rank + oversamples
+
+    if (sample_count >= min(matrix.shape)):
+        [u, s, vt] = numpy.linalg.svd(matrix, full_matrices=False)
+        return [u[:, 0:rank], s[0:rank], vt[0:rank]]
+
+    random_state = numpy.random.RandomState(seed)
+    basis = numpy.dot(matrix, random_state.normal(size=(matrix.shape[1], sample_count)))
+    basis = numpy.linalg.qr(basis)[0]
+
+    # Power iterations, re-orthonormalizing each time so the small singular values are not lost to roundoff.
+    for iteration in range(power_iterations):
+        basis = numpy.linalg.qr(numpy.dot(matrix.T, basis))[0]
+        basis = numpy.linalg.qr(numpy.dot(matrix, basis))[0]
+
+    [u, s, vt] = numpy.linalg.svd(numpy.dot(basis.T, matrix), full_matrices=False)
+
+    return [numpy.dot(basis, u[:, 0:rank]), s[0:rank], vt[0:rank]]
+
+def _fix_mode_signs(modes):
+    ''' Flip each mode (row) so that its largest component is positive, so the same cohort always gives the same modes and scores. '''
+
+    signs = numpy.sign(modes[numpy.arange(modes.shape[0]), numpy.argmax(numpy.abs(modes), axis=1)])
+    signs[signs == 0] = 1
+
+    return modes * signs[:, numpy.newaxis]
+
+def _group_rows_by_missing(missing):
+    ''' Group the rows of an N x D boolean array of missing values by their pattern, returning a list of [row indices, missing mask]. '''
+
+    groups = {}
+    for rowindex in range(missing.shape[0]):
+        key = missing[rowindex].tostring()
+        if (key not in groups): groups[key] = [[], missing[rowindex]]
+        groups[key][0].append(rowindex)
+
+    return [[numpy.array(rowindices), mask] for rowindices, mask in groups.values()]
+
+class ShapeModel(object):
+    ''' The mean shape and principal modes of variation of a cohort's fiducial coordinates.
+        Shapes are handled as N x F x 3 arrays of coordinates in the order of _fid_names, with NaN for missing fiducials. '''
+
+    _fid_names = None # List of F fiducial names modelled
+    _mean = None # 3F array of mean coordinates, flattened fiducial by fiducial
+    _modes = None # K x 3F array of orthonormal modes of variation, most significant first
+    _singular_values = None # K singular values of the centered cohort, one per mode
+    _total_sum_squares = None # Sum of squared deviations from the mean over every scan and coordinate, for the fraction of variance explained
+    _scan_count = None # Number of scans the model was built from
+
+    def __init__(self, fid_names, mean, modes, singular_values, total_sum_squares, scan_count):
+        self._fid_names = list(fid_names)
+        self._mean = mean
+        self._modes = modes
+        self._singular_values = singular_values
+        self._total_sum_squares = total_sum_squares
+        self._scan_count = scan_count
+
+    def get_mode_count(self):
+        return self._modes.shape[0]
+
+    def get_mode_variances(self):
+        ''' Return the variance of the cohort's scores along each mode. '''
+        return (self._singular_values ** 2) / self._scan_count
+
+    def get_explained_variance_ratios(self):
+        ''' Return the fraction of the cohort's total shape variance that each mode accounts for. '''
+        if (self._total_sum_squares == 0): return numpy.zeros(self.get_mode_count())
+        return (self._singular_values ** 2) / self._total_sum_squares
+
+    def _flatten(self, coords):
+        coords = numpy.asarray(coords, dtype=float)
+        if (coords.shape[1:] != (len(self._fid_names), 3)):
+            raise ValueError("Error: Expected shapes of " + str(len(self._fid_names)) + " fiducials, but got " + str(coords.shape[1]))
+        return coords.reshape((coords.shape[0], 3 * len(self._fid_names)))
+
+    def _project_flat(self, flat):
+        ''' Return N x K scores for an N x 3F array of shapes, fitting each shape's scores to only the coordinates it has. '''
+
+        scores = numpy.empty((flat.shape[0], self.get_mode_count()))
+        scores.fill(numpy.nan)
+
+        centered = flat - self._mean
+
+        for rowindices, mask in _group_rows_by_missing(numpy.isnan(flat)):
+            observed = ~mask
+
+            if observed.all():
+                # The modes are orthonormal, so a complete shape's scores are just its dot products with them.
+                scores[rowindices] = numpy.dot(centered[rowindices], self._modes.T)
+            elif (observed.sum() >= self.get_mode_count()):
+                # Otherwise find the scores whose reconstruction best matches the coordinates we do have.
+                scores[rowindices] = numpy.linalg.lstsq(self._modes[:, observed].T, centered[rowindices][:, observed].T)[0].T
+
+        return scores
+
+    def project(self, coords):
+        ''' Return an N x K array of mode scores for an N x F x 3 array of shapes in _fid_names order.
+            Missing fiducials are ignored, and shapes with fewer coordinates than there are modes get NaN scores. '''
+        return self._project_flat(self._flatten(coords))
+
+    def reconstruct(self, scores):
+        ''' Return the N x F x 3 array of shapes given by an N x K array of mode scores. '''
+        flat = self._mean + numpy.dot(numpy.asarray(scores, dtype=float), self._modes)
+        return flat.reshape((flat.shape[0], len(self._fid_names), 3))
+
+    def fill_missing(self, coords):
+        ''' Return a copy of an N x F x 3 array of shapes with each missing fiducial estimated from the rest of its shape. '''
+
+        flat = self._flatten(coords)
+        missing = numpy.isnan(flat)
+
+        scores = self._project_flat(flat)
+        scores[numpy.isnan(scores)] = 0
+
+        filled = flat.copy()
+        estimate = self._mean + numpy.dot(scores, self._modes)
+        filled[missing] = estimate[missing]
+
+        return filled.reshape(numpy.shape(coords))
+
+    def add_scans(self, coords):
+        ''' Update the model in place with an N x F x 3 array of new shapes, without revisiting the scans it was built from.
+            The modes are merged as in incremental PCA (after Ross et al.), so the model keeps its number of modes. '''
+
+        new_count = len(coords)
+        if (new_count == 0): return
+
+        flat = self._flatten(self.fill_missing(coords))
+
+        old_count = self._scan_count
+        total_count = old_count + new_count
+
+        batch_mean = flat.mean(axis=0)
+        batch_centered = flat - batch_mean
+        mean_shift = self._mean - batch_mean
+
+        # The old scans, as seen through the modes, plus the new scans, plus the correction for the two groups' different means.
+        stacked = numpy.vstack([self._singular_values[:, numpy.newaxis] * self._modes,
+                                batch_centered,
+                                numpy.sqrt(float(old_count * new_count) / total_count) * mean_shift])
+
+        [u, s, vt] = numpy.linalg.svd(stacked, full_matrices=False)
+
+        mode_count = self.get_mode_count()
+        self._modes = _fix_mode_signs(vt[0:mode_count])
+        self._singular_values = s[0:mode_count]
+
+        self._total_sum_squares += (batch_centered ** 2).sum() + (float(old_count * new_count) / total_count) * (mean_shift ** 2).sum()
+        self._mean = (old_count * self._mean + new_count * batch_mean) / total_count
+        self._scan_count = total_count
+
+def build_shape_model(coords, fid_names, mode_count, seed = 0, iterations = IMPUTATION_ITERATIONS, tolerance = IMPUTATION_TOLERANCE):
+    ''' Build a ShapeModel of mode_count modes from an N x F x 3 array of aligned (e.g. PICS-normalized) shapes in fid_names order.
+        Fiducials no scan has are dropped, as are scans with no fiducials.  Other missing fiducials start at the cohort mean and are
+        then repeatedly re-estimated from the modes fit to everything else, until the estimates settle. '''
+
+    coords = numpy.asarray(coords, dtype=float)
+
+    present_fids = ~numpy.isnan(coords).all(axis=(0, 2))
+    present_scans = ~numpy.isnan(coords).all(axis=(1, 2))
+
+    fid_names = [fid_names[fidindex] for fidindex in numpy.flatnonzero(present_fids)]
+    flat = coords[present_scans][:, present_fids].reshape((present_scans.sum(), -1))
+
+    if (flat.shape[0] < 2):
+        raise ValueError("Error: Need at least two scans to build a shape model.")
+
+    missing = numpy.isnan(flat)
+
+    with numpy.errstate(invalid='ignore'):
+        filled = numpy.where(missing, numpy.nanmean(flat, axis=0), flat)
+
+    for iteration in range(iterations):
+        mean = filled.mean(axis=0)
+        [u, s, vt] = randomized_svd(filled - mean, mode_count, seed = seed)
+
+        if not missing.any(): break
+
+        estimate = mean + numpy.dot(u * s, vt)
+        change = numpy.abs(estimate[missing] - filled[missing]).max()
+        filled[missing] = estimate[missing]
+
+        if (change < tolerance): break
+
+    mean = filled.mean(axis=0)
+    [u, s, vt] = randomized_svd(filled - mean, mode_count, seed = seed)
+
+    return ShapeModel(fid_names, mean, _fix_mode_signs(vt), s, ((filled - mean) ** 2).sum(), flat.shape[0])
+
+def build_shape_model_from_cohort(cohort, mode_count, seed = 0):
+    ''' Build a ShapeModel from the fiducial coordinates of a CohortArrays. '''
+    return build_shape_model(cohort._coords, cohort._fid_names, mode_count, seed)
+
+def project_cohort(model, cohort):
+    ''' Return an N x K array of mode scores for every scan of a CohortArrays, ignoring any fiducials the model doesn't have. '''
+    return model.project(cohort.align_to(model._fid_names, cohort._coords))
+
+def add_cohort_to_shape_model(model, cohort):
+    ''' Update a ShapeModel in place with every scan of a CohortArrays, ignoring any fiducials the model doesn't have. '''
+    model.add_scans(cohort.align_to(model._fid_names, cohort._coords))
+
+def save_shape_model(filename, model):
+    ''' Save a ShapeModel to filename, to be loaded with load_shape_model. '''
+
+    arrays = {}
+    arrays["format_version"] = numpy.array([SHAPE_MODEL_FORMAT_VERSION])
+    arrays["fid_names"] = numpy.array(model._fid_names)
+    arrays["mean"] = model._mean
+    arrays["modes"] = model._modes
+    arrays["singular_values"] = model._singular_values
+    arrays["total_sum_squares"] = numpy.array([model._total_sum_squares])
+    arrays["scan_count"] = numpy.array([model._scan_count])
+
+    # Write through a file object so numpy doesn't tack its own extension onto our filename.
+    with open(filename, 'wb') as outfile:
+        numpy.savez_compressed(outfile, **arrays)
+
+def load_shape_model(filename):
+    ''' Load a ShapeModel saved by save_shape_model. '''
+
+    arrays = numpy.load(filename)
+
+    format_version = int(arrays["format_version"][0])
+    if (format_version != SHAPE_MODEL_FORMAT_VERSION):
+        raise ValueError("Error: " + filename + " is a saved shape model of format version " + str(format_version)
+                         + ", but only version " + str(SHAPE_MODEL_FORMAT_VERSION) + " can be loaded.")
+
+    return ShapeModel([str(name) for name in arrays["fid_names"]], arrays["mean"], arrays["modes"], arrays["singular_values"],
+                      float(arrays["total_sum_squares"][0]), int(arrays["scan_count"][0]))
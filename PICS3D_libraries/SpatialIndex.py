@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# A k-d tree over a set of points (fiducial coordinates, or any other fixed-length vectors), for finding each query point's nearest
+# neighbours, or every point inside a box, ball or half-space, without measuring every point, and the correspondences built on it:
+# matching every point of one scan to the nearest point of another, optionally only within the same row.
+#
+# The tree is balanced and stored as flat arrays, node i having children 2i+1 and 2i+2 and every leaf at the same depth.  Queries are
+# answered in bulk: every query point first takes the points of the leaf it falls in as its best guess, then all of them descend the
+# tree together, level by level, each keeping only the nodes that could still hold a point nearer than that guess.
+
+import numpy
+
+# At most how many points should each leaf of a KDTree hold?  Smaller leaves prune more, but take more levels to reach.
+KDTREE_LEAF_SIZE = 8
+
+def _merge_neighbours(best_distances, best_indices, query_numbers, distances, indices):
+    ''' Merge candidate neighbours - row i of distances and indices belonging to query query_numbers[i] - into the M x k nearest neighbours
+        found so far, returning the new [M x k distances, M x k indices], nearest first. '''
+
+    [query_count, k] = best_distances.shape
+
+    all_queries = numpy.concatenate([numpy.repeat(numpy.arange(query_count), k), numpy.repeat(query_numbers, distances.shape[1])])
+    all_distances = numpy.concatenate([best_distances.ravel(), distances.ravel()])
+    all_indices = numpy.concatenate([best_indices.ravel(), indices.ravel()])
+
+    # Sort by query, then by distance, and keep the first k of each query's run - every query has at least its k previous best.
+    order = numpy.lexsort((all_distances, all_queries))
+    sorted_queries = all_queries[order]
+    ranks = numpy.arange(len(order)) - numpy.searchsorted(sorted_queries, numpy.arange(query_count))[sorted_queries]
+    keep = order[ranks < k]
+
+    return [all_distances[keep].reshape((query_count, k)), all_indices[keep].reshape((query_count, k))]
+
+def _box_distances(points, mins, maxs):
+    ''' Return the distance from each point to the corresponding box with lower corner mins and upper corner maxs (inf for an empty box). '''
+
+    outside = numpy.maximum(numpy.maximum(mins - points, points - maxs), 0)
+    return numpy.sqrt((outside ** 2).sum(axis=1))
+
+class KDTree(object):
+    ''' A balanced k-d tree over an N x D array of points. '''
+
+    _points = None # N x D array of the points indexed
+    _depth = None # Number of levels of splits; the tree has 2**_depth leaves
+    _split_axes = None # Axis each internal node splits on, by node number
+    _split_values = None # Value each internal node splits at; points at or above it are in its right child
+    _node_mins = None # Nodes x D lower corners of the box bounding each node's points (inf for an empty node)
+    _node_maxs = None # Nodes x D upper corners of the box bounding each node's points (-inf for an empty node)
+    _leaf_points = None # Leaves x L array of the indices of the points in each leaf, -1 for unused places
+
+    def __init__(self, points, leaf_size = KDTREE_LEAF_SIZE):
+        points = numpy.asarray(points, dtype=float)
+
+        if (points.ndim != 2):
+            raise ValueError("Error: A KDTree needs an N x D array of points, but got an array of shape " + str(points.shape))
+        if numpy.isnan(points).any():
+            raise ValueError("Error: Cannot index points with missing (NaN) coordinates.")
+
+        self._points = points
+        [point_count, dimensions] = points.shape
+
+        self._depth = 0
+        while (point_count > (leaf_size * (2 ** self._depth))): self._depth += 1
+
+        internal_count = (2 ** self._depth) - 1
+        node_count = (2 * internal_count) + 1
+
+        self._split_axes = numpy.zeros(internal_count, dtype=int)
+        self._split_values = numpy.zeros(internal_count)
+        self._node_mins = numpy.empty((node_count, dimensions))
+        self._node_mins.fill(numpy.inf)
+        self._node_maxs = numpy.empty((node_count, dimensions))
+        self._node_maxs.fill(-numpy.inf)
+
+        # Each node holds a contiguous run of order; splitting a node partitions its run about the middle.
+        order = numpy.arange(point_count)
+        starts = numpy.zeros(node_count, dtype=int)
+        ends = numpy.zeros(node_count, dtype=int)
+        ends[0] = point_count
+
+        for node in range(node_count):
+            members = order[starts[node]:ends[node]]
+
+            if (len(members) > 0):
+                self._node_mins[node] = points[members].min(axis=0)
+                self._node_maxs[node] = points[members].max(axis=0)
+
+            if (node >= internal_count): continue
+
+            middle = (starts[node] + ends[node]) // 2
+            [starts[2 * node + 1], ends[2 * node + 1]] = [starts[node], middle]
+            [starts[2 * node + 2], ends[2 * node + 2]] = [middle, ends[node]]
+
+            if (len(members) > 0):
+                # Split along the node's longest side.
+                axis = numpy.argmax(self._node_maxs[node] - self._node_mins[node])
+                order[starts[node]:ends[node]] = members[numpy.argpartition(points[members, axis], middle - starts[node])]
+
+                self._split_axes[node] = axis
+                self._split_values[node] = points[order[middle], axis]
+
+        leaf_starts = starts[internal_count:]
+        leaf_ends = ends[internal_count:]
+        leaf_width = max([1] + (leaf_ends - leaf_starts).tolist())
+
+        self._leaf_points = -numpy.ones((len(leaf_starts), leaf_width), dtype=int)
+        for leaf in range(len(leaf_starts)):
+            self._leaf_points[leaf, 0:(leaf_ends[leaf] - leaf_starts[leaf])] = order[leaf_starts[leaf]:leaf_ends[leaf]]
+
+    def get_point_count(self):
+        return len(self._points)
+
+    def _leaf_distances(self, queries, leaves):
+        ''' Return [distances, indices] from each query point to every point of the corresponding leaf (inf for unused places). '''
+
+        indices = self._leaf_points[leaves]
+        offsets = self._points[indices] - queries[:, numpy.newaxis]
+        distances = numpy.sqrt((offsets ** 2).sum(axis=2))
+        distances[indices < 0] = numpy.inf
+
+        return [distances, indices]
+
+    def query(self, queries, k = 1):
+        ''' Find the k points nearest each of an M x D array of query points.  Returns [M x k distances, M x k point indices], nearest
+            first, with distance inf and index -1 wherever the tree holds fewer than k points. '''
+
+        queries = numpy.asarray(queries, dtype=float).reshape((-1, self._points.shape[1]))
+        query_count = len(queries)
+        internal_count = len(self._split_axes)
+
+        best_distances = numpy.empty((query_count, k))
+        best_distances.fill(numpy.inf)
+        best_indices = -numpy.ones((query_count, k), dtype=int)
+
+        if (self.get_point_count() == 0): return [best_distances, best_indices]
+
+        # Descend each query point to the leaf it falls in, and take the nearest points there as a first guess.
+        home_nodes = numpy.zeros(query_count, dtype=int)
+        for level in range(self._depth):
+            go_right = (queries[numpy.arange(query_count), self._split_axes[home_nodes]] >= self._split_values[home_nodes])
+            home_nodes = (2 * home_nodes) + 1 + go_right
+
+        [distances, indices] = self._leaf_distances(queries, home_nodes - internal_count)
+        [best_distances, best_indices] = _merge_neighbours(best_distances, best_indices, numpy.arange(query_count), distances, indices)
+
+        # Then descend again from the root, dropping every node that can hold nothing nearer than the kth nearest point of that guess.
+        pair_queries = numpy.arange(query_count)
+        pair_nodes = numpy.zeros(query_count, dtype=int)
+
+        for level in range(self._depth + 1):
+            keep = (_box_distances(queries[pair_queries], self._node_mins[pair_nodes], self._node_maxs[pair_nodes])
+                    < best_distances[pair_queries, k - 1])
+            if (level == self._depth): keep &= (pair_nodes != home_nodes[pair_queries])
+
+            pair_queries = pair_queries[keep]
+            pair_nodes = pair_nodes[keep]
+
+            if (level < self._depth):
+                pair_queries = numpy.repeat(pair_queries, 2)
+                pair_nodes = ((2 * numpy.repeat(pair_nodes, 2)) + 1 + numpy.tile([0, 1], len(pair_nodes)))
+
+        [distances, indices] = self._leaf_distances(queries[pair_queries], pair_nodes - internal_count)
+
+        return _merge_neighbours(best_distances, best_indices, pair_queries, distances, indices)
+
+    def _search(self, may_contain, contains):
+        ''' Return the sorted indices of every point for which contains(points) is True, visiting only the nodes for which
+            may_contain(node_mins, node_maxs) is True - a test that must hold for any node holding such a point. '''
+
+        nodes = numpy.zeros(1, dtype=int)
+
+        for level in range(self._depth + 1):
+            nodes = nodes[may_contain(self._node_mins[nodes], self._node_maxs[nodes])]
+            if (level < self._depth): nodes = ((2 * nodes[:, numpy.newaxis]) + numpy.array([1, 2])).ravel()
+
+        candidates = self._leaf_points[nodes - len(self._split_axes)].ravel()
+        candidates = candidates[candidates >= 0]
+
+        return numpy.sort(candidates[contains(self._points[candidates])])
+
+    def query_box(self, lower, upper):
+        ''' Return the indices of every point inside the box with corners lower and upper, inclusive. '''
+
+        lower = numpy.asarray(lower, dtype=float)
+        upper = numpy.asarray(upper, dtype=float)
+
+        return self._search(lambda mins, maxs: ((maxs >= lower) & (mins <= upper)).all(axis=1),
+                            lambda points: ((points >= lower) & (points <= upper)).all(axis=1))
+
+    def query_radius(self, center, radius):
+        ''' Return the indices of every point no further than radius from center. '''
+
+        center = numpy.asarray(center, dtype=float)
+
+        return self._search(lambda mins, maxs: (_box_distances(center, mins, maxs) <= radius),
+                            lambda points: (((points - center) ** 2).sum(axis=1) <= (radius ** 2)))
+
+    def query_half_space(self, normal, offset):
+        ''' Return the indices of every point at least offset along normal, i.e. with dot(point, normal) >= offset. '''
+
+        normal = numpy.asarray(normal, dtype=float)
+
+        # The furthest along normal any point of a box can lie is at whichever corner each component of normal points toward.
+        def may_contain(mins, maxs):
+            with numpy.errstate(invalid='ignore'):
+                furthest = numpy.where(normal > 0, maxs * normal, numpy.where(normal < 0, mins * normal, 0)).sum(axis=1)
+            return (furthest >= offset)
+
+        return self._search(may_contain, lambda points: (numpy.dot(points, normal) >= offset))
+
+def query_by_group(points, point_groups, queries, query_groups, k = 1):
+    ''' As KDTree.query, but matching each query point only to points of the same group (e.g. the same row), with one tree per group.
+        Returns [M x k distances, M x k indices into points]. '''
+
+    points = numpy.asarray(points, dtype=float)
+    queries = numpy.asarray(queries, dtype=float)
+    point_groups = numpy.asarray(point_groups)
+    query_groups = numpy.asarray(query_groups)
+
+    distances = numpy.empty((len(queries), k))
+    distances.fill(numpy.inf)
+    indices = -numpy.ones((len(queries), k), dtype=int)
+
+    for group in numpy.unique(query_groups):
+        members = numpy.flatnonzero(point_groups == group)
+        if (len(members) == 0): continue
+
+        askers = numpy.flatnonzero(query_groups == group)
+        [group_distances, group_indices] = KDTree(points[members]).query(queries[askers], k)
+
+        distances[askers] = group_distances
+        indices[askers] = numpy.where(group_indices >= 0, members[group_indices], -1)
+
+    return [distances, indices]
+
+def match_nearest_points(from_points, to_points, from_groups = None, to_groups = None):
+    ''' Match each of an M x D array of from_points to the nearest of to_points - of the same group, if groups are given.
+        Returns [M indices into to_points (-1 where there is none), M x D difference vectors from each point to its match, M distances]. '''
+
+    from_points = numpy.asarray(from_points, dtype=float)
+    to_points = numpy.asarray(to_points, dtype=float)
+
+    if (from_groups is None):
+        [distances, indices] = KDTree(to_points).query(from_points)
+    else:
+        [distances, indices] = query_by_group(to_points, to_groups, from_points, from_groups)
+
+    indices = indices[:, 0]
+    matched = (indices >= 0)
+
+    differences = numpy.empty(from_points.shape)
+    differences.fill(numpy.nan)
+    differences[matched] = to_points[indices[matched]] - from_points[matched]
+
+    return [indices, differences, numpy.where(indices >= 0, distances[:, 0], numpy.nan)]
+
+def get_match_statistics(points1, points2, groups1 = None, groups2 = None):
+    ''' Summarize how far apart two point sets lie.  Returns [mean, max, Hausdorff distance], where the mean and max are of the distances from
+        each of points2 to the nearest of points1, and the Hausdorff distance is the larger of that max and the max the other way round.
+        Points with no match (no point of their group in the other set) are left out. '''
+
+    distances2 = match_nearest_points(points2, points1, groups2, groups1)[2]
+    distances1 = match_nearest_points(points1, points2, groups1, groups2)[2]
+
+    distances2 = distances2[~numpy.isnan(distances2)]
+    distances1 = distances1[~numpy.isnan(distances1)]
+
+    if (len(distances2) == 0): return [numpy.nan, numpy.nan, numpy.nan]
+
+    return [distances2.mean(), distances2.max(), max([distances2.max()] + distances1.tolist())]
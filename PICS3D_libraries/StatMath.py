@@ -0,0 +1,441 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Collection of vectorized statistics scripts for comparing individual scans and cohorts.
+# Every function here works column-wise on 2D arrays (one row per scan, one column per measurement), with NaN marking missing values.
+
+import math
+import numpy
+from multiprocessing import Pool
+
+# Custom imports
+from Resampling import permutation_indices
+
+# Convergence controls for the incomplete beta function behind our t-test p-values
+INCOMPLETE_BETA_MAX_ITERATIONS = 300
+INCOMPLETE_BETA_TOLERANCE = 1e-14
+
+# How many permutations should we generate at once?  Bigger is faster, but needs chunk x sample count index memory.
+PERMUTATION_CHUNK_SIZE = 2000
+
+def column_means_and_std_devs(values):
+    ''' Given an N x K array of values, return [means, std_devs, counts], each of length K, ignoring NaNs.
+        Standard deviations are population (ddof = 0) values, to match the numpy std used in ComputeStatistics.
+        Columns with no valid values get NaN for mean and std dev. '''
+
+    valid = ~numpy.isnan(values)
+    counts = valid.sum(axis=0)
+
+    filled = numpy.where(valid, values, 0)
+    sums = filled.sum(axis=0)
+    sums_of_squares = (filled * filled).sum(axis=0)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        variances = (sums_of_squares / counts) - (means * means)
+
+    # Guard against tiny negative variances caused by floating point roundoff
+    variances = numpy.where(variances < 0, 0, variances)
+
+    return [means, numpy.sqrt(variances), counts]
+
+def z_scores(values, means, std_devs):
+    ''' Given an M x K array of values and K-length means and std_devs (or M x K ones, one per value), return the M x K array of z-scores.
+        A zero or missing std dev produces NaN rather than infinity. '''
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        scores = (values - means) / std_devs
+
+    return numpy.where(std_devs > 0, scores, numpy.nan)
+
+def leave_one_out_means_and_std_devs(values):
+    ''' Given an N x K array of values, return [means, std_devs, counts], each N x K, of each column leaving out each row in turn -
+        i.e. the statistics of the other rows, against which that row's value can be scored.  NaNs are ignored, as in
+        column_means_and_std_devs.  The column sums are taken once, and each row's own contribution subtracted from them, so this costs
+        no more than the full-column statistics. '''
+
+    valid = ~numpy.isnan(values)
+
+    # Sum relative to each column's mean, which keeps the sums small and the subtracted variances accurate.
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        shifts = numpy.where(valid, values, 0).sum(axis=0) / valid.sum(axis=0)
+    shifts = numpy.where(numpy.isnan(shifts), 0, shifts)
+
+    offsets = numpy.where(valid, values - shifts, 0)
+
+    counts = valid.sum(axis=0) - valid
+    sums = offsets.sum(axis=0) - offsets
+    sums_of_squares = (offsets * offsets).sum(axis=0) - (offsets * offsets)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean_offsets = sums / counts
+        variances = (sums_of_squares / counts) - (mean_offsets * mean_offsets)
+
+    # Guard against tiny negative variances caused by floating point roundoff
+    variances = numpy.where(variances < 0, 0, variances)
+
+    return [shifts + mean_offsets, numpy.sqrt(variances), counts]
+
+def percentile_ranks(values, reference):
+    ''' Given an M x K array of values and an N x K array of reference values, return the M x K array of percentile ranks (0..100)
+        of each value within the valid (non-NaN) reference values of its column.  Ties count as half below and half above. '''
+
+    ranks = numpy.empty(values.shape)
+    ranks.fill(numpy.nan)
+
+    # NaNs sort to the end of each column, so the first "counts" entries of each sorted column are the valid references.
+    sorted_reference = numpy.sort(reference, axis=0)
+    counts = (~numpy.isnan(reference)).sum(axis=0)
+
+    for colindex in range(values.shape[1]):
+        count = counts[colindex]
+        if (count == 0): continue
+
+        column = sorted_reference[0:count, colindex]
+        below = numpy.searchsorted(column, values[:, colindex], side='left')
+        at_or_below = numpy.searchsorted(column, values[:, colindex], side='right')
+
+        ranks[:, colindex] = 100.0 * (below + at_or_below) / (2.0 * count)
+
+    ranks[numpy.isnan(values)] = numpy.nan
+
+    return ranks
+
+def leave_one_out_percentile_ranks(values):
+    ''' Given an N x K array of values, return the N x K array of percentile ranks (0..100) of each value within the other valid values of
+        its column, as percentile_ranks would give against the column with that value left out.  Each column is sorted once. '''
+
+    ranks = numpy.empty(values.shape)
+    ranks.fill(numpy.nan)
+
+    sorted_values = numpy.sort(values, axis=0)
+    counts = (~numpy.isnan(values)).sum(axis=0)
+
+    for colindex in range(values.shape[1]):
+        count = counts[colindex]
+        if (count < 2): continue
+
+        column = sorted_values[0:count, colindex]
+        below = numpy.searchsorted(column, values[:, colindex], side='left')
+
+        # Every value is at or below itself, so take it back out.
+        at_or_below = numpy.searchsorted(column, values[:, colindex], side='right') - 1
+
+        ranks[:, colindex] = 100.0 * (below + at_or_below) / (2.0 * (count - 1))
+
+    ranks[numpy.isnan(values)] = numpy.nan
+
+    return ranks
+
+def column_means_and_sample_variances(values):
+    ''' Given an N x K array of values, return [means, variances, counts], each of length K, ignoring NaNs.
+        Variances are sample (ddof = 1) values, as used by the two-sample tests below. '''
+
+    [means, std_devs, counts] = column_means_and_std_devs(values)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        variances = std_devs * std_devs * counts / (counts - 1.0)
+
+    return [means, variances, counts]
+
+def _log_gamma(values):
+    ''' Elementwise natural log of the gamma function, since numpy doesn't provide one. '''
+    return numpy.frompyfunc(math.lgamma, 1, 1)(values).astype(float)
+
+def _incomplete_beta_continued_fraction(a, b, x):
+    ''' Evaluate the continued fraction for the regularized incomplete beta function by the modified Lentz method, elementwise over arrays.
+        Converges quickly for x < (a + 1) / (a + b + 2). '''
+
+    TINY = 1e-300
+
+    def not_tiny(values):
+        return numpy.where(numpy.abs(values) < TINY, TINY, values)
+
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+
+    c = numpy.ones(x.shape)
+    d = 1.0 / not_tiny(1.0 - qab * x / qap)
+    result = d.copy()
+
+    for m in range(1, INCOMPLETE_BETA_MAX_ITERATIONS + 1):
+        m2 = 2 * m
+
+        # Even step of the recurrence
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 / not_tiny(1.0 + aa * d)
+        c = not_tiny(1.0 + aa / c)
+        result *= d * c
+
+        # Odd step of the recurrence
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 / not_tiny(1.0 + aa * d)
+        c = not_tiny(1.0 + aa / c)
+        delta = d * c
+        result *= delta
+
+        if numpy.all(numpy.abs(delta - 1.0) < INCOMPLETE_BETA_TOLERANCE): break
+
+    return result
+
+def regularized_incomplete_beta(a, b, x):
+    ''' Elementwise regularized incomplete beta function I_x(a, b), for arrays of a > 0, b > 0 and 0 <= x <= 1.
+        Anything outside that domain (including NaN) gives NaN. '''
+
+    a, b, x = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float), numpy.asarray(x, dtype=float))
+
+    result = numpy.empty(x.shape)
+    result.fill(numpy.nan)
+
+    with numpy.errstate(invalid='ignore'):
+        valid = (a > 0) & (b > 0) & (x >= 0) & (x <= 1)
+
+    if not numpy.any(valid): return result
+
+    a = a[valid]
+    b = b[valid]
+    x = x[valid]
+
+    with numpy.errstate(divide='ignore'):
+        log_front = (_log_gamma(a + b) - _log_gamma(a) - _log_gamma(b)
+                     + a * numpy.log(x) + b * numpy.log(1.0 - x))
+    front = numpy.exp(log_front)
+
+    # Use the continued fraction directly where it converges quickly, and the symmetry relation I_x(a,b) = 1 - I_(1-x)(b,a) elsewhere.
+    direct = x < ((a + 1.0) / (a + b + 2.0))
+    values = numpy.empty(x.shape)
+
+    values[direct] = front[direct] * _incomplete_beta_continued_fraction(a[direct], b[direct], x[direct]) / a[direct]
+
+    flipped = ~direct
+    values[flipped] = 1.0 - (front[flipped] * _incomplete_beta_continued_fraction(b[flipped], a[flipped], 1.0 - x[flipped]) / b[flipped])
+
+    result[valid] = values
+
+    return result
+
+def student_t_two_sided_p_values(t, degrees_of_freedom):
+    ''' Elementwise two-sided p-values for Student t statistics with the given (possibly fractional) degrees of freedom. '''
+
+    t = numpy.asarray(t, dtype=float)
+    degrees_of_freedom = numpy.asarray(degrees_of_freedom, dtype=float)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        x = degrees_of_freedom / (degrees_of_freedom + t * t)
+
+    return regularized_incomplete_beta(degrees_of_freedom / 2.0, 0.5, x)
+
+def welch_t_tests(values1, values2):
+    ''' Welch's unequal variance t test between the matching columns of two N1 x K and N2 x K arrays, ignoring NaNs.
+        Returns [t, degrees_of_freedom, p_values], each of length K.  Columns with fewer than two values on either side give NaN. '''
+
+    [means1, variances1, counts1] = column_means_and_sample_variances(values1)
+    [means2, variances2, counts2] = column_means_and_sample_variances(values2)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        squared_error1 = variances1 / counts1
+        squared_error2 = variances2 / counts2
+
+        t = (means1 - means2) / numpy.sqrt(squared_error1 + squared_error2)
+
+        degrees_of_freedom = ((squared_error1 + squared_error2) ** 2
+                              / ((squared_error1 ** 2) / (counts1 - 1.0) + (squared_error2 ** 2) / (counts2 - 1.0)))
+
+    return [t, degrees_of_freedom, student_t_two_sided_p_values(t, degrees_of_freedom)]
+
+def hedges_g_effect_sizes(values1, values2):
+    ''' Standardized difference in means (Hedges' g, Cohen's d with a small-sample bias correction) between matching columns, ignoring NaNs. '''
+
+    [means1, variances1, counts1] = column_means_and_sample_variances(values1)
+    [means2, variances2, counts2] = column_means_and_sample_variances(values2)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        pooled_std_dev = numpy.sqrt(((counts1 - 1) * variances1 + (counts2 - 1) * variances2) / (counts1 + counts2 - 2.0))
+        cohens_d = (means1 - means2) / pooled_std_dev
+
+        correction = 1.0 - 3.0 / (4.0 * (counts1 + counts2) - 9.0)
+
+    return cohens_d * correction
+
+def tied_ranks(values):
+    ''' Rank a 1D array of values from 1..n, giving tied values the average of the ranks they span. '''
+
+    [unique_values, inverse, counts] = numpy.unique(values, return_inverse=True, return_counts=True)
+
+    # The last rank each unique value spans, less half the extra ranks it covers.
+    average_ranks = numpy.cumsum(counts) - (counts - 1) / 2.0
+
+    return average_ranks[inverse]
+
+def mann_whitney_u_tests(values1, values2):
+    ''' Mann-Whitney U test between the matching columns of two N1 x K and N2 x K arrays, ignoring NaNs.
+        Returns [u, p_values], where u is the U statistic for the first array and p_values are two-sided,
+        from the normal approximation with tie and continuity corrections. '''
+
+    column_count = values1.shape[1]
+
+    u = numpy.empty(column_count)
+    p_values = numpy.empty(column_count)
+    u.fill(numpy.nan)
+    p_values.fill(numpy.nan)
+
+    for colindex in range(column_count):
+        column1 = values1[:, colindex]
+        column2 = values2[:, colindex]
+        column1 = column1[~numpy.isnan(column1)]
+        column2 = column2[~numpy.isnan(column2)]
+
+        count1 = len(column1)
+        count2 = len(column2)
+        if ((count1 == 0) or (count2 == 0)): continue
+
+        total = count1 + count2
+        ranks = tied_ranks(numpy.concatenate((column1, column2)))
+
+        u[colindex] = ranks[0:count1].sum() - count1 * (count1 + 1) / 2.0
+
+        # Variance of U, reduced for every group of tied values
+        [unique_values, tie_counts] = numpy.unique(numpy.concatenate((column1, column2)), return_counts=True)
+        tie_term = ((tie_counts ** 3) - tie_counts).sum() / float(total * (total - 1)) if (total > 1) else 0
+
+        u_variance = (count1 * count2 / 12.0) * ((total + 1) - tie_term)
+        if (u_variance <= 0): continue
+
+        u_mean = count1 * count2 / 2.0
+        z = (abs(u[colindex] - u_mean) - 0.5) / math.sqrt(u_variance)
+
+        p_values[colindex] = min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+    return [u, p_values]
+
+def _count_permutation_exceedances(pooled, count1, observed_difference, resamples, seed):
+    ''' Shuffle pooled into groups of count1 and the remainder "resamples" times, vectorized in chunks, and count how many
+        shufflings give an absolute difference in group means at least as large as observed_difference. '''
+
+    random_state = numpy.random.RandomState(seed)
+
+    count2 = len(pooled) - count1
+    total = pooled.sum()
+
+    # Allow for floating point roundoff when comparing shuffled differences against the observed one.
+    threshold = abs(observed_difference) - 1e-12 * max(1.0, abs(observed_difference))
+
+    exceedances = 0
+    remaining = resamples
+
+    while (remaining > 0):
+        chunk = min(remaining, PERMUTATION_CHUNK_SIZE)
+        remaining -= chunk
+
+        permutations = permutation_indices(random_state, chunk, len(pooled))
+        sums1 = pooled[permutations[:, 0:count1]].sum(axis=1)
+
+        differences = (sums1 / count1) - ((total - sums1) / count2)
+        exceedances += numpy.count_nonzero(numpy.abs(differences) >= threshold)
+
+    return exceedances
+
+def _permutation_test_worker(arguments):
+    ''' Process pool helper - unpack the arguments for _count_permutation_exceedances. '''
+    return _count_permutation_exceedances(*arguments)
+
+def permutation_tests(values1, values2, resamples, processes = 1, seed = 0):
+    ''' Two-sided permutation test of the difference in means between matching columns of two N1 x K and N2 x K arrays, ignoring NaNs.
+        Each column is shuffled "resamples" times from its own random seed (seed + column index), so results are repeatable however many
+        processes the columns are spread across.  Returns the K p-values. '''
+
+    column_count = values1.shape[1]
+
+    p_values = numpy.empty(column_count)
+    p_values.fill(numpy.nan)
+
+    tasks = []
+    task_columns = []
+
+    for colindex in range(column_count):
+        column1 = values1[:, colindex]
+        column2 = values2[:, colindex]
+        column1 = column1[~numpy.isnan(column1)]
+        column2 = column2[~numpy.isnan(column2)]
+
+        if ((len(column1) == 0) or (len(column2) == 0)): continue
+
+        observed_difference = column1.mean() - column2.mean()
+        tasks.append([numpy.concatenate((column1, column2)), len(column1), observed_difference, resamples, seed + colindex])
+        task_columns.append(colindex)
+
+    if ((processes == 1) or (len(tasks) < 2)):
+        exceedances = [_permutation_test_worker(task) for task in tasks]
+    else:
+        pool = Pool(processes)
+        try:
+            exceedances = pool.map(_permutation_test_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    for taskindex in range(len(tasks)):
+        p_values[task_columns[taskindex]] = (exceedances[taskindex] + 1.0) / (resamples + 1.0)
+
+    return p_values
+
+def holm_corrected_p_values(p_values):
+    ''' Holm-Bonferroni step-down correction for multiple comparisons, treating every non-NaN p-value as one family. '''
+
+    corrected = numpy.empty(len(p_values))
+    corrected.fill(numpy.nan)
+
+    valid = ~numpy.isnan(p_values)
+    count = valid.sum()
+    if (count == 0): return corrected
+
+    valid_p_values = p_values[valid]
+    order = numpy.argsort(valid_p_values)
+
+    adjusted = numpy.maximum.accumulate((count - numpy.arange(count)) * valid_p_values[order])
+
+    valid_corrected = numpy.empty(count)
+    valid_corrected[order] = numpy.minimum(adjusted, 1.0)
+    corrected[valid] = valid_corrected
+
+    return corrected
+
+def benjamini_hochberg_corrected_p_values(p_values):
+    ''' Benjamini-Hochberg false discovery rate correction for multiple comparisons, treating every non-NaN p-value as one family. '''
+
+    corrected = numpy.empty(len(p_values))
+    corrected.fill(numpy.nan)
+
+    valid = ~numpy.isnan(p_values)
+    count = valid.sum()
+    if (count == 0): return corrected
+
+    valid_p_values = p_values[valid]
+    order = numpy.argsort(valid_p_values)
+
+    # Scale each sorted p-value by count / rank, then make the result monotonic from the largest p-value downward.
+    adjusted = valid_p_values[order] * count / numpy.arange(1.0, count + 1)
+    adjusted = numpy.minimum.accumulate(adjusted[::-1])[::-1]
+
+    valid_corrected = numpy.empty(count)
+    valid_corrected[order] = numpy.minimum(adjusted, 1.0)
+    corrected[valid] = valid_corrected
+
+    return corrected
+
+def covariance_ellipsoid_axes(covariances, multiplier = 1):
+    ''' Given a K x 3 x 3 stack of covariance matrices, return the K x 3 x 3 stack of their ellipsoids' semi-axes, using one batched
+        eigen-decomposition.  Each column is a principal direction, scaled to multiplier standard deviations along it.
+        Covariances containing NaN give NaN axes. '''
+
+    valid = ~numpy.isnan(covariances).any(axis=(1, 2))
+
+    [variances, directions] = numpy.linalg.eigh(numpy.where(valid[:, numpy.newaxis, numpy.newaxis], covariances, 0))
+
+    # Guard against tiny negative variances caused by floating point roundoff
+    lengths = multiplier * numpy.sqrt(numpy.maximum(variances, 0))
+
+    axes = directions * lengths[:, numpy.newaxis, :]
+    axes[~valid] = numpy.nan
+
+    return axes
@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+# Author: Sean Lisse
+# Triangulate the row x column fiducial grid of a scan into a surface mesh of the vaginal wall, and measure it: total and per-row surface
+# area, the shape of each row's cross section, and discrete Gaussian and mean curvature at each fiducial.
+#
+# Each cell of the grid - two neighbouring points on one row and the same two columns on the next - becomes two triangles (split along its
+# shorter diagonal), or one if a corner is missing.  The grids of a whole cohort are triangulated together, and every measure is computed
+# over all triangles at once.
+
+import numpy
+
+# Corners of a grid cell, as [row offset, column offset]: the top left and right points, then the bottom left and right.
+CELL_CORNERS = [[0, 0], [0, 1], [1, 0], [1, 1]]
+
+# The four triangles a cell can be split into, as indices into CELL_CORNERS, all wound the same way round.
+# A full cell uses the first two (split top left to bottom right) or the last two (split top right to bottom left);
+# a cell missing one corner uses the single triangle of the other three.
+CELL_TRIANGLES = numpy.array([[0, 1, 3], [0, 3, 2], [0, 1, 2], [1, 3, 2]])
+
+def _row_grid_from_rows(rows, row_count, column_count):
+    ''' Return the R x C x 3 coordinates of a scan's _rows grid (NaN where there is no point) and the R x C grid of its fiducial names. '''
+
+    coords = numpy.empty((row_count, column_count, 3))
+    coords.fill(numpy.nan)
+    names = numpy.empty((row_count, column_count), dtype=object)
+
+    for rowindex in range(len(rows)):
+        for colindex in range(len(rows[rowindex])):
+            # Empty places in the grid hold [] rather than a Fiducial.
+            fid = rows[rowindex][colindex]
+            if fid:
+                coords[rowindex, colindex] = fid.coords[0:3]
+                names[rowindex, colindex] = fid.name
+
+    return [coords, names]
+
+def triangulate_grids(grid_coords):
+    ''' Triangulate N x R x C x 3 stacked row grids (NaN where there is no point).  Returns an N x (R-1) x (C-1) x 4 boolean array saying
+        which of each cell's CELL_TRIANGLES are in that scan's mesh. '''
+
+    rows = grid_coords.shape[1] - 1
+    cols = grid_coords.shape[2] - 1
+
+    corner_coords = [grid_coords[:, rowoffset:rowoffset + rows, coloffset:coloffset + cols] for rowoffset, coloffset in CELL_CORNERS]
+    [top_left, top_right, bottom_left, bottom_right] = [~numpy.isnan(coords).any(axis=-1) for coords in corner_coords]
+
+    full = top_left & top_right & bottom_left & bottom_right
+    with numpy.errstate(invalid='ignore'):
+        split_down = (((corner_coords[3] - corner_coords[0]) ** 2).sum(axis=-1) <= ((corner_coords[2] - corner_coords[1]) ** 2).sum(axis=-1))
+
+    chosen = numpy.empty(full.shape + (4,), dtype=bool)
+    chosen[..., 0] = (full & split_down) | (top_left & top_right & bottom_right & ~bottom_left)
+    chosen[..., 1] = (full & split_down) | (top_left & bottom_right & bottom_left & ~top_right)
+    chosen[..., 2] = (full & ~split_down) | (top_left & top_right & bottom_left & ~bottom_right)
+    chosen[..., 3] = (full & ~split_down) | (top_right & bottom_right & bottom_left & ~top_left)
+
+    return chosen
+
+def _triangle_geometry(vertices, faces):
+    ''' Return [T x 3 x 3 edge vectors opposite each corner, T x 3 corner angles, T triangle areas, T x 3 unit normals]. '''
+
+    corners = vertices[faces]
+
+    # Edge opposite corner i runs from corner i+1 to corner i+2.
+    edges = numpy.roll(corners, -2, axis=1) - numpy.roll(corners, -1, axis=1)
+
+    crosses = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    doubled_areas = numpy.sqrt((crosses ** 2).sum(axis=1))
+
+    # The angle at corner i is between the edges to its two neighbours.
+    to_next = numpy.roll(corners, -1, axis=1) - corners
+    to_previous = numpy.roll(corners, 1, axis=1) - corners
+    cosines = (to_next * to_previous).sum(axis=2)
+    sines = numpy.sqrt((numpy.cross(to_next, to_previous) ** 2).sum(axis=2))
+    angles = numpy.arctan2(sines, cosines)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        normals = crosses / doubled_areas[:, numpy.newaxis]
+
+    return [edges, angles, doubled_areas / 2, normals]
+
+class SurfaceMesh(object):
+    ''' A triangulated surface through the row and column fiducials of one scan. '''
+
+    _vertex_names = None # List of V fiducial names
+    _vertices = None # V x 3 array of fiducial coordinates
+    _vertex_rows = None # V array of each vertex's row number (from 1, at the apex)
+    _vertex_columns = None # V array of each vertex's column number (from 1, at the left)
+    _faces = None # T x 3 array of vertex indices of each triangle, all wound the same way
+    _face_rows = None # T array of the row number of the top of each triangle's grid cell
+
+    def __init__(self, vertex_names, vertices, vertex_rows, vertex_columns, faces, face_rows):
+        self._vertex_names = vertex_names
+        self._vertices = vertices
+        self._vertex_rows = vertex_rows
+        self._vertex_columns = vertex_columns
+        self._faces = faces
+        self._face_rows = face_rows
+
+        [self._edges, self._angles, self._triangle_areas, self._normals] = _triangle_geometry(vertices, faces.reshape((-1, 3)))
+
+    def get_triangle_count(self):
+        return len(self._faces)
+
+    def get_area(self):
+        return self._triangle_areas.sum()
+
+    def get_row_strip_areas(self, row_count = None):
+        ''' Return the area of the strip of surface between each row and the next, as an array indexed by row number - 1. '''
+
+        if (row_count == None): row_count = max([0] + self._vertex_rows.tolist())
+        if (row_count == 0): return numpy.zeros(0)
+
+        return numpy.bincount(self._face_rows - 1, weights=self._triangle_areas, minlength=row_count)[0:row_count]
+
+    def get_vertex_areas(self):
+        ''' Return each vertex's share of the surface - a third of the area of every triangle it is a corner of. '''
+        return numpy.bincount(self._faces.ravel(), weights=numpy.repeat(self._triangle_areas / 3, 3), minlength=len(self._vertices))
+
+    def get_boundary_vertices(self):
+        ''' Return a V boolean array marking the vertices on the edge of the mesh - those on an edge used by only one triangle. '''
+
+        edges = numpy.concatenate([self._faces[:, [0, 1]], self._faces[:, [1, 2]], self._faces[:, [2, 0]]])
+        edges.sort(axis=1)
+
+        edge_keys = edges[:, 0] * len(self._vertices) + edges[:, 1]
+        [unique_keys, counts] = numpy.unique(edge_keys, return_counts=True)
+        boundary_keys = unique_keys[counts == 1]
+
+        boundary = numpy.zeros(len(self._vertices), dtype=bool)
+        boundary[boundary_keys // len(self._vertices)] = True
+        boundary[boundary_keys % len(self._vertices)] = True
+
+        # A vertex no triangle uses is on no surface at all.
+        boundary[numpy.bincount(self._faces.ravel(), minlength=len(self._vertices)) == 0] = True
+
+        return boundary
+
+    def get_vertex_normals(self):
+        ''' Return V x 3 unit normals at each vertex, the area-weighted average of the normals of the triangles around it. '''
+
+        weighted = numpy.where(numpy.isnan(self._normals), 0, self._normals) * self._triangle_areas[:, numpy.newaxis]
+        normals = numpy.zeros((len(self._vertices), 3))
+        for corner in range(3):
+            for axis in range(3):
+                normals[:, axis] += numpy.bincount(self._faces[:, corner], weights=weighted[:, axis], minlength=len(self._vertices))
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return normals / numpy.sqrt((normals ** 2).sum(axis=1))[:, numpy.newaxis]
+
+    def get_gaussian_curvatures(self):
+        ''' Return the discrete Gaussian curvature at each vertex (its angle defect over its share of the area), NaN on the mesh boundary. '''
+
+        angle_sums = numpy.bincount(self._faces.ravel(), weights=self._angles.ravel(), minlength=len(self._vertices))
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            curvatures = (2 * numpy.pi - angle_sums) / self.get_vertex_areas()
+
+        curvatures[self.get_boundary_vertices()] = numpy.nan
+        return curvatures
+
+    def get_mean_curvatures(self):
+        ''' Return the discrete mean curvature at each vertex from the cotangent Laplacian, signed positive where the surface curves
+            toward its normal, and NaN on the mesh boundary. '''
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            cotangents = 1 / numpy.tan(self._angles)
+        cotangents = numpy.where(numpy.isfinite(cotangents), cotangents, 0)
+
+        laplacian = numpy.zeros((len(self._vertices), 3))
+        for corner in range(3):
+            # The angle at each corner weighs the edge opposite it, pulling each end of that edge toward the other.
+            start = self._faces[:, (corner + 1) % 3]
+            end = self._faces[:, (corner + 2) % 3]
+            pull = cotangents[:, corner, numpy.newaxis] * self._edges[:, corner]
+            for axis in range(3):
+                laplacian[:, axis] += numpy.bincount(start, weights=pull[:, axis], minlength=len(self._vertices))
+                laplacian[:, axis] -= numpy.bincount(end, weights=pull[:, axis], minlength=len(self._vertices))
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            laplacian /= (4 * self.get_vertex_areas())[:, numpy.newaxis]
+
+        curvatures = numpy.sqrt((laplacian ** 2).sum(axis=1)) * numpy.sign((laplacian * self.get_vertex_normals()).sum(axis=1))
+        curvatures[self.get_boundary_vertices()] = numpy.nan
+        return curvatures
+
+    def get_row_cross_sections(self):
+        ''' Measure the cross section each row of the grid traces, indexed by row number - 1.  Returns [chords, depths, areas]:
+            the straight-line distance between the row's two ends, how far the row bows out from that line at most, and the area enclosed
+            between the row and that line.  Rows of fewer than two points are NaN. '''
+
+        row_count = max([0] + self._vertex_rows.tolist())
+        column_count = max([0] + self._vertex_columns.tolist())
+
+        grid = numpy.empty((row_count, column_count, 3))
+        grid.fill(numpy.nan)
+        grid[self._vertex_rows - 1, self._vertex_columns - 1] = self._vertices
+
+        return get_row_cross_sections(grid)
+
+def get_row_cross_sections(grid_coords):
+    ''' get_row_cross_sections of SurfaceMesh, for any ... x C x 3 array of rows (NaN where there is no point). '''
+
+    present = ~numpy.isnan(grid_coords).any(axis=-1)
+    counts = present.sum(axis=-1)
+    columns = numpy.arange(grid_coords.shape[-2])
+
+    # Find the first and last point of each row.
+    first = numpy.argmax(present, axis=-1)
+    last = grid_coords.shape[-2] - 1 - numpy.argmax(present[..., ::-1], axis=-1)
+    flat = grid_coords.reshape((-1,) + grid_coords.shape[-2:])
+    flat_indices = numpy.arange(flat.shape[0])
+    starts = flat[flat_indices, first.ravel()].reshape(grid_coords.shape[:-2] + (3,))
+    ends = flat[flat_indices, last.ravel()].reshape(grid_coords.shape[:-2] + (3,))
+
+    chord_vectors = ends - starts
+    chords = numpy.sqrt((chord_vectors ** 2).sum(axis=-1))
+
+    # Each point's offset from the row's start; its perpendicular distance from the chord gives the depth.
+    offsets = grid_coords - starts[..., numpy.newaxis, :]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        depths = numpy.sqrt((numpy.cross(offsets, chord_vectors[..., numpy.newaxis, :]) ** 2).sum(axis=-1)) / chords[..., numpy.newaxis]
+    depths = numpy.where(present, depths, 0).max(axis=-1)
+
+    # The enclosed area is half the magnitude of the summed cross products of successive offsets (a fan from the row's start),
+    # taken over the row's points in order, bridging any missing columns.
+    order = numpy.argsort(~present, axis=-1, kind='mergesort')
+    packed = flat[flat_indices[:, numpy.newaxis], order.reshape((flat.shape[0], -1))] - starts.reshape((-1, 1, 3))
+    fan = numpy.cross(packed[:, :-1], packed[:, 1:])
+    within_row = (columns[numpy.newaxis, 1:] < counts.reshape((-1, 1)))
+    fan = numpy.where(within_row[..., numpy.newaxis], fan, 0).sum(axis=1)
+    areas = (numpy.sqrt((fan ** 2).sum(axis=-1)) / 2).reshape(grid_coords.shape[:-2])
+
+    single = (counts < 2)
+    for measure in [chords, depths, areas]:
+        measure[single] = numpy.nan
+
+    return [chords, depths, areas]
+
+def build_surface_meshes(propslist):
+    ''' Triangulate every scan in propslist together, returning one SurfaceMesh per scan. '''
+
+    row_count = max([len(vag_props._rows) for vag_props in propslist] + [0])
+    column_count = max([len(row) for vag_props in propslist for row in vag_props._rows] + [0])
+
+    grids = [_row_grid_from_rows(vag_props._rows, row_count, column_count) for vag_props in propslist]
+    coords = numpy.array([grid[0] for grid in grids]).reshape((len(propslist), row_count, column_count, 3))
+
+    if (row_count > 1) and (column_count > 1):
+        chosen = triangulate_grids(coords)
+    else:
+        chosen = numpy.zeros((len(propslist), max(row_count - 1, 0), max(column_count - 1, 0), 4), dtype=bool)
+
+    # Grid position of each corner of every candidate triangle, shared by every scan.
+    [cellrows, cellcols] = numpy.meshgrid(numpy.arange(max(row_count - 1, 0)), numpy.arange(max(column_count - 1, 0)), indexing='ij')
+    corner_rows = numpy.array([cellrows + rowoffset for rowoffset, coloffset in CELL_CORNERS])
+    corner_cols = numpy.array([cellcols + coloffset for rowoffset, coloffset in CELL_CORNERS])
+    triangle_positions = (corner_rows * column_count + corner_cols)[CELL_TRIANGLES]   # 4 x 3 x (R-1) x (C-1)
+    triangle_positions = numpy.transpose(triangle_positions, (2, 3, 0, 1))            # (R-1) x (C-1) x 4 x 3
+    triangle_rows = numpy.repeat(cellrows[:, :, numpy.newaxis] + 1, 4, axis=2)
+
+    meshes = []
+    for scanindex in range(len(propslist)):
+        [grid, names] = grids[scanindex]
+        present = ~numpy.isnan(grid).any(axis=-1).ravel()
+
+        # Number the present points in grid order, as the mesh's vertices.
+        vertex_index = numpy.cumsum(present) - 1
+        positions = numpy.flatnonzero(present)
+
+        faces = vertex_index[triangle_positions[chosen[scanindex]]].reshape((-1, 3))
+        face_rows = triangle_rows[chosen[scanindex]]
+
+        meshes.append(SurfaceMesh(names.ravel()[positions].tolist(), grid.reshape((-1, 3))[positions],
+                                  positions // max(column_count, 1) + 1, positions % max(column_count, 1) + 1, faces, face_rows))
+
+    return meshes
+
+def get_surface_meshes(propslist):
+    ''' Return the SurfaceMesh of every scan in propslist.  Each scan keeps its mesh until its fiducials change,
+        and only scans without one are triangulated (all at once). '''
+
+    stale = [vag_props for vag_props in propslist if (vag_props._surface_mesh == None)]
+
+    if (len(stale) > 0):
+        for vag_props, mesh in zip(stale, build_surface_meshes(stale)):
+            vag_props._surface_mesh = mesh
+
+    return [vag_props._surface_mesh for vag_props in propslist]
+
+def get_surface_mesh(vag_props):
+    return get_surface_meshes([vag_props])[0]
@@ -38,3 +38,7 @@ def setdebuglevel(level):
 def rad_to_degrees(radians):
     
     return(radians*180 /pi)
+
+def degrees_to_rad(degrees):
+
+    return(degrees*pi/180)
@@ -3,6 +3,7 @@
 # Define a class to encapsulate a vagina and its display method
 
 from VaginalProperties import VaginalProperties
+from Configuration import DEFAULT_PICS_CONFIGURATION
 from PICS3D_executable.Options import DEFAULT_COLORIZATION_STRATEGY
 
 class VaginalDisplay(VaginalProperties):
@@ -13,8 +14,8 @@ class VaginalDisplay(VaginalProperties):
     # Vaginal width list (indexed by fiducial rows)
     _vagrowcolors = None
     
-    def __init__(self, name, color_strat = DEFAULT_COLORIZATION_STRATEGY ):
-        VaginalProperties.__init__(self, name)
+    def __init__(self, name, color_strat = DEFAULT_COLORIZATION_STRATEGY, configuration = DEFAULT_PICS_CONFIGURATION):
+        VaginalProperties.__init__(self, name, configuration = configuration)
         
         self._color_strategy = color_strat
         self._vagrowcolors=[]
@@ -3,7 +3,7 @@
 
 # Built in library imports
 import collections
-from numpy import Infinity, abs, dot
+from numpy import Infinity, abs, dot, array, matrix, newaxis
 
 # Basic utilities
 from Utilities import debug_levels, debugprint, rad_to_degrees
@@ -11,16 +11,23 @@ from Utilities import debug_levels, debugprint, rad_to_degrees
 # My custom function imports
 from Fiducials import Fiducial, vector_from_fiducials, get_fiducial_row_and_column
 from MRMLSweep import load_fiducials_from_mrml_slicer_v_4_2, load_fiducials_from_mrml_slicer_v_4_3
+from PICSMath import pics_recenter_and_reorient, transform_coords_by_matrix
+from Procrustes import apply_row_transforms
+from Configuration import DEFAULT_PICS_CONFIGURATION
 from VectorMath import vector_magnitude_sum, magnitude, perpendicular_component, parallel_component, NEGLIGABLY_SMALL_NUMBER
 
 # Constants
-from Options import COORDS, CREATE_IIS, AXIS_CODING_IS
+from Options import COORDS
 from Options import LEFT_ISCHIAL_SPINE_NAME, RIGHT_ISCHIAL_SPINE_NAME, INTER_ISCHIAL_SPINE_NAME, PUBIC_SYMPHYSIS_NAME, SC_JOINT_NAME
+from Options import REFERENCE_POINT_NAMES
 
 class VaginalProperties(object):
     ''' This class is used to store information about the bony pelvis and pelvic floor of a particular woman, as determined by imaging. '''
     
     _name = ""
+
+    # The PICSConfiguration this scan is corrected and measured under
+    _configuration = None
     
     # Set of all points defining the vagina
     _fiducial_points = None
@@ -56,10 +63,27 @@ class VaginalProperties(object):
     _pelvic_tilt_correction_angle_about_LR_axis = None
     _pelvic_tilt_correction_angle_about_AP_axis = None
     _pelvic_tilt_correction_angle_about_IS_axis = None
+
+    # Set by pics_recenter_and_reorient: the 4x4 matrix taking raw radiographic coordinates to PICS coordinates (including any scaling),
+    # and the raw coordinates of each fiducial before it was applied.  Used by move_fiducial to update single points.
+    _pics_transform = None
+    _raw_coords = None
+
+    # Set by apply_transform: the 4x4 row-vector transform (e.g. a Procrustes alignment) applied on top of PICS correction, or None if
+    # there is none.  Used by move_fiducial to re-apply it when PICS correction has to be redone.
+    _alignment_transform = None
+
+    # Set by RowResampling.get_resampled_row_fiducials: [point count, OrderedDict of the resampled row fiducials], so that the same
+    # Fiducial objects are collated each time (and can be removed from statistics again).  Cleared whenever the rows change.
+    _resampled_row_fiducials = None
+
+    # Set by SurfaceMesh.get_surface_meshes: the SurfaceMesh triangulating this scan's row grid.  Cleared whenever the rows change.
+    _surface_mesh = None
     
-    def __init__(self, name, fiducials = None):
+    def __init__(self, name, fiducials = None, configuration = DEFAULT_PICS_CONFIGURATION):
         
         self._name = name
+        self._configuration = configuration
         
         if (fiducials == None):
             # Create a dictionary to contain our Fiducial points.  Each point will be indexed by name, and will be a 3-tuple of X,Y,Z values.
@@ -76,7 +100,15 @@ class VaginalProperties(object):
  
     def compute_properties(self):
         ''' Compute the physical properties of the pelvic floor. '''
-        
+
+        # Start the row grid and width table afresh, since we are called again after every PICS transformation.
+        self._rows = []
+        self._vagwidths = []
+        self._vagwidthmin = Infinity
+        self._vagwidthmax = -1 * Infinity
+        self._resampled_row_fiducials = None
+        self._surface_mesh = None
+
         # Compute some basic properties of the pelvic floor based on bony landmarks    
         if (self._fiducial_points.has_key(PUBIC_SYMPHYSIS_NAME) 
             and self._fiducial_points.has_key(LEFT_ISCHIAL_SPINE_NAME) 
@@ -90,7 +122,7 @@ class VaginalProperties(object):
             self._Left_PIS_Vector = vector_from_fiducials(self._Pubic_Symphysis, self._Left_IS)
             self._Right_PIS_Vector = vector_from_fiducials(self._Pubic_Symphysis, self._Right_IS)
         
-            if CREATE_IIS:
+            if self._configuration._create_iis:
                 IIS_coords = (self._Left_IS.coords + self._Right_IS.coords)/2
                 self._IIS = Fiducial(INTER_ISCHIAL_SPINE_NAME, IIS_coords[COORDS.X], IIS_coords[COORDS.Y], IIS_coords[COORDS.Z])
                 self._fiducial_points[INTER_ISCHIAL_SPINE_NAME] = self._IIS
@@ -114,50 +146,16 @@ class VaginalProperties(object):
         
         # Compute paravaginal gap distances
         for key in self._fiducial_points.iterkeys():
-            fid= self._fiducial_points[key]
-            fid.paravaginal_gap = magnitude(get_paravaginal_gap_vector(fid, self))
-            fid.paravaginal_gap_is = get_paravaginal_gap_distance_is(fid, self)
-            fid.paravaginal_gap_horiz = get_paravaginal_gap_distance_horiz(fid, self)
+            self._compute_fiducial_gaps(self._fiducial_points[key])
               
         # Iterate through the Fiducial points and gather those that have a row and column number into "rows"
         for key in self._fiducial_points.iterkeys():
-            
-            rownum,colnum = get_fiducial_row_and_column(self._fiducial_points[key])
-        
-            if ((rownum == None) or (colnum == None)):
-                continue
-        
-            rowindex = int(rownum) - 1
-            colindex = int(colnum) - 1
-        
-            # Expand rows[] to encompass our new row as needed
-            while(len(self._rows) < (rowindex + 1)):
-                self._rows.append([])
-        
-            # Expand rows[][] to encompass our new column as needed
-            while(len(self._rows[rowindex]) < (colindex + 1)):
-                self._rows[int(rowindex)].append([])
-        
-            fid = self._fiducial_points[key]
-            
-            self._rows[rowindex][colindex] = fid
+            self._add_fiducial_to_rows(self._fiducial_points[key])
         
         # Iterate over all the Fiducial points and collect them into a sequence of point-to-point vectors for each row 
         for rowindex in range(0,len(self._rows)):
         
-            columns = self._rows[rowindex]
-            
-            # Our list of vectors from each point to the next in the list, starting leftmost and continuing right.
-            vecs = []
-            
-            for colindex in range(1, len(columns)):
-                # Start at 1 to intentionally skip the first point so we don't underrun when looking at rows[colindex - 1]. 
-                
-                if (columns[colindex-1]) and (columns[colindex]):
-                    # We know we have two non-empty entries, so add a vector from this point to the point before
-                    vecs.append(vector_from_fiducials(columns[colindex - 1], columns[colindex]))
-        
-            new_width = abs(vector_magnitude_sum(vecs))
+            new_width = self._compute_row_width(rowindex)
         
             self._vagwidths.insert(rowindex,new_width)
             
@@ -175,12 +173,164 @@ class VaginalProperties(object):
             if (self._vagwidths[rowindex] > self._globalvagwidthmax):
                 self._globalvagwidthmax = self._vagwidths[rowindex]
             
+    def _compute_fiducial_gaps(self, fid):
+        ''' Compute the three paravaginal gap components of a single fiducial, leaving them None if the scan lacks any of the reference
+        points they are measured from (so that a scan with a missing landmark still loads, for landmark QA to report). '''
+
+        if (self._Pubic_Symphysis == None) or (self._Left_IS == None) or (self._Right_IS == None):
+            fid.paravaginal_gap = fid.paravaginal_gap_is = fid.paravaginal_gap_horiz = None
+            return
+
+        fid.paravaginal_gap = magnitude(get_paravaginal_gap_vector(fid, self))
+        fid.paravaginal_gap_is = get_paravaginal_gap_distance_is(fid, self)
+        fid.paravaginal_gap_horiz = get_paravaginal_gap_distance_horiz(fid, self)
+
+    def _add_fiducial_to_rows(self, fid):
+        ''' Place a fiducial into the "rows" grid by its row and column number, if it has them.  Returns its row index, or None. '''
+
+        rownum,colnum = get_fiducial_row_and_column(fid)
+    
+        if ((rownum == None) or (colnum == None)):
+            return None
+    
+        rowindex = int(rownum) - 1
+        colindex = int(colnum) - 1
+    
+        # Expand rows[] to encompass our new row as needed
+        while(len(self._rows) < (rowindex + 1)):
+            self._rows.append([])
+    
+        # Expand rows[][] to encompass our new column as needed
+        while(len(self._rows[rowindex]) < (colindex + 1)):
+            self._rows[int(rowindex)].append([])
+        
+        self._rows[rowindex][colindex] = fid
+
+        return rowindex
+
+    def _compute_row_width(self, rowindex):
+        ''' Compute the width of one row of the "rows" grid as the sum of the distances between neighbouring points. '''
+
+        columns = self._rows[rowindex]
+        
+        # Our list of vectors from each point to the next in the list, starting leftmost and continuing right.
+        vecs = []
+        
+        for colindex in range(1, len(columns)):
+            # Start at 1 to intentionally skip the first point so we don't underrun when looking at rows[colindex - 1]. 
+            
+            if (columns[colindex-1]) and (columns[colindex]):
+                # We know we have two non-empty entries, so add a vector from this point to the point before
+                vecs.append(vector_from_fiducials(columns[colindex - 1], columns[colindex]))
+    
+        return abs(vector_magnitude_sum(vecs))
+
+    def move_fiducial(self, name, x, y, z):
+        ''' Move the fiducial called name (adding it if it's new) to radiological coordinates x, y, z - i.e. as annotated, before any PICS
+        correction - recomputing only what depends on it.  A row and column fiducial is re-transformed by the stored PICS transform, and
+        only its own gaps and its row's width are recomputed.  Moving a reference landmark (or any point before PICS correction) changes the
+        frame everything else is measured in, so then every point is restored to its raw coordinates and corrected again from scratch.
+        Any alignment transform (e.g. from Procrustes analysis) is then applied again as it was - it is not refit to the moved landmark. '''
+
+        if (name in self._fiducial_points):
+            fid = self._fiducial_points[name]
+        else:
+            fid = Fiducial(name, x, y, z)
+            self._fiducial_points[name] = fid
+
+        raw_coords = array([float(x), float(y), float(z)])
+        rownum = get_fiducial_row_and_column(fid)[0]
+
+        if (self._pics_transform is None):
+            # Nothing has been PICS-corrected yet, so the raw coordinates are the coordinates.
+            fid.coords = raw_coords
+            self.compute_properties()
+            return
+
+        self._raw_coords[name] = raw_coords
+
+        if ((name in REFERENCE_POINT_NAMES) or (rownum == None) or (rownum > len(self._rows))):
+            debugprint("Moving " + name + " changes the PICS frame or row grid, so recomputing everything for " + self._name, debug_levels.DETAILED_DEBUG)
+
+            for fidname, coords in self._raw_coords.iteritems():
+                if (fidname in self._fiducial_points):
+                    self._fiducial_points[fidname].coords = coords.copy()
+
+            alignment_transform = self._alignment_transform
+            self._alignment_transform = None
+
+            pics_recenter_and_reorient(self)
+            if (alignment_transform is not None): self.apply_transform(alignment_transform)
+            return
+
+        fid.coords = transform_coords_by_matrix(raw_coords, self._pics_transform)
+        self._compute_fiducial_gaps(fid)
+
+        rowindex = self._add_fiducial_to_rows(fid)
+        self._vagwidths[rowindex] = self._compute_row_width(rowindex)
+        self._vagwidthmin = min(self._vagwidths)
+        self._vagwidthmax = max(self._vagwidths)
+        self._resampled_row_fiducials = None
+        self._surface_mesh = None
+
+    def apply_transform(self, transform):
+        ''' Move every fiducial of this PICS-corrected scan by a 4 x 4 row-vector transform (see Procrustes), fold the transform into
+        _pics_transform so that move_fiducial places edited points consistently, and recompute the scan's properties. '''
+
+        fidnames = self._fiducial_points.keys()
+        coords = array([self._fiducial_points[fidname].coords[0:3] for fidname in fidnames], dtype=float).reshape((1, -1, 3))
+        moved = apply_row_transforms(coords, transform[newaxis])[0]
+
+        for fidindex in range(len(fidnames)):
+            fid = self._fiducial_points[fidnames[fidindex]]
+            fid.coords = array(moved[fidindex].tolist() + fid.coords[3:].tolist())
+
+        # The PICS transform maps points to [x, y, z, 0], so its last column can't carry our translation through - add it to the last row instead.
+        if (self._pics_transform is not None):
+            self._pics_transform = self._pics_transform * matrix(transform)
+            self._pics_transform[3, 0:3] += transform[3, 0:3]
+
+        if (self._alignment_transform is None):
+            self._alignment_transform = array(transform, dtype=float)
+        else:
+            self._alignment_transform = dot(self._alignment_transform, transform)
+
+        self.compute_properties()
+
+    def copy_raw(self, configuration = None):
+        ''' Return a new, uncorrected VaginalProperties holding copies of this scan's fiducials at their raw radiological coordinates,
+        to be corrected under configuration (or this scan's own configuration if None) - without reloading the scan from disk. '''
+
+        if (configuration == None): configuration = self._configuration
+
+        copy = VaginalProperties(self._name, configuration = configuration)
+
+        for name, fid in self._fiducial_points.iteritems():
+            # Skip the inter-ischial spine point, which compute_properties creates rather than loads.
+            if (name == INTER_ISCHIAL_SPINE_NAME): continue
+
+            coords = fid.coords
+            if (self._raw_coords != None) and (name in self._raw_coords):
+                coords = self._raw_coords[name]
+
+            copy._fiducial_points[name] = Fiducial(fid.name, coords[COORDS.X], coords[COORDS.Y], coords[COORDS.Z])
+
+        copy.compute_properties()
+
+        return copy
+
     def initialize_from_MRML(self, filename):
         ''' Load a set of fiducials from an MRML file.  Try both version 4.2 and version 4.3 formats.'''
         load_fiducials_from_mrml_slicer_v_4_2(filename, self._fiducial_points)
         load_fiducials_from_mrml_slicer_v_4_3(filename, self._fiducial_points)
         self.compute_properties() 
 
+    def initialize_from_coordinates(self, coordinates):
+        ''' Load a set of fiducials from a dictionary of fiducial names to [x, y, z] coordinates, e.g. as sent to the analysis server. '''
+        for name, coords in coordinates.iteritems():
+            self._fiducial_points[name] = Fiducial(name, float(coords[0]), float(coords[1]), float(coords[2]))
+        self.compute_properties()
+
     def to_string(self):
         ''' Converts this object to a string readout. '''
         retstring = ("Vaginal properties.  " + "\n") 
@@ -283,7 +433,7 @@ def get_paravaginal_gap_distance_is(fiducial, vagproperties):
 
     gap_vec = get_paravaginal_gap_vector(fiducial, vagproperties)
         
-    IS_distance = gap_vec[AXIS_CODING_IS]
+    IS_distance = gap_vec[vagproperties._configuration._axis_coding_is]
         
     return IS_distance
 
@@ -297,20 +447,20 @@ def get_paravaginal_gap_distance_horiz(fiducial, vagproperties):
 
     gap_vec = get_paravaginal_gap_vector(fiducial, vagproperties)
     
-    gap_vec[AXIS_CODING_IS] = 0
+    gap_vec[vagproperties._configuration._axis_coding_is] = 0
     
     AP_LR_distance = magnitude(gap_vec)
         
     return AP_LR_distance
 
-def load_vaginal_properties(filenames):
+def load_vaginal_properties(filenames, configuration = DEFAULT_PICS_CONFIGURATION):
     ''' Gather sets of vaginal properties from the filenames provided as arguments, and run them through the PICS standardization process. '''
     
     propslist = []
     for i in range(0,len(filenames)):
         filename = filenames[i]
                     
-        vag_props = VaginalProperties(filename)        
+        vag_props = VaginalProperties(filename, configuration = configuration)        
         vag_props.initialize_from_MRML(filename)
                     
         propslist.append(vag_props) 